@@ -26,12 +26,18 @@ PyInvaders is a simple, python-based clone of the popular game Space Invaders
 
 import sys
 import pygame
-import copy
 import os
-import time
+import gc
 import random
+import cProfile
 from . import gametools as gt
 from . import data
+from . import assets
+from . import audio
+from . import settings
+from . import gpu
+from . import instrumentation
+from . import capture
 from .level_creator import LevelCreator
 
 from os.path import dirname, abspath
@@ -48,28 +54,36 @@ game_dir = dirname(
 )
 FONT_GAME = "/textures/game_font.ttf"
 IMG_ICON = "/icon.png"
+SOUND_TRACK = "/sound/soundtrack.ogg"
 
 class Constants(object): pass
 
+def set_display_mode(size):
+    """open the window with the given size, with vsync if it is enabled and
+       available"""
+    if Constants.vsync:
+        try:
+            return pygame.display.set_mode(size, vsync=1)
+        except pygame.error:
+            print("vsync is not available")
+    return pygame.display.set_mode(size)
+
+def screen_mode(renderer, resolution):
+    """Returns: (window size, True if the frame gets scaled) for a renderer
+                and the resolution setting, the software renderer always
+                shows the 640*480 frame unscaled
+    """
+    if renderer == 'software':
+        return (640, 480), False
+    return resolution, resolution != (640, 480)
+
 class ScreenScaling(object):
     """Experimental up- or downscaling of the screen"""
     def __init__(self):
-        self.size = 640, 480
-        self.scaling = (self.size[0] / Constants.screen_size[0],
-                        self.size[1] / Constants.screen_size[1])
-        self.frame_times = []
-        self.fps_check = gt.Delay(30)
-
-    def get_fps(self):
-        """prints the average fps-rate of the last second"""
-        if self.fps_check.handle():
-            self.frame_times.append(time.time())
-            if len(self.frame_times) > 2:
-                del self.frame_times[0]
-                fps = 30 / (self.frame_times[-1:][0] -
-                            self.frame_times[-2:-1][0])
-                print("{} FPS".format(fps))
-            self.fps_check = gt.Delay(30)
+        self.size = Constants.screen_size
+        self.scaling = (self.size[0] / 640.0,
+                        self.size[1] / 480.0)
+        self.frame = None
 
     def set_size(self, size):
         """set new screen-size"""
@@ -77,37 +91,132 @@ class ScreenScaling(object):
         self.scaling = (size[0] / 640.0,
                         size[1] / 480.0)
         Constants.screen_size = size
-        Constants.screen = pygame.display.set_mode(size)
-
-    def handle(self):
-        """scale the screen"""
-        if Constants.screen_scaling:
-            screenshot = copy.copy(pygame.display.get_surface())
-            surf_size = (int(self.size[0] * self.scaling[0]),
-                         int(self.size[1] * self.scaling[1]))
-            if Constants.smooth_scaling:
-                screenshot = pygame.transform.smoothscale(screenshot, surf_size)
-            else:
-                screenshot = pygame.transform.scale(screenshot, surf_size)
-            screenshot.set_clip((0, 0, self.size[0], self.size[1]))
-            Constants.screen.blit(screenshot, (0, 0))
-        self.get_fps()
+        Constants.screen = set_display_mode(size)
+        self.frame = None
+
+    def active(self):
+        """check if the screen gets scaled to an other size than 640*480"""
+        return Constants.screen_scaling and self.size != (640, 480)
+
+    def screenshot(self):
+        """Returns: a copy of the unscaled 640*480 frame"""
+        if self.active() and self.frame is not None:
+            return self.frame.copy()
+        return pygame.display.get_surface().subsurface(
+            (0, 0, 640, 480)
+        ).copy()
+
+    def copy_frame(self, target):
+        """copy the unscaled 640*480 frame onto a surface of the same size,
+           without allocating a new one
+
+           Args: target -> pygame.Surface
+        """
+        if self.active() and self.frame is not None:
+            target.blit(self.frame, (0, 0))
+        else:
+            target.blit(pygame.display.get_surface(), (0, 0),
+                        (0, 0, 640, 480))
+
+    def handle(self, dirty_rects=None):
+        """scale the screen
+
+           Returns: the areas of the screen, which have to be updated, None
+                    for the whole screen
+
+           Args: dirty_rects -> list of changed areas in the unscaled frame,
+                                None if the whole frame changed
+        """
+        if not self.active() or dirty_rects == []:
+            return dirty_rects
+        #the scaled image overwrites the rendered frame, so keep an unscaled
+        #copy of it to apply partial changes on
+        screen = pygame.display.get_surface()
+        if self.frame is None:
+            self.frame = pygame.Surface((640, 480))
+            dirty_rects = None
+        if dirty_rects is None:
+            self.frame.blit(screen, (0, 0), (0, 0, 640, 480))
+        else:
+            for rect in dirty_rects:
+                self.frame.blit(screen, rect, rect)
+        if Constants.smooth_scaling:
+            pygame.transform.smoothscale(self.frame, self.size, screen)
+        else:
+            pygame.transform.scale(self.frame, self.size, screen)
+        return None
+
+    def present(self, dirty_rects=None):
+        """scale the frame and show it in the window
+
+           Args: dirty_rects -> list of changed areas in the unscaled frame,
+                                None if the whole frame changed
+        """
+        update_rects = self.handle(dirty_rects)
+        if update_rects is None or Constants.renderer != 'dirty':
+            pygame.display.update()
+        elif update_rects:
+            pygame.display.update(update_rects)
+
+    def render_queue(self):
+        """Returns: a RenderQueue, which draws on the screen"""
+        return gt.RenderQueue(gt.get_screen())
+
+def screen_memory():
+    """Returns: dict with the bytes of the display and the cached frames of
+                the scenes
+    """
+    report = {}
+    display = pygame.display.get_surface()
+    if display is not None:
+        report['display'] = gt.surface_bytes(display)
+    if getattr(Scene.upscaler, 'frame', None) is not None:
+        report['unscaled frame'] = gt.surface_bytes(Scene.upscaler.frame)
+    if PauseMenu.OVERLAY is not None:
+        report['pause overlay'] = gt.surface_bytes(PauseMenu.OVERLAY)
+    return report
 
 class Scene(object):
     upscaler = None
     fps_clock = None
+    frames = 0
     menu_background = None
+    needs_menu_background = True
 
     def __init__(self):
         if Scene.upscaler is None:
-            Scene.upscaler = ScreenScaling()
+            if Constants.renderer == 'sdl2':
+                Scene.upscaler = Constants.gpu_screen
+            else:
+                Scene.upscaler = ScreenScaling()
         if Scene.fps_clock is None:
             Scene.fps_clock = pygame.time.Clock()
-        if Scene.menu_background is None:
-            Scene.menu_background = gt.SurfaceSequence()
-            Scene.menu_background.open_images(
+        if Scene.menu_background is None and self.needs_menu_background:
+            Scene.menu_background = assets.manager.images(
                 game_dir + "/textures/menu_background.png", (640, 480)
             )
+        self.idle = False
+        self.events = []
+
+    def get_events(self, timeout=None):
+        """Returns: pygame.event.get()
+
+           In idle mode this blocks until the next event arrives or the
+           timeout (milliseconds, default Constants.idle_timeout) runs out.
+
+           Args: timeout -> maximal time to wait in idle mode
+        """
+        if not self.idle:
+            self.events = pygame.event.get()
+            return self.events
+        if timeout is None:
+            timeout = Constants.idle_timeout
+        event = pygame.event.wait(max(int(timeout), 1))
+        if event.type == pygame.NOEVENT:
+            self.events = []
+        else:
+            self.events = [event] + pygame.event.get()
+        return self.events
 
     def check_for_exit(self, events):
         """test if the window gets closed and exit the game
@@ -119,19 +228,67 @@ class Scene(object):
                 print('EXIT')
                 sys.exit()
 
-    def scene_basics(self):
-        """Update the screen, scale it and manage the fps"""
-        self.upscaler.handle()
-        pygame.display.update()
-        self.fps_clock.tick(Constants.fps)
+    def print_fps(self):
+        """prints the average fps-rate every 30 frames, if profiling is
+           enabled"""
+        Scene.frames += 1
+        if Constants.profiling and Scene.frames % 30 == 0:
+            print("{} FPS".format(self.fps_clock.get_fps()))
+
+    def scene_basics(self, dirty_rects=None):
+        """Update the screen, scale it and manage the fps
+
+           Args: dirty_rects -> list of changed areas of the screen, None if
+                                the whole screen changed
+        """
+        with instrumentation.span('audio', 'scene'):
+            Constants.sounds.flush()
+            Constants.music.update()
+        with instrumentation.span('present', 'scene'):
+            self.upscaler.present(dirty_rects)
+        if instrumentation.hooked('present'):
+            instrumentation.emit('present', self.upscaler)
+        #without input, held keys and changes on the screen the next frame
+        #can wait for an event
+        self.idle = (dirty_rects == [] and not self.events and
+                     not Constants.music.fading_out and
+                     not any(pygame.key.get_pressed()))
+        with instrumentation.span('wait', 'scene'):
+            self.fps_clock.tick(Constants.fps)
+        self.print_fps()
+
+class LoadingScreen(Scene):
+    """shows a progress bar, while the assets get decoded in the background"""
+    needs_menu_background = False
+
+    def main(self):
+        """wait until all required assets are ready"""
+        text = Constants.menu_font.render("Loading", 8,
+                                          Constants.colour_headline)
+        bar = pygame.Rect(120, 300, 400, 24)
+        screen = gt.get_screen()
+        while not assets.manager.ready():
+            event_list = pygame.event.get()
+            self.check_for_exit(event_list)
+            finished, total = assets.manager.progress()
+            screen.fill((0, 0, 0))
+            screen.blit(text, (160, 160))
+            pygame.draw.rect(screen, Constants.colour_passive, bar, 2)
+            progress = bar.inflate(-8, -8)
+            progress.width = progress.width * finished // max(total, 1)
+            screen.fill(Constants.colour_active, progress)
+            self.scene_basics()
 
 class PauseMenu(Scene):
+    OVERLAY = None
+
     def main(self):
         """pause the game and give the choice to continue or leave"""
-        screenshot = copy.copy(pygame.display.get_surface()) #copy the screen
-        surface = pygame.Surface((640, 480), (pygame.SRCALPHA))
-        surface.fill((0, 0, 0, 200))
-        screenshot.blit(surface, (0, 0))
+        if PauseMenu.OVERLAY is None:
+            PauseMenu.OVERLAY = pygame.Surface((640, 480), pygame.SRCALPHA)
+            PauseMenu.OVERLAY.fill((0, 0, 0, 200))
+        screenshot = self.upscaler.screenshot()
+        screenshot.blit(self.OVERLAY, (0, 0))
         background = gt.SurfaceSequence()
         background.add_surface(screenshot)
         menu = gt.Menu(Constants.menu_font, background, Constants.colour_active,
@@ -140,28 +297,36 @@ class PauseMenu(Scene):
         menu.add_button("Return", (100, 140))
         menu.add_button("Quit", (100, 220))
         while True:
-            event_list = pygame.event.get()
+            event_list = self.get_events()
             self.check_for_exit(event_list)
             action = menu.handle(event_list, Constants.game_sound)
             if action == 1:
                 break
             elif action == 2:
                 return True
-            self.scene_basics()
+            self.scene_basics(menu.dirty_rects)
 
 class Game(Scene):
     """the main game"""
     EXPLOSION_SOUND = None
     SHOT_SOUND = None
-
-    def __init__(self):
+    #layers of the render queue
+    LAYER_BACKGROUND = 0
+    LAYER_INVADERS = 1
+    LAYER_MISSILES = 2
+    LAYER_EXPLOSIONS = 3
+    LAYER_PLAYER = 4
+    LAYER_HUD = 5
+    LAYER_TRACKERS = 6
+
+    def __init__(self, level_list=None):
         super().__init__()
         if Game.EXPLOSION_SOUND is None:
-            Game.EXPLOSION_SOUND = gt.load_sound(
+            Game.EXPLOSION_SOUND = assets.manager.sound(
                 game_dir + "/sound/explosion.ogg"
             )
         if Game.SHOT_SOUND is None:
-            Game.SHOT_SOUND = gt.load_sound(
+            Game.SHOT_SOUND = assets.manager.sound(
                 game_dir + "/sound/shot.ogg"
             )
         self.player = data.Spaceship((320, 440))
@@ -169,42 +334,47 @@ class Game(Scene):
         self.background.add_images(
             game_dir + "/textures/background.png", (640, 480)
         )
-        self.level_list = data.LevelList()
+        if level_list is None:
+            level_list = data.LevelList()
+        self.level_list = level_list
         self.live_bar = data.LiveBar((370, 20))
         self.score = data.Score((580, 20))
-        self.invaders = []
+        self.invaders = data.Formation()
         self.missiles = []
         self.trackers = []
         self.explosions = []
+        self.shots = 0
         self.level = 0
         self.game_over = False
-        self.go_delay = gt.Delay(45)
-        self.iv_down = gt.Delay(100)
+        #timers of the last game never expire in this one
+        gt.timers.clear()
+        self.go_delay = None
+        self.iv_down = gt.timers.start(100)
         self.iv_direction = random.choice(('LEFT', 'RIGHT'))
-        self.screen = pygame.display.get_surface()
+        self.screen = gt.get_screen()
+        self.render_queue = self.upscaler.render_queue()
+        self.screen_rect = pygame.Rect(0, 0, 640, 480)
 
     def add_explosion(self, position):
         """add an explosion to the given rect/position"""
         if Constants.game_sound:
-           self.EXPLOSION_SOUND.play()
+            Constants.sounds.play(self.EXPLOSION_SOUND)
         self.explosions.append(data.Explosion(position[:2]))
 
     def add_missile(self, position, direction):
         """add a missile to the given rect/position"""
         if Constants.game_sound:
-           self.SHOT_SOUND.play()
+            Constants.sounds.play(self.SHOT_SOUND)
         self.missiles.append(data.Missile(position[:2], direction))
 
     def handle_missile(self, missile):
         missile.move()
         if (missile.rect.colliderect(self.player.rect) and
             missile.direction == 'down'):
-            player_surface = self.player.surface.handle(copy=True)
-            player_surface = pygame.transform.scale(player_surface,
-                                                    (32, 32))
-            self.trackers.append(data.Tracker(player_surface,
+            self.trackers.append(data.Tracker(self.player.get_surface(),
                                             self.player.rect,
-                                            self.live_bar.left_pos))
+                                            self.live_bar.left_pos,
+                                            (32, 32)))
             return False
 
         for invader in self.invaders:
@@ -212,15 +382,13 @@ class Game(Scene):
                 missile.direction == 'up'):
                 self.invaders.remove(invader)
                 self.add_explosion(invader.rect.center)
-                self.trackers.append(data.Tracker(invader.surface.handle(),
+                self.trackers.append(data.Tracker(invader.get_surface(),
                                                 invader.rect,
                                                 self.score.position))
                 return False
 
-        if missile.rect.y < 0 or missile.rect.y > 480:
-            return False
-
-        self.screen.blit(*missile.get_data())
+        self.render_queue.add(*missile.get_data(),
+                              layer=self.LAYER_MISSILES)
 
         return True
 
@@ -250,88 +418,273 @@ class Game(Scene):
     def handle_invaders(self):
         """move and render all invaders"""
         direction = self.get_invader_direction()
-        if self.iv_down.handle():
-            self.iv_down = gt.Delay(100)
+        if self.iv_down.expired():
+            self.iv_down.restart(100)
             iv_ymove = 32
         else:
             iv_ymove = 0
+        self.invaders.move(iv_ymove)
+        #the invaders can hit the player or the ground only, when the lowest
+        #row reached the player zone
+        zone = min(self.player.rect.top, 460)
+        check_hits = self.invaders.reached(zone)
 
         for invader in self.invaders:
             invader.move(iv_ymove, direction)
-            if invader.shoot(self.invaders):
+            if invader.armed and invader.shoot(self.invaders):
                 missile_position = list(invader.rect.center)
                 missile_position[1] += 16
                 self.add_missile(missile_position, 'down')
-            if (invader.rect.colliderect(self.player.rect) or
-                invader.rect[1] > 460):
-                self.game_over = True
-                self.go_delay = gt.Delay(0)
-            self.screen.blit(*invader.get_data())
+            if check_hits and (invader.rect.colliderect(self.player.rect) or
+                               invader.rect[1] > 460):
+                self.end_game(0)
+            self.render_queue.add(*invader.get_data(),
+                                  layer=self.LAYER_INVADERS)
+
+    def cull(self):
+        """remove off-screen and finished entities, before they get tested
+           for collisions or rendered in this tick"""
+        trackers = []
+        for tracker in self.trackers:
+            if tracker.dest_reached():
+                self.tracker_arrived(tracker)
+            else:
+                trackers.append(tracker)
+        missiles = [missile for missile in self.missiles
+                    if self.screen_rect.colliderect(missile.rect)]
+        #after the trackers, which may add an explosion
+        explosions = [explosion for explosion in self.explosions
+                      if not explosion.finished()]
+        if instrumentation.hooked('cull'):
+            instrumentation.emit('cull', gt.clock.tick, {
+                'missiles': (len(missiles),
+                             len(self.missiles) - len(missiles)),
+                'explosions': (len(explosions),
+                               len(self.explosions) - len(explosions)),
+                'trackers': (len(trackers),
+                             len(self.trackers) - len(trackers)),
+            })
+        self.missiles[:] = missiles
+        self.explosions[:] = explosions
+        self.trackers[:] = trackers
 
     def handle_explosions(self):
         """render all explosions"""
         for explosion in self.explosions:
-            if explosion.finished():
-                self.explosions.remove(explosion)
-            self.screen.blit(*explosion.get_data())
+            self.render_queue.add(*explosion.get_data(),
+                                  layer=self.LAYER_EXPLOSIONS)
+
+    def tracker_arrived(self, tracker):
+        """deduct a live or add a point, when a tracker reached the live bar
+           or the score"""
+        if tracker.destination == self.live_bar.left_pos:
+            if self.live_bar.deduct():
+                self.end_game(45)
+                self.add_explosion(self.player.rect.center)
+        elif tracker.destination == self.score.position:
+            self.score.add_score()
+
+    def end_game(self, ticks):
+        """the game is over, the game over screen follows after the number
+           of ticks"""
+        if not self.game_over:
+            self.game_over = True
+            self.go_delay = gt.timers.start(ticks)
+        elif ticks + 1 < self.go_delay.remaining():
+            self.go_delay.restart(ticks)
 
     def handle_trackers(self):
         """render all trackers"""
         for tracker in self.trackers:
-            self.screen.blit(*tracker.get_data())
-            if tracker.dest_reached():
-                if tracker.destination == self.live_bar.left_pos:
-                    if self.live_bar.deduct():
-                        self.game_over = True
-                        self.add_explosion(self.player.rect.center)
-                elif tracker.destination == self.score.position:
-                    self.score.add_score()
-                self.trackers.remove(tracker)
+            self.render_queue.add(*tracker.get_data(),
+                                  layer=self.LAYER_TRACKERS)
 
     def handle_player(self):
         """move and render the player"""
         if not self.game_over:
-            self.player.move((50, 590))
-            if self.player.shoot():
+            #the controls may be a policy, which must run once per tick
+            pressed_keys = self.player.controls()
+            self.player.move((50, 590), pressed_keys)
+            if self.player.shoot(pressed_keys):
+                self.shots += 1
                 missile_position = list(self.player.rect.center)
                 missile_position[1] -= 32
                 self.add_missile(missile_position, 'up')
-            self.screen.blit(*self.player.get_data())
+            self.render_queue.add(*self.player.get_data(),
+                                  layer=self.LAYER_PLAYER)
+
+    def memory(self):
+        """Returns: dict with the bytes of the entity lists and the
+                    semi transparent copies of the trackers
+        """
+        return {
+            'invaders': instrumentation.object_bytes(self.invaders),
+            'missiles': instrumentation.object_bytes(self.missiles),
+            'explosions': instrumentation.object_bytes(self.explosions),
+            'trackers': instrumentation.object_bytes(self.trackers),
+            'tracker surfaces': data.ghost_memory(),
+        }
+
+    def safe_point(self):
+        """collect the garbage between two levels
+
+           If gc_freeze is enabled, the surviving objects are frozen and the
+           collector stays disabled until the next level starts, so it never
+           interrupts a wave.
+        """
+        if not Constants.gc_freeze:
+            return
+        with instrumentation.span('collect garbage'):
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+        gc.disable()
 
     def main(self):
         """the game"""
+        if Constants.game_sound:
+            Constants.music.play('game')
+        instrumentation.add_memory_source('entities', self.memory)
+        try:
+            self.play()
+        finally:
+            instrumentation.remove_memory_source('entities')
+            if Constants.gc_freeze:
+                gc.unfreeze()
+                gc.enable()
+        if Constants.game_sound:
+            Constants.music.play('menu')
+
+    def save_score(self):
+        """add the score and the reached level to the highscores"""
+        level = ""
+        if self.level:
+            level = self.level_list[self.level - 1].name
+        data.Highscore().check_highscore(self.score.score, level=level)
+
+    def step(self):
+        """advance the game by one tick, the frame is left in the render
+           queue"""
+        gt.timers.run()
+        with instrumentation.span('cull'):
+            self.cull()
+        self.render_queue.add(*self.background.get_data(),
+                              layer=self.LAYER_BACKGROUND)
+        with instrumentation.span('invaders'):
+            self.handle_invaders()
+        with instrumentation.span('missiles'):
+            self.handle_missiles()
+        self.handle_explosions()
+        self.handle_player()
+        with instrumentation.span('hud'):
+            self.render_queue.add(*self.live_bar.get_data(),
+                                  layer=self.LAYER_HUD)
+            self.render_queue.add(*self.score.get_data(),
+                                  layer=self.LAYER_HUD)
+        self.handle_trackers()
+        gt.clock.advance()
+
+    def fast_forward(self, max_ticks):
+        """skip the ticks until the next event without rendering them
+
+           Ticks can be skipped, while nothing but the formation and the
+           missiles of the invaders moves: no trackers or missiles of the
+           player exist, the controls of the player are declared idle
+           (Spaceship.always_idle) and the formation is above the player
+           zone. The next event is the first expiring timer (an
+           invader shot, the next descent), the formation reaching an edge
+           or a missile reaching the player or the bottom of the screen.
+           The invaders and missiles are moved by the distance of all
+           skipped ticks at once. The 'cull' and 'frame' events of the
+           skipped ticks are not emitted. The controls are not called, so
+           a stateful policy never gets fast forwarded.
+
+           Returns: the number of skipped ticks, 0 if the next tick has to be
+                    stepped
+
+           Args: max_ticks -> maximal number of ticks to skip
+        """
+        if (self.game_over or not self.invaders or self.trackers or
+                not self.player.always_idle):
+            return 0
+        if self.invaders.reached(min(self.player.rect.top, 460)):
+            return 0
+        ticks = max_ticks
+        deadline = gt.timers.next_deadline()
+        if deadline is not None:
+            #the timer expires on the tick after its deadline
+            ticks = min(ticks, deadline + 1 - gt.clock.tick)
+        player = self.player.rect
+        for missile in self.missiles:
+            if missile.direction != 'down':
+                return 0
+            #culled at the start of the first tick below the screen
+            ticks = min(ticks, -(-(480 - missile.rect.top) // 9))
+            if (missile.rect.left < player.right and
+                    missile.rect.right > player.left and
+                    missile.rect.top < player.bottom):
+                #hits the player after the move of a tick
+                ticks = min(ticks, (player.top - missile.rect.bottom) // 9)
+        left = min(invader.rect.center[0] for invader in self.invaders)
+        right = max(invader.rect.center[0] for invader in self.invaders)
+        xmove = 0
+        if not (left < 40 and right > 600):
+            #the direction stays the same, until the check at the start of a
+            #tick finds an invader behind the edge
+            if self.iv_direction == 'RIGHT':
+                edge = 600 - right
+                xmove = 2
+            else:
+                edge = left - 40
+                xmove = -2
+            ticks = min(ticks, edge // 2 + 1 if edge >= 0 else 0)
+        if ticks <= 0:
+            return 0
+        with instrumentation.span('fast forward', args={'ticks': ticks}):
+            for invader in self.invaders:
+                invader.rect[0] += xmove * ticks
+            for missile in self.missiles:
+                missile.rect[1] += 9 * ticks
+            gt.clock.advance(ticks)
+        return ticks
+
+    def play(self):
+        """the game loop, returns when the game is over or left"""
         while True:
             event_list = pygame.event.get()
             self.check_for_exit(event_list)
 
             if gt.check_for_keydown(pygame.K_ESCAPE, event_list):
                 if PauseMenu().main():
-                    data.Highscore().check_highscore(self.score.score)
+                    self.save_score()
                     break
 
             if self.game_over:
-                if self.go_delay.handle():
+                if self.go_delay.expired():
                     GameOver().main()
-                    data.Highscore().check_highscore(self.score.score)
+                    self.save_score()
                     break
 
             if self.invaders == []:
                 if self.level_list.exist_level(self.level):
                     self.invaders = self.level_list[self.level].get_invaders()
                     self.level += 1
+                    self.safe_point()
+                    instrumentation.instant('level', args={
+                        'level': self.level_list[self.level - 1].name
+                    })
                 else:
-                    data.Highscore().check_highscore(self.score.score)
+                    self.save_score()
                     break
 
-            self.screen.blit(*self.background.get_data())
-            self.handle_invaders()
-            self.handle_missiles()
-            self.handle_explosions()
-            self.handle_player()
-            self.screen.blit(*self.live_bar.get_data())
-            self.screen.blit(*self.score.get_data())
-            self.handle_trackers()
-
+            if instrumentation.hooked('frame start'):
+                instrumentation.emit('frame start', gt.clock.tick)
+            with instrumentation.span('step'):
+                self.step()
+            with instrumentation.span('render'):
+                self.render_queue.flush()
+            if instrumentation.hooked('frame end'):
+                instrumentation.emit('frame end', gt.clock.tick)
             self.scene_basics()
 
 class GameOver(Scene):
@@ -339,32 +692,28 @@ class GameOver(Scene):
         """Simple image, exit to the main menu after 5 seconds"""
         gameover_image = data.StaticObject((0, 0))
         gameover_image.add_images(game_dir + '/textures/gameover.png', (640, 480))
-        time_to_continue = 150
-        while time_to_continue:
-            event_list = pygame.event.get()
+        end_time = pygame.time.get_ticks() + 5000
+        dirty_rects = None
+        while pygame.time.get_ticks() < end_time:
+            event_list = self.get_events(
+                min(end_time - pygame.time.get_ticks(),
+                    Constants.idle_timeout)
+            )
             self.check_for_exit(event_list)
-            Constants.screen.blit(*gameover_image.get_data())
+            if dirty_rects is None:
+                Constants.screen.blit(*gameover_image.get_data())
 
             if gt.check_for_keydown(pygame.K_ESCAPE, event_list):
                 break
 
-            time_to_continue -= 1
-            self.scene_basics()
+            self.scene_basics(dirty_rects)
+            dirty_rects = []
 
 class OptionsMenu(Scene):
-
-    SOUND_TRACK = None
-
-    def __init__(self):
-        super().__init__()
-        if OptionsMenu.SOUND_TRACK is None:
-            OptionsMenu.SOUND_TRACK = gt.load_sound(
-                game_dir + "/sound/soundtrack.ogg"
-            )
-
     def main(self):
         """menu, with various options"""
-        resolution_string = "%d*%d" % Constants.screen_size
+        game_settings = Constants.settings
+        resolution_string = "%d*%d" % game_settings.resolution
         menu = gt.Menu(Constants.menu_font, self.menu_background,
                        Constants.colour_active, Constants.colour_passive)
         menu.add_text("Options", (160, 20), Constants.colour_headline)
@@ -375,40 +724,50 @@ class OptionsMenu(Scene):
         menu.add_button(resolution_string, (350, 190))
         menu.add_button(str(Constants.smooth_scaling), (350, 270))
         while True:
-            event_list = pygame.event.get()
+            event_list = self.get_events()
             self.check_for_exit(event_list)
 
             action = menu.handle(event_list, Constants.game_sound)
             if action == 1:
                 if Constants.game_sound:
-                    self.SOUND_TRACK.stop()
+                    Constants.music.stop()
                 else:
-                    self.SOUND_TRACK.play(loops=-1)
+                    Constants.music.play('menu')
                 Constants.game_sound = not Constants.game_sound
+                game_settings.set('sound', Constants.game_sound)
                 menu.change_button(str(Constants.game_sound), (350, 110), 1)
 
             elif action == 2:
-                resolutions = ((640, 480), (800, 600), (1024, 768), (1280, 960))
-                reso_index = resolutions.index(Constants.screen_size)
-                if reso_index == 0:
-                    Constants.screen_scaling = True
-                    self.upscaler.set_size((800, 600))
-                elif 0 < reso_index < 3:
-                    self.upscaler.set_size(resolutions[reso_index + 1])
-                elif reso_index == 3:
-                    Constants.screen_scaling = False
-                    self.upscaler.set_size((640, 480))
-                resolution_string = "%d*%d" % Constants.screen_size
+                resolutions = settings.RESOLUTIONS
+                if game_settings.resolution in resolutions:
+                    reso_index = resolutions.index(game_settings.resolution)
+                else:
+                    reso_index = -1
+                resolution = resolutions[(reso_index + 1) % len(resolutions)]
+                game_settings.set('resolution', resolution)
+                size, Constants.screen_scaling = screen_mode(
+                    Constants.renderer, resolution
+                )
+                if size != Constants.screen_size:
+                    self.upscaler.set_size(size)
+                    Constants.screen_size = size
+                resolution_string = "%d*%d" % resolution
                 menu.change_button(resolution_string, (350, 190), 2)
+                menu.invalidate()
 
             elif action == 3:
                 Constants.smooth_scaling = not Constants.smooth_scaling
+                game_settings.set('scaling_filter',
+                                  settings.SCALING_FILTERS[
+                                      Constants.smooth_scaling])
                 menu.change_button(str(Constants.smooth_scaling), (350, 270), 3)
 
             if gt.check_for_keydown(pygame.K_ESCAPE, event_list):
+                if game_settings.stored:
+                    game_settings.save()
                 break
 
-            self.scene_basics()
+            self.scene_basics(menu.dirty_rects)
 
 class ScoreMenu(Scene):
     def main(self):
@@ -419,12 +778,12 @@ class ScoreMenu(Scene):
         for score, number in zip(data.Highscore().scores, range(5)):
             menu.add_text(str(score), (120, number * 65 + 100))
         while True:
-            event_list = pygame.event.get()
+            event_list = self.get_events()
             self.check_for_exit(event_list)
             menu.handle(event_list, Constants.game_sound)
             if gt.check_for_keydown(pygame.K_ESCAPE, event_list):
                 break
-            self.scene_basics()
+            self.scene_basics(menu.dirty_rects)
 
 class MainMenu(Scene):
     def main(self):
@@ -437,7 +796,7 @@ class MainMenu(Scene):
         menu.add_button("Options", (125, 270))
         menu.add_button("Exit", (125, 350))
         while True:
-            event_list = pygame.event.get()
+            event_list = self.get_events()
             self.check_for_exit(event_list)
             action = menu.handle(event_list, Constants.game_sound)
 
@@ -449,48 +808,147 @@ class MainMenu(Scene):
                 OptionsMenu().main()
             elif action == 4:
                 break
-            self.scene_basics()
+            if action:
+                #an other scene used the screen
+                menu.invalidate()
+                continue
+            self.scene_basics(menu.dirty_rects)
 
 class PyInvaders2(object):
-    def __init__(self):
-        pygame.mixer.pre_init(44100, -16, 1, 512)
+    """The game application
+
+       Args: game_settings -> settings.Settings, default are the settings
+                              of the config file and the environment
+    """
+    def __init__(self, game_settings=None):
+        if game_settings is None:
+            game_settings = settings.load()
+        Constants.settings = game_settings
+        if game_settings.headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+        pygame.mixer.pre_init(44100, -16, 1, game_settings.audio_buffer)
         pygame.init()
-
-        Constants.screen_size = 640, 480
-        Constants.screen = pygame.display.set_mode(Constants.screen_size)
-        Constants.screen_scaling = True
-        Constants.smooth_scaling = False
+        if game_settings.headless:
+            Constants.sounds = audio.NullSoundManager()
+            Constants.music = audio.NullMusicPlayer()
+        else:
+            Constants.sounds = audio.create_sound_manager()
+            Constants.music = audio.create_music_player()
+        Constants.music.add_playlist('menu', [game_dir + SOUND_TRACK])
+        Constants.music.add_playlist('game', [game_dir + SOUND_TRACK])
+
+        Constants.renderer = game_settings.renderer
+        Constants.vsync = game_settings.vsync
+        Constants.smooth_scaling = game_settings.scaling_filter == 'smooth'
+        Constants.screen_size, Constants.screen_scaling = screen_mode(
+            Constants.renderer, game_settings.resolution
+        )
+        if Constants.renderer == 'sdl2':
+            try:
+                Constants.gpu_screen = gpu.GPUScreen(
+                    Constants.screen_size, Constants.vsync,
+                    Constants.smooth_scaling
+                )
+            except (pygame.error, RuntimeError) as error:
+                print("sdl2 renderer is not available: {}".format(error))
+                Constants.renderer = 'dirty'
+        if Constants.renderer == 'sdl2':
+            Constants.screen = Constants.gpu_screen.canvas
+            gt.set_screen(Constants.screen)
+        else:
+            Constants.screen = set_display_mode(Constants.screen_size)
         Constants.font_path = game_dir + FONT_GAME
         if not os.path.isfile(Constants.font_path):
             gt.messagebox("couldn't load {}".format(FONT_GAME))
             sys.exit()
-        Constants.game_sound = False
-        Constants.fps = 30
+        Constants.game_sound = game_settings.sound
+        Constants.fps = game_settings.fps
+        Constants.idle_timeout = 500
+        Constants.profiling = game_settings.profiling
+        Constants.gc_freeze = game_settings.gc_freeze
 
         icon_path = game_dir + IMG_ICON
         if not os.path.isfile(icon_path):
             gt.messagebox("couldn't load {}".format(IMG_ICON))
             sys.exit()
-        screen_icon = pygame.image.load(icon_path).convert_alpha()
+        screen_icon = gt.convert_alpha(pygame.image.load(icon_path))
         screen_icon = pygame.transform.scale(screen_icon, (32, 32))
-        pygame.display.set_icon(screen_icon)
-        pygame.display.set_caption("PyInvaders2")
+        if Constants.renderer == 'sdl2':
+            Constants.gpu_screen.window.set_icon(screen_icon)
+        else:
+            pygame.display.set_icon(screen_icon)
+            pygame.display.set_caption("PyInvaders2")
         #colours
         Constants.colour_headline = (55, 225, 0)
         Constants.colour_active = (255, 150, 0)
         Constants.colour_passive = (100, 60, 0)
         #Fonts
         Constants.menu_font = pygame.font.Font(Constants.font_path, 70)
+        instrumentation.add_memory_source('screen', screen_memory)
+        assets.manager.set_budget(game_settings.memory_budget * 1024 * 1024)
+        assets.manager.preload()
 
     def main(self):
+        LoadingScreen().main()
+        gt.ButtonGroup.CLICK_SOUND = assets.manager.sound(
+            game_dir + "/sound/click.ogg"
+        )
+        if Constants.game_sound:
+            Constants.music.play('menu')
         main_menu = MainMenu()
         main_menu.main()
 
 def levelcreator():
     LevelCreator().main()
 
-def game():
-    PyInvaders2().main()
+def game(argv=None):
+    """start the game with the settings of the command line"""
+    if argv is None:
+        argv = sys.argv[1:]
+    game_settings = settings.load(argv)
+    if game_settings.trace_output:
+        instrumentation.start_tracing(game_settings.trace_output)
+    allocations = None
+    if game_settings.allocation_report:
+        allocations = instrumentation.AllocationTracker()
+        allocations.start()
+    recorder = None
+    if game_settings.record_output:
+        recorder = capture.FrameRecorder(game_settings.record_output,
+                                         game_settings.fps,
+                                         game_settings.record_buffers)
+        if not recorder.start():
+            recorder = None
+    try:
+        if game_settings.profiling:
+            profile(game_settings)
+        else:
+            PyInvaders2(game_settings).main()
+    finally:
+        if recorder is not None:
+            recorder.stop()
+            print(recorder.summary())
+        instrumentation.stop_tracing()
+        if allocations is not None:
+            allocations.stop()
+            print(allocations.summary(game_settings.allocation_report))
+
+def profile(game_settings):
+    """run the game with cProfile and print the statistics of the
+       instrumentation at the end"""
+    culling_stats = instrumentation.CullingStats()
+    instrumentation.add_hook('cull', culling_stats)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        PyInvaders2(game_settings).main()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(game_settings.profile_output)
+        print(culling_stats.summary())
+        print(instrumentation.format_memory_report())
+        print("Wrote profile to {}".format(game_settings.profile_output))
 
 if __name__ == "__main__":
     game()
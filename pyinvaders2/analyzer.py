@@ -0,0 +1,377 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+
+"""
+This module estimates the difficulty of levels by playing them headlessly
+
+Every level is played many times by scripted player policies in a pool of
+worker processes. The report contains the rate of cleared runs, the time to
+clear the level, the shots fired, the hit rate and the peak number of
+entities, and flags levels that are too hard or create too many entities.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import multiprocessing
+from collections import namedtuple
+import pygame
+from . import level_codec
+from . import writer
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+#ticks per second of the game with the default settings
+TICKS_PER_SECOND = 30
+
+RunResult = namedtuple(
+    "RunResult",
+    "level policy seed cleared lost ticks shots kills invaders lives_lost "
+    "peak_entities"
+)
+
+class PressedKeys(frozenset):
+    """The keys pressed by a policy, they can be read like the result of
+       pygame.key.get_pressed()"""
+    def __getitem__(self, key):
+        return key in self
+
+class IdlePolicy(object):
+    """Never moves or shoots, shows how fast a level overruns the player
+
+       Args: rng -> random.Random of this run
+    """
+    #the game may skip ticks without asking this policy
+    idle = True
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def __call__(self, game):
+        return PressedKeys()
+
+class RandomPolicy(object):
+    """Moves in random directions and shoots at random times
+
+       Args: rng -> random.Random of this run
+    """
+    def __init__(self, rng):
+        self.rng = rng
+        self.direction = None
+
+    def __call__(self, game):
+        if self.rng.random() < 0.1:
+            self.direction = self.rng.choice((pygame.K_LEFT, pygame.K_RIGHT,
+                                              None))
+        keys = [self.direction]
+        if self.rng.random() < 0.5:
+            keys.append(pygame.K_SPACE)
+        return PressedKeys(keys)
+
+class AimPolicy(object):
+    """Moves below the lowest invader, evades missiles above the spaceship
+       and shoots all the time
+
+       Args: rng -> random.Random of this run
+    """
+    def __init__(self, rng):
+        self.rng = rng
+
+    def __call__(self, game):
+        player = game.player.rect
+        keys = [pygame.K_SPACE]
+        threats = [missile.rect.centerx for missile in game.missiles
+                   if missile.direction == 'down' and
+                   0 < player.top - missile.rect.bottom < 120 and
+                   abs(missile.rect.centerx - player.centerx) < 48]
+        if threats:
+            #move away from the nearest missile
+            if threats[0] > player.centerx:
+                keys.append(pygame.K_LEFT)
+            else:
+                keys.append(pygame.K_RIGHT)
+        elif game.invaders:
+            target = max(game.invaders, key=lambda invader: (
+                invader.rect.bottom, -abs(invader.rect.centerx -
+                                          player.centerx)
+            )).rect.centerx
+            if target < player.centerx - 4:
+                keys.append(pygame.K_LEFT)
+            elif target > player.centerx + 4:
+                keys.append(pygame.K_RIGHT)
+        return PressedKeys(keys)
+
+POLICIES = {
+    'idle': IdlePolicy,
+    'random': RandomPolicy,
+    'aim': AimPolicy,
+}
+#the idle policy never clears a level, it is only played on request
+DEFAULT_POLICIES = ('aim', 'random')
+
+def _init_worker():
+    """set up a headless game in a worker process"""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    #SDL turns SIGTERM into a quit event, the pool has to be able to stop
+    #its workers
+    os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+    from . import PyInvaders2, settings
+    game_settings = settings.Settings(os.devnull)
+    game_settings.update({'headless': True, 'renderer': 'software',
+                          'sound': False})
+    PyInvaders2(game_settings)
+
+def simulate(level_path, policy, seed, max_ticks, fast_forward=False):
+    """play a level once, the game has to be initialised (see _init_worker)
+
+       Returns: RunResult
+
+       Args: level_path   -> string, path of the level file
+             policy       -> string, name of the policy in POLICIES
+             seed         -> int, seed of the random numbers of this run
+             max_ticks    -> int, the run ends after this number of ticks
+             fast_forward -> boolean, skip the ticks without events, if
+                             the policy is idle (see Game.fast_forward)
+    """
+    from . import Game, data
+    rows = level_codec.read(level_path)
+    random.seed(seed)
+    game = Game(level_list=[])
+    player_policy = POLICIES[policy](random.Random(seed))
+    game.player.controls = lambda: player_policy(game)
+    game.player.always_idle = getattr(player_policy, 'idle', False)
+    game.invaders = data.Formation(
+        data.Invader(position) for position in level_codec.positions(rows)
+    )
+    game.level = 1
+    invaders = len(game.invaders)
+    peak_entities = 0
+    ticks = 0
+    while ticks < max_ticks and game.invaders and not game.game_over:
+        if fast_forward:
+            skipped = game.fast_forward(max_ticks - ticks)
+            if skipped:
+                ticks += skipped
+                continue
+        game.step()
+        #nothing gets drawn, only the logic of the game matters
+        game.render_queue.collect()
+        ticks += 1
+        peak_entities = max(peak_entities,
+                            len(game.invaders) + len(game.missiles) +
+                            len(game.explosions) + len(game.trackers))
+    lives_lost = 6 - game.live_bar.lives + sum(
+        1 for tracker in game.trackers
+        if tracker.destination == game.live_bar.left_pos
+    )
+    return RunResult(level_path, policy, seed, not game.invaders,
+                     game.game_over, ticks, game.shots,
+                     invaders - len(game.invaders), invaders, lives_lost,
+                     peak_entities)
+
+def _simulate(task):
+    """run simulate() with the arguments of a task tuple"""
+    return simulate(*task)
+
+def summarize(results, min_clear_rate=0.5, max_entities=200):
+    """Returns: list with a dict of statistics for every level and policy
+
+       Args: results        -> list of RunResults
+             min_clear_rate -> levels with a lower rate of cleared runs are
+                               flagged as too hard
+             max_entities   -> levels with a higher peak of entities are
+                               flagged as too heavy
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault((result.level, result.policy), []).append(result)
+    summary = []
+    for (level, policy), runs in sorted(groups.items()):
+        cleared = [run for run in runs if run.cleared]
+        shots = sum(run.shots for run in runs)
+        entry = {
+            'level': level,
+            'policy': policy,
+            'runs': len(runs),
+            'clear_rate': len(cleared) / len(runs),
+            'clear_seconds': (sum(run.ticks for run in cleared) /
+                              len(cleared) / TICKS_PER_SECOND
+                              if cleared else None),
+            'shots': shots / len(runs),
+            'hit_rate': (sum(run.kills for run in runs) / shots
+                         if shots else 0.0),
+            'lives_lost': sum(run.lives_lost for run in runs) / len(runs),
+            'peak_entities': max(run.peak_entities for run in runs),
+            'flags': [],
+        }
+        if entry['clear_rate'] < min_clear_rate:
+            entry['flags'].append('too hard')
+        if entry['peak_entities'] > max_entities:
+            entry['flags'].append('too many entities')
+        summary.append(entry)
+    return summary
+
+def format_summary(summary):
+    """Returns: string with a table of the summary"""
+    lines = ["%-24s %-7s %5s %8s %8s %7s %6s %5s  %s" % (
+        "level", "policy", "runs", "cleared", "time", "shots", "hits",
+        "peak", "flags"
+    )]
+    for entry in summary:
+        clear_time = "-"
+        if entry['clear_seconds'] is not None:
+            clear_time = "%.1fs" % entry['clear_seconds']
+        lines.append("%-24s %-7s %5d %7.0f%% %8s %7.1f %5.0f%% %5d  %s" % (
+            os.path.basename(entry['level']), entry['policy'], entry['runs'],
+            entry['clear_rate'] * 100, clear_time, entry['shots'],
+            entry['hit_rate'] * 100, entry['peak_entities'],
+            ", ".join(entry['flags'])
+        ))
+    return "\n".join(lines)
+
+def find_levels(paths):
+    """Returns: (list with the paths of the valid level files, list with the
+                 LevelErrors of the invalid ones)
+
+       Args: paths -> list with level files and directories of level files
+    """
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths += sorted(entry.path for entry in os.scandir(path)
+                                 if entry.name.endswith(".txt") and
+                                 entry.is_file())
+        else:
+            file_paths.append(path)
+    levels = []
+    errors = []
+    for file_path in file_paths:
+        try:
+            level_codec.read(file_path)
+            levels.append(file_path)
+        except level_codec.LevelError as error:
+            errors.append(error)
+    return levels, errors
+
+def analyze(levels, policies=DEFAULT_POLICIES, runs=20, max_ticks=9000,
+            seed=0, workers=None, fast_forward=False):
+    """play all levels with all policies in worker processes
+
+       Returns: list of RunResults
+
+       Args: levels       -> list with paths of level files
+             policies     -> list with names of policies in POLICIES
+             runs         -> number of runs per level and policy
+             max_ticks    -> maximal length of a run in ticks
+             seed         -> seed of the first run, every run gets its own
+                             seed
+             workers      -> number of processes, None for all cores
+             fast_forward -> boolean, skip the ticks without events
+    """
+    tasks = [(level, policy, seed + number, max_ticks, fast_forward)
+             for level in levels for policy in policies
+             for number in range(runs)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(min(workers, len(tasks)), 1)
+    chunk_size = max(len(tasks) // (workers * 4), 1)
+    #every worker starts a fresh interpreter, forking a process with running
+    #threads or an initialised SDL is not safe
+    context = multiprocessing.get_context("spawn")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    with context.Pool(workers, initializer=_init_worker) as pool:
+        return list(pool.imap_unordered(_simulate, tasks, chunk_size))
+
+def argument_parser():
+    """Returns: argparse.ArgumentParser for the command line flags"""
+    parser = argparse.ArgumentParser(
+        prog="pyinvaders-analyze",
+        description="Play levels headlessly and report their difficulty"
+    )
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help="level file or directory of level files")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="runs per level and policy")
+    parser.add_argument("--policy", action="append",
+                        choices=sorted(POLICIES),
+                        help="player policy, can be repeated, default " +
+                        " and ".join(DEFAULT_POLICIES))
+    parser.add_argument("--max-ticks", type=int, default=9000,
+                        help="maximal length of a run in ticks")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first run")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes, default all cores")
+    parser.add_argument("--min-clear-rate", type=float, default=0.5,
+                        help="flag levels, which are cleared less often")
+    parser.add_argument("--max-entities", type=int, default=200,
+                        help="flag levels with more entities at a time")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="skip the ticks without events, only works "
+                        "with --policy idle, the other policies play every "
+                        "tick")
+    parser.add_argument("--json", help="write the report to a JSON file")
+    return parser
+
+def main(argv=None):
+    """analyze the levels of the command line, the exit status is 1 if any
+       level is invalid or flagged"""
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argument_parser()
+    arguments = parser.parse_args(argv)
+    policies = arguments.policy or DEFAULT_POLICIES
+    if arguments.fast_forward:
+        #the other policies may press a key in every tick
+        playing = [policy for policy in policies
+                   if not getattr(POLICIES[policy], 'idle', False)]
+        if len(playing) == len(policies):
+            parser.error("--fast-forward only works with --policy idle")
+        if playing:
+            print("--fast-forward doesn't apply to the {} "
+                  "policy".format(" and ".join(playing)))
+    levels, errors = find_levels(arguments.paths)
+    for error in errors:
+        print(error)
+    results = []
+    if levels:
+        results = analyze(levels, policies,
+                          arguments.runs, arguments.max_ticks,
+                          arguments.seed, arguments.workers,
+                          arguments.fast_forward)
+    summary = summarize(results, arguments.min_clear_rate,
+                        arguments.max_entities)
+    print(format_summary(summary))
+    if arguments.json:
+        writer.write_file_atomic(arguments.json,
+                                 json.dumps(summary, indent=2) + "\n")
+    flagged = [entry for entry in summary if entry['flags']]
+    return 1 if errors or flagged else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module decodes the images and sounds of PyInvaders2 in the background
+"""
+
+import pygame
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import gametools as gt
+from . import instrumentation
+
+from os.path import dirname, abspath
+import inspect
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+game_dir = dirname(
+    abspath(inspect.getfile(inspect.currentframe()))
+)
+
+#(path, scaling, flipping, required) of all images used by the game
+IMAGES = (
+    ("/textures/menu_background.png", (640, 480), (False, False), True),
+    ("/textures/background.png", (640, 480), (False, False), True),
+    ("/textures/spaceship.png", (64, 64), (False, False), True),
+    ("/textures/invader.png", (32, 32), (False, False), True),
+    ("/textures/missile.png", (32, 32), (False, False), True),
+    ("/textures/missile.png", (32, 32), (False, True), True),
+    ("/textures/explosion.png", (64, 64), (False, False), True),
+    ("/textures/livebar.png", (32, 32), (False, False), True),
+    ("/textures/gameover.png", (640, 480), (False, False), False),
+)
+
+#(path, required) of all sounds used by the game
+SOUNDS = (
+    ("/sound/click.ogg", True),
+    ("/sound/shot.ogg", True),
+    ("/sound/explosion.ogg", True),
+)
+
+#animations are not downsampled below this number of different frames
+MIN_FRAMES = 8
+
+def _decode_sound(sound_file):
+    """load a sound file, returns None if the file does not exist"""
+    if os.path.isfile(sound_file):
+        with instrumentation.span('load sound', 'assets',
+                                  {'path': os.path.basename(sound_file)}):
+            return pygame.mixer.Sound(sound_file)
+
+def _read_file(file_path):
+    """read a whole file, returns None if the file does not exist"""
+    if os.path.isfile(file_path):
+        with instrumentation.span('read file', 'assets',
+                                  {'path': os.path.basename(file_path)}):
+            with open(file_path, 'rb') as data_file:
+                return data_file.read()
+
+def _sound_bytes(sound):
+    """Returns: the number of bytes of the decoded samples of a sound"""
+    mixer = pygame.mixer.get_init()
+    if mixer is None:
+        return 0
+    frequency, sample_format, channels = mixer
+    return int(sound.get_length() * frequency * channels *
+               (abs(sample_format) // 8))
+
+def _opaque(surface):
+    """check if every pixel of the surface is fully opaque"""
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return True
+    return pygame.surfarray.array_alpha(surface).min() == 255
+
+def _reduce_depth(surface):
+    """Returns: a 16 bit copy of an opaque surface"""
+    reduced = pygame.Surface(surface.get_size(), 0, 16)
+    reduced.blit(surface, (0, 0))
+    return reduced
+
+class AssetManager(object):
+    """Decodes images and sounds in a pool of worker threads
+
+       Assets are requested once with request_images() and request_sound()
+       and fetched with images() and sound() when they are needed. Fetching
+       an asset, which was not requested, loads it synchronously.
+
+       With a memory budget (set_budget()) the manager keeps the decoded
+       assets below it: first assets, which are not required, are evicted
+       (least recently used first), then images are downsampled in place.
+       Animations lose every second frame and opaque images get 16 bit
+       colours, the biggest saving first. Objects, which hold a
+       SurfaceSequence, see the change with their next frame.
+
+       Args: workers -> number of worker threads, None for the default of
+                        concurrent.futures
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.executor = None
+        self.futures = {}
+        self.required = set()
+        #least recently fetched assets first
+        self.cache = OrderedDict()
+        self.budget = 0
+        #keys of the images with 16 bit colours
+        self.reduced = set()
+        #image key -> boolean, all pixels are fully opaque
+        self.opaque = {}
+        #counts every change of the cached images, e.g. for the textures of
+        #the GPUScreen
+        self.generation = 0
+        self.over_budget = False
+        instrumentation.add_memory_source('assets', self.memory)
+
+    def _submit(self, key, function, *args):
+        """start the decoding of an asset in the thread pool"""
+        if key in self.futures or key in self.cache:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="assets"
+            )
+        self.futures[key] = self.executor.submit(function, *args)
+
+    def request_images(self, image_path, surface_scaling,
+                       surface_flipping=(False, False), required=True):
+        """decode an image(sequence) in the background
+
+           Args: image_path       -> the path to the image (string)
+                 surface_scaling  -> size of the new surface(s) (tuple)
+                 surface_flipping -> flip the new surface on the x- or y- axis
+                                     (tuple)
+                 required         -> boolean, the game waits for all required
+                                     assets before it starts
+        """
+        key = ('images', image_path, tuple(surface_scaling),
+               tuple(surface_flipping))
+        self._submit(key, gt.load_surfaces, image_path,
+                     surface_scaling, surface_flipping)
+        if required:
+            self.required.add(key)
+
+    def request_sound(self, sound_file, required=True):
+        """decode a sound file in the background
+
+           Args: sound_file -> string, path to the sound file
+                 required   -> boolean, the game waits for all required
+                               assets before it starts
+        """
+        key = ('sound', sound_file)
+        self._submit(key, _decode_sound, sound_file)
+        if required:
+            self.required.add(key)
+
+    def request_file(self, file_path, required=False):
+        """read the raw content of a file in the background, e.g. music
+           which gets decoded while it is streamed
+
+           Args: file_path -> string, path to the file
+                 required  -> boolean, the game waits for all required
+                              assets before it starts
+        """
+        key = ('file', file_path)
+        self._submit(key, _read_file, file_path)
+        if required:
+            self.required.add(key)
+
+    def preload(self):
+        """request all images and sounds listed in IMAGES and SOUNDS"""
+        for path, scaling, flipping, required in IMAGES:
+            self.request_images(game_dir + path, scaling, flipping, required)
+        for path, required in SOUNDS:
+            self.request_sound(game_dir + path, required)
+
+    def progress(self):
+        """Returns: (finished, total) number of the required assets"""
+        finished = 0
+        for key in self.required:
+            if key in self.cache or self.futures[key].done():
+                finished += 1
+        return finished, len(self.required)
+
+    def ready(self):
+        """check if all required assets are decoded"""
+        finished, total = self.progress()
+        return finished == total
+
+    def _result(self, key, function, *args):
+        """wait for the asset or decode it now, if it wasn't requested"""
+        name = os.path.basename(key[1])
+        if key in self.futures:
+            with instrumentation.span('wait for asset', 'assets',
+                                      {'path': name}):
+                return self.futures.pop(key).result()
+        with instrumentation.span('first use load', 'assets',
+                                  {'path': name}):
+            return function(*args)
+
+    def images(self, image_path, surface_scaling,
+               surface_flipping=(False, False)):
+        """Returns the SurfaceSequence of an image(sequence)
+
+           All objects, that fetch the same images, share one SurfaceSequence.
+        """
+        key = ('images', image_path, tuple(surface_scaling),
+               tuple(surface_flipping))
+        if key not in self.cache:
+            surfaces = self._result(key, gt.load_surfaces, image_path,
+                                    surface_scaling, surface_flipping)
+            if surfaces == []:
+                gt.messagebox("Error, couldn't load %s" % image_path)
+                sys.exit()
+            #converting needs the display and has to run in this thread
+            with instrumentation.span('convert images', 'assets'):
+                surfaces = [gt.convert_alpha(surface)
+                            for surface in surfaces]
+            sequence = gt.SurfaceSequence()
+            sequence.set_surfaces(surfaces)
+            self._store(key, sequence)
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def sound(self, sound_file):
+        """Returns the pygame.mixer.Sound of a sound file"""
+        key = ('sound', sound_file)
+        if key not in self.cache:
+            sound = self._result(key, _decode_sound, sound_file)
+            if sound is None:
+                gt.messagebox("Error , couldn't load %s" % sound_file)
+                sys.exit()
+            self._store(key, sound)
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def file(self, file_path):
+        """Returns: bytes, the raw content of a file"""
+        key = ('file', file_path)
+        if key not in self.cache:
+            data = self._result(key, _read_file, file_path)
+            if data is None:
+                gt.messagebox("Error , couldn't load %s" % file_path)
+                sys.exit()
+            self._store(key, data)
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def _store(self, key, asset):
+        """add a decoded asset to the cache and keep the budget"""
+        self.cache[key] = asset
+        self.generation += 1
+        self._enforce_budget(key)
+
+    def nbytes(self, key):
+        """Returns: the number of bytes of a cached asset"""
+        asset = self.cache[key]
+        if key[0] == 'images':
+            return asset.nbytes()
+        elif key[0] == 'sound':
+            return _sound_bytes(asset)
+        return len(asset)
+
+    def memory(self):
+        """Returns: dict with a label of every cached asset -> bytes"""
+        report = {}
+        for key in self.cache:
+            label = os.path.basename(key[1])
+            if key[0] == 'images':
+                label += " {}x{}".format(*key[2])
+                if any(key[3]):
+                    label += " flipped"
+            report[label] = report.get(label, 0) + self.nbytes(key)
+        return report
+
+    def set_budget(self, budget):
+        """limit the memory of the decoded assets
+
+           Args: budget -> int, bytes, 0 for no limit
+        """
+        self.budget = budget
+        self.over_budget = False
+        self._enforce_budget()
+
+    def _opaque(self, key):
+        """check if all surfaces of a cached image are fully opaque"""
+        if key not in self.opaque:
+            self.opaque[key] = all(_opaque(surface) for surface
+                                   in self.cache[key].surface_list)
+        return self.opaque[key]
+
+    def _enforce_budget(self, keep=None):
+        """evict and downsample cached assets, until they fit into the budget
+
+           Args: keep -> key of the asset, which gets fetched right now
+        """
+        if not self.budget:
+            return
+        sizes = {key: self.nbytes(key) for key in self.cache}
+        total = sum(sizes.values())
+        for key in list(self.cache):
+            if total <= self.budget:
+                return
+            if key != keep and key not in self.required:
+                total -= sizes.pop(key)
+                del self.cache[key]
+                self.reduced.discard(key)
+                self.opaque.pop(key, None)
+                self.generation += 1
+        while total > self.budget:
+            #(saved bytes, key, reduce the colours instead of the frames)
+            candidates = []
+            for key, asset in self.cache.items():
+                if key[0] != 'images':
+                    continue
+                if asset.unique_surfaces() >= MIN_FRAMES:
+                    candidates.append((sizes[key] // 2, key, False))
+                if key not in self.reduced and self._opaque(key):
+                    candidates.append((sizes[key] // 2, key, True))
+            if not candidates:
+                if not self.over_budget:
+                    self.over_budget = True
+                    print("assets need {:.0f} KB, more than the memory "
+                          "budget of {:.0f} KB".format(total / 1024,
+                                                       self.budget / 1024))
+                return
+            saved, key, colours = max(candidates)
+            sequence = self.cache[key]
+            if colours:
+                self.reduced.add(key)
+                reduced = {}
+                for surface in sequence.surface_list:
+                    if id(surface) not in reduced:
+                        reduced[id(surface)] = _reduce_depth(surface)
+                sequence.surface_list = [reduced[id(surface)] for surface
+                                         in sequence.surface_list]
+            else:
+                sequence.drop_frames()
+            total += sequence.nbytes() - sizes[key]
+            sizes[key] = sequence.nbytes()
+            self.generation += 1
+
+    def shutdown(self):
+        """stop the worker threads"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+manager = AssetManager()
@@ -0,0 +1,242 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module manages the playback of sound effects on the mixer channels
+"""
+
+import pygame
+import io
+import os
+from . import assets
+from . import instrumentation
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+class SoundManager(object):
+    """Plays sound effects on a pool of reserved mixer channels
+
+       Every sound is played at most once per frame, no matter how often
+       play() was called. A sound never uses more than voice_limit channels,
+       its oldest voice gets stopped for a new one. If all channels of the
+       pool are busy, the oldest voice of any sound is stolen.
+
+       Args: channels    -> number of channels reserved for the pool
+             voice_limit -> maximal number of voices per sound
+    """
+    def __init__(self, channels=8, voice_limit=3):
+        #the first channels get reserved, they are never used by
+        #Sound.play(), which keeps the other channels for menus and music
+        pygame.mixer.set_num_channels(
+            pygame.mixer.get_num_channels() + channels
+        )
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(number)
+                         for number in range(channels)]
+        self.voice_limit = voice_limit
+        self.voices = []
+        self.pending = []
+
+    def play(self, sound):
+        """play the sound with the next flush()
+
+           Args: sound -> pygame.mixer.Sound
+        """
+        if sound not in self.pending:
+            self.pending.append(sound)
+
+    def _get_channel(self, sound):
+        """find a channel for a new voice of the sound"""
+        #forget all voices, which have finished
+        self.voices = [(voice_sound, channel) for voice_sound, channel
+                       in self.voices if channel.get_sound() is voice_sound]
+        own_voices = [voice for voice in self.voices if voice[0] is sound]
+        if len(own_voices) >= self.voice_limit:
+            self.voices.remove(own_voices[0])
+            return own_voices[0][1]
+        busy_channels = [channel for voice_sound, channel in self.voices]
+        for channel in self.channels:
+            if channel not in busy_channels:
+                return channel
+        return self.voices.pop(0)[1]
+
+    def flush(self):
+        """start all sounds requested since the last flush"""
+        if not self.pending:
+            return
+        with instrumentation.span('play sounds', 'sound',
+                                  {'sounds': len(self.pending)}):
+            for sound in self.pending:
+                channel = self._get_channel(sound)
+                channel.stop()
+                channel.play(sound)
+                self.voices.append((sound, channel))
+        self.pending = []
+
+    def stop(self):
+        """stop all voices of the pool"""
+        for channel in self.channels:
+            channel.stop()
+        self.voices = []
+        self.pending = []
+
+class NullSoundManager(object):
+    """A SoundManager, which plays nothing, for runs without a mixer"""
+    def play(self, sound):
+        pass
+
+    def flush(self):
+        pass
+
+    def stop(self):
+        pass
+
+class MusicPlayer(object):
+    """Streams music with pygame.mixer.music
+
+       The tracks are organised in named playlists. They are read in the
+       background by the asset manager and stay compressed in memory, the
+       mixer decodes them while playing. Switching to an other playlist fades
+       the current track out and then the new one in, the tracks of a
+       playlist are played in a loop. mixer.music has a single stream, two
+       tracks never play at the same time.
+
+       Args: fade_time -> duration of the fade out and of the fade in,
+                          in milliseconds
+    """
+    def __init__(self, fade_time=1000):
+        self.playlists = {}
+        self.playlist = None
+        self.track = 0
+        self.stream = None
+        self.fade_time = fade_time
+        self.fading_out = False
+        self.fade_out_start = 0
+        self.next_playlist = None
+        #wakes up idle scenes, when a track ends
+        pygame.mixer.music.set_endevent(pygame.event.custom_type())
+
+    def add_playlist(self, name, tracks):
+        """add a playlist and start to preload its tracks
+
+           Args: name   -> string, name of the playlist
+                 tracks -> list of paths to music files
+        """
+        self.playlists[name] = list(tracks)
+        for track in tracks:
+            assets.manager.request_file(track)
+
+    def play(self, name):
+        """fade the current track out and then the playlist in
+
+           Args: name -> string, name of the playlist, None to stop the music
+        """
+        if name == self.playlist and not self.fading_out:
+            return
+        if (self.playlist is not None and name is not None and
+            self.playlists[name] == self.playlists[self.playlist]):
+            #same tracks, keep on playing
+            self.playlist = name
+            self.fading_out = False
+            pygame.mixer.music.set_volume(1.0)
+            return
+        if self.playlist is None or not pygame.mixer.music.get_busy():
+            self._start(name)
+            return
+        self.next_playlist = name
+        if not self.fading_out:
+            self.fading_out = True
+            self.fade_out_start = pygame.time.get_ticks()
+
+    def stop(self):
+        """fade the music out"""
+        self.play(None)
+
+    def _start(self, name):
+        """start the first track of the playlist"""
+        self.playlist = name
+        self.track = 0
+        self.fading_out = False
+        pygame.mixer.music.set_volume(1.0)
+        if name is None:
+            pygame.mixer.music.stop()
+            pygame.mixer.music.unload()
+            self.stream = None
+        else:
+            self._load(self.playlists[name][0], self.fade_time)
+
+    def _load(self, track, fade_ms=0):
+        """stream a track from its preloaded file content"""
+        with instrumentation.span('load music', 'sound',
+                                  {'path': os.path.basename(track)}):
+            self.stream = io.BytesIO(assets.manager.file(track))
+            pygame.mixer.music.load(self.stream,
+                                    os.path.splitext(track)[1].lstrip('.'))
+            pygame.mixer.music.play(fade_ms=fade_ms)
+
+    def update(self):
+        """handle the fade out and continue with the next track, call this
+           once per frame"""
+        if self.fading_out:
+            passed = pygame.time.get_ticks() - self.fade_out_start
+            if passed >= self.fade_time:
+                self._start(self.next_playlist)
+            else:
+                pygame.mixer.music.set_volume(1.0 - passed / self.fade_time)
+        elif self.playlist is not None and not pygame.mixer.music.get_busy():
+            tracks = self.playlists[self.playlist]
+            self.track = (self.track + 1) % len(tracks)
+            self._load(tracks[self.track])
+
+class NullMusicPlayer(object):
+    """A MusicPlayer, which plays nothing, for runs without a mixer"""
+    fading_out = False
+
+    def add_playlist(self, name, tracks):
+        pass
+
+    def play(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def update(self):
+        pass
+
+def create_sound_manager(channels=8, voice_limit=3):
+    """Returns: a SoundManager, or a NullSoundManager if the mixer is not
+                initialised
+    """
+    if pygame.mixer.get_init() is None:
+        return NullSoundManager()
+    return SoundManager(channels, voice_limit)
+
+def create_music_player(fade_time=1000):
+    """Returns: a MusicPlayer, or a NullMusicPlayer if the mixer is not
+                initialised
+    """
+    if pygame.mixer.get_init() is None:
+        return NullMusicPlayer()
+    return MusicPlayer(fade_time)
@@ -0,0 +1,210 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module records the shown frames of PyInvaders2 as an image sequence or
+a video
+
+The game loop only copies every frame into a free surface of a ring, which
+is allocated once. A background thread saves the surfaces as images or pipes
+their pixels to an ffmpeg process and returns them to the ring. If the
+encoder falls behind and the ring is full, frames are dropped, the game
+loop never waits for the encoder.
+"""
+
+import os
+import sys
+import zlib
+import queue
+import struct
+import shutil
+import threading
+import traceback
+import subprocess
+import pygame
+from . import gametools as gt
+from . import instrumentation
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+FRAME_SIZE = 640, 480
+#raw RGB frames from stdin to the output file
+ENCODER_COMMAND = ("ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo",
+                   "-pix_fmt", "rgb24", "-s", "{width}x{height}",
+                   "-r", "{fps}", "-i", "-", "-pix_fmt", "yuv420p",
+                   "{output}")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def _png_chunk(kind, data):
+    """Returns: bytes of a PNG chunk with its length and checksum"""
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data)))
+
+def png_bytes(surface, level=1):
+    """Returns: bytes of a PNG file with the RGB pixels of the surface
+
+       pygame.image.save() keeps the global interpreter lock, while it
+       compresses a PNG file, and stalls the game loop. zlib releases it.
+
+       Args: surface -> pygame.Surface
+             level   -> int, zlib compression level
+    """
+    width, height = surface.get_size()
+    pixels = pygame.image.tobytes(surface, "RGB")
+    stride = width * 3
+    #every row starts with its filter type, 0 is no filter
+    rows = b"".join(b"\0" + pixels[start:start + stride]
+                    for start in range(0, len(pixels), stride))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE + _png_chunk(b"IHDR", header) +
+            _png_chunk(b"IDAT", zlib.compress(rows, level)) +
+            _png_chunk(b"IEND", b""))
+
+class FrameRecorder(object):
+    """Records the frames shown by the scenes
+
+       The output is either a file name pattern with a number placeholder,
+       e.g. 'frames/%05d.png' or 'frames/%05d.bmp', for an image sequence,
+       or the name of a video file, which is encoded by ffmpeg.
+
+       Args: output  -> string, pattern of the images or the video file
+             fps     -> frames per second of the video
+             buffers -> number of frames, which can wait for the encoder
+    """
+    def __init__(self, output, fps=30, buffers=8):
+        self.output = output
+        self.fps = fps
+        self.buffers = buffers
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        self.surfaces = []
+        self.thread = None
+        self.encoder = None
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+
+    def image_sequence(self):
+        """check if the output is a pattern for single images"""
+        return "%" in self.output
+
+    def start(self):
+        """start the encoder and listen to the shown frames
+
+           Returns: False, if the encoder is not available
+        """
+        directory = os.path.dirname(os.path.abspath(self.output))
+        os.makedirs(directory, exist_ok=True)
+        if not self.image_sequence():
+            if shutil.which(ENCODER_COMMAND[0]) is None:
+                print("{} is not available, the session is not "
+                      "recorded".format(ENCODER_COMMAND[0]))
+                return False
+            command = [part.format(width=FRAME_SIZE[0],
+                                   height=FRAME_SIZE[1], fps=self.fps,
+                                   output=self.output)
+                       for part in ENCODER_COMMAND]
+            self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.thread = threading.Thread(target=self._run, name="capture",
+                                       daemon=True)
+        self.thread.start()
+        instrumentation.add_hook('present', self.capture)
+        return True
+
+    def stop(self):
+        """stop listening, write the waiting frames and close the encoder"""
+        instrumentation.remove_hook('present', self.capture)
+        if self.thread is not None:
+            self.filled.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.encoder is not None:
+            try:
+                self.encoder.stdin.close()
+            except OSError:
+                pass
+            self.encoder.wait()
+            self.encoder = None
+
+    def _allocate(self):
+        """create the ring of surfaces in the pixel format of the screen"""
+        screen = gt.get_screen()
+        for number in range(self.buffers):
+            self.surfaces.append(pygame.Surface(FRAME_SIZE, 0, screen))
+            self.free.put(number)
+
+    def capture(self, screen):
+        """copy the shown frame into a free surface of the ring, the frame
+           is dropped if no surface is free
+
+           Args: screen -> the upscaler of the scenes (ScreenScaling or
+                           GPUScreen)
+        """
+        if not self.surfaces:
+            self._allocate()
+        try:
+            number = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        with instrumentation.span('capture frame', 'capture'):
+            screen.copy_frame(self.surfaces[number])
+        self.filled.put((number, self.captured))
+        self.captured += 1
+
+    def _write(self, surface, index):
+        """save a surface as image or send it to the encoder"""
+        if self.encoder is not None:
+            self.encoder.stdin.write(pygame.image.tobytes(surface, "RGB"))
+        elif self.output.lower().endswith(".png"):
+            with open(self.output % index, "wb") as image_file:
+                image_file.write(png_bytes(surface))
+        else:
+            pygame.image.save(surface, self.output % index)
+
+    def _run(self):
+        """the loop of the encoder thread"""
+        while True:
+            job = self.filled.get()
+            if job is None:
+                break
+            number, index = job
+            try:
+                self._write(self.surfaces[number], index)
+                self.written += 1
+            except BrokenPipeError:
+                #the encoder quit, the remaining frames get lost
+                self.errors += 1
+            except Exception:
+                self.errors += 1
+                traceback.print_exc(file=sys.stderr)
+            self.free.put(number)
+
+    def summary(self):
+        """Returns: string with the number of recorded and dropped frames"""
+        return "recorded {} of {} frames to {}, {} dropped, {} failed".format(
+            self.written, self.captured + self.dropped, self.output,
+            self.dropped, self.errors
+        )
@@ -25,9 +25,14 @@ This module contains objects for the game PyInvaders2
 import pygame
 import os
 import random
-import copy
 import sys
+import weakref
 from . import gametools as gt
+from . import assets
+from . import scores
+from . import writer
+from . import level_codec
+from . import instrumentation
 
 from os.path import dirname, abspath
 import inspect
@@ -52,6 +57,10 @@ class Spaceship(pygame.sprite.Sprite):
                 live           -> number of lives, (integer, >= 0)
                 position       -> current position in game and render position
                 _shoot_counter -> time to wait between shots
+                controls       -> function, that returns the pressed keys,
+                                  default is pygame.key.get_pressed
+                always_idle    -> True, if the controls never press a key,
+                                  set by the owner of the controls
     """
     surface = None
 
@@ -59,18 +68,22 @@ class Spaceship(pygame.sprite.Sprite):
         self.size = 64, 64
         if not Spaceship.surface:
             #create surface
-            Spaceship.surface = gt.SurfaceSequence()
-            Spaceship.surface.open_images(
+            Spaceship.surface = assets.manager.images(
                 game_dir + "/textures/spaceship.png", (64, 64)
             )
         self.rect = pygame.Rect(0, 0, *self.size)
         self.rect.center = position
-        self.shoot_delay = gt.Delay(0)
+        self.reload = gt.timers.start(0)
+        self.controls = pygame.key.get_pressed
+        self.always_idle = False
 
-    def move(self, area):
+    def move(self, area, pressed_keys):
         """Check if the key A,D,LEFT,RIGHT were pressed and moves the
-           Spaceship """
-        pressed_keys = pygame.key.get_pressed()
+           Spaceship
+
+           Args: area         -> (left, right) limits of the center
+                 pressed_keys -> the result of controls() for this tick
+        """
         keys_left = pygame.K_a, pygame.K_LEFT
         keys_right = pygame.K_d, pygame.K_RIGHT
         for key in keys_left:
@@ -80,41 +93,51 @@ class Spaceship(pygame.sprite.Sprite):
             if pressed_keys[key] and self.rect.center[0] < area[1]:
                 self.rect[0] += 9
 
-    def shoot(self):
-        """check if spacebar is pressed and fires a missile"""
-        pressed_keys = pygame.key.get_pressed()
-        if self.shoot_delay.handle():
+    def shoot(self, pressed_keys):
+        """check if spacebar is pressed and fires a missile
+
+           Args: pressed_keys -> the result of controls() for this tick
+        """
+        if self.reload.expired():
             if pressed_keys[pygame.K_SPACE]:
-                self.shoot_delay = gt.Delay(10)
+                self.reload.restart(10)
                 return True
 
+    def get_surface(self):
+        """Returns: the current surface of the spaceship"""
+        return self.surface.frame(gt.clock.tick)
+
     def get_data(self):
         """Move the spaceship and fire missiles"""
-        return self.surface.handle(), self.rect
+        return self.get_surface(), self.rect
 
 class Invader(object):
     """the evil invaders try to destroy the earth
 
-       Attributes: current_surface -> There is on single SurfaceSequence for
-                                      all invaders, this attribute handles the
-                                      single invaders
+       Attributes: surface         -> the SurfaceSequence of all invaders
+                   phase           -> the offset of this invader in the
+                                      animation of the surface
                    position        -> the current position in the game
-                   _shoot_counter  -> time to wait between shots
+                   reload          -> Timer, which arms the invader
+                   armed           -> True, when the invader may shoot
     """
     surface = None
 
     def __init__(self, position):
         self.size = 32, 32
         if not Invader.surface:
-            Invader.surface = gt.SurfaceSequence()
-            Invader.surface.open_images(
+            Invader.surface = assets.manager.images(
                 game_dir + "/textures/invader.png", self.size
             )
         self.rect = pygame.Rect(0, 0, *self.size)
         self.rect.center = position
-        self.surface = Invader.surface.private_handler()
-        self.surface.set_random()
-        self.shoot_delay = gt.Delay(random.randint(0, 250))
+        self.phase = random.randint(0, self.surface.surface_number)
+        self.armed = False
+        self.reload = gt.timers.start(random.randint(0, 250), self.arm)
+
+    def arm(self):
+        """allow the next shot, called by the reload timer"""
+        self.armed = True
 
     def move(self, ymove, direction):
         """move the invaders
@@ -134,7 +157,7 @@ class Invader(object):
            checks if there is a chance of friendly fire(a missile hit an other
            invader) and if not fire a missile
         """
-        if self.shoot_delay.handle():
+        if self.armed:
             friendly_fire = False
             for invader in iv_list:
                 if (self.rect.center[0] - 32 <= invader.rect.center[0] <=
@@ -142,19 +165,55 @@ class Invader(object):
                     self.rect.center[1] < invader.rect.center[1]):
                     friendly_fire = True
             if not friendly_fire:
-                self.shoot_delay = gt.Delay(random.randint(300, 450))
+                self.armed = False
+                self.reload.restart(random.randint(300, 450))
                 return True
 
+    def get_surface(self):
+        """Returns: the current surface of the invader"""
+        return self.surface.frame(gt.clock.tick + self.phase)
+
     def get_data(self):
         """return surface and rect"""
-        return self.surface.handle(), self.rect
+        return self.get_surface(), self.rect
+
+class Formation(list):
+    """A list with all invaders of a level, that keeps a bound of its lowest
+       row up to date
+
+       Attributes: bottom -> the lowest bottom edge of all invaders, it is
+                             moved with the invaders and not raised, when
+                             invaders get removed, so it is never above the
+                             real lowest row
+    """
+    def __init__(self, invaders=()):
+        list.__init__(self, invaders)
+        self.bottom = max((invader.rect.bottom for invader in self),
+                          default=0)
+
+    def remove(self, invader):
+        """remove an invader and stop its reload timer"""
+        list.remove(self, invader)
+        invader.reload.cancel()
+
+    def move(self, ymove):
+        """move the bound together with the invaders
+
+           Args: ymove -> distance the invaders move on the y-axis
+        """
+        self.bottom += ymove
+
+    def reached(self, y):
+        """check if the lowest row could have reached the y-coordinate"""
+        return self.bottom > y
 
 class Missile(object):
     """A simple object, that moves until it hits something
 
        Attributes: surface_up and surface_down
                              -> the missiles got also on single SurfaceSequence,
-                                but every one has an different "current_surface"
+                                every missile starts its animation at the
+                                first surface
                    direction -> direction where to move, spaceship-missiles
                                 move upwards and invader-missiles downwards
     """
@@ -167,18 +226,17 @@ class Missile(object):
         self.rect.center = position
         self.direction = direction
         if not Missile.surface_up:
-            Missile.surface_up = gt.SurfaceSequence()
-            Missile.surface_up.open_images(
+            Missile.surface_up = assets.manager.images(
                 game_dir + "/textures/missile.png", self.size
             )
-            Missile.surface_down = gt.SurfaceSequence()
-            Missile.surface_down.open_images(
+            Missile.surface_down = assets.manager.images(
                 game_dir + "/textures/missile.png", self.size, (False, True)
             )
         if direction == 'up':
-            self.surface = Missile.surface_up.private_handler()
+            self.surface = Missile.surface_up
         elif direction == 'down':
-            self.surface = Missile.surface_down.private_handler()
+            self.surface = Missile.surface_down
+        self.phase = -gt.clock.tick
 
     def move(self):
         """changes the position of the missile"""
@@ -189,7 +247,7 @@ class Missile(object):
 
     def get_data(self):
         """returns: surface and rect"""
-        return self.surface.handle(), self.rect
+        return self.surface.frame(gt.clock.tick + self.phase), self.rect
 
 class Explosion(object):
     """a simple fireball"""
@@ -198,22 +256,21 @@ class Explosion(object):
         self.size = 64, 64
         self.rect = pygame.Rect((0, 0), self.size)
         self.rect.center = position
-        self.current_surface = -1
+        self.start = gt.clock.tick
         if not Explosion.surface:
-            Explosion.surface = gt.SurfaceSequence()
-            Explosion.surface.open_images(
+            Explosion.surface = assets.manager.images(
                 game_dir + "/textures/explosion.png", (64, 64)
             )
 
     def finished(self):
         """check if the explosion is gone"""
-        if self.current_surface == self.surface.surface_number - 2:
-            return True
+        return gt.clock.tick - self.start >= self.surface.surface_number
 
     def get_data(self):
         """render the explosion"""
-        self.current_surface += 1
-        return self.surface.handle(self.current_surface), self.rect
+        number = min(gt.clock.tick - self.start,
+                     self.surface.surface_number - 1)
+        return self.surface.handle(number), self.rect
 
 
 class StaticObject(object):
@@ -226,8 +283,7 @@ class StaticObject(object):
     def add_images(self, image_path, scaling):
         """add an image"""
         self.type = 'image'
-        self.surface = gt.SurfaceSequence()
-        self.surface.open_images(image_path, scaling)
+        self.surface = assets.manager.images(image_path, scaling)
 
     def add_font(self, font, size, text, colour):
         """add a text"""
@@ -245,26 +301,23 @@ class StaticObject(object):
 class Level(object):
     """Contains Informations about invader positions in each level
 
-       Attributes: number            -> number of the level
+       Attributes: name              -> name of the level file
                    invader_positions -> list with the starting positions
                                         of the invaders in this level
     """
     def __init__(self, file_path):
-        self.invader_positions = []
-        level_file = open(file_path, 'r')
-        for line, line_number in zip(level_file, range(5)):
-            for letter, number in zip(line, range(19)):
-                if letter == '#':
-                    position = number * 32 + 32, line_number * 32 + 32
-                    self.invader_positions.append(position)
-        level_file.close()
+        self.name = os.path.basename(file_path)
+        try:
+            rows = level_codec.read(file_path)
+        except level_codec.LevelError as error:
+            gt.messagebox("Invalid level-file %s" % error)
+            sys.exit()
+        self.invader_positions = level_codec.positions(rows)
 
     def get_invaders(self):
         """add the invaders of the level to the game"""
-        invaders = []
-        for position in self.invader_positions:
-            invaders.append(Invader(position))
-        return invaders
+        return Formation(Invader(position)
+                         for position in self.invader_positions)
 
 class LevelList(list):
     """A list with all levels"""
@@ -296,9 +349,11 @@ class LiveBar(object):
         self.lives = 6
         self.position = position
         self.left_pos = self.position[0] + 192, self.position[1]
+        #frame of the live sprite -> composed bar for self.composed_lives
+        self.composed = {}
+        self.composed_lives = None
         if not LiveBar.surface:
-            LiveBar.surface = gt.SurfaceSequence()
-            LiveBar.surface.open_images(
+            LiveBar.surface = assets.manager.images(
                 game_dir + "/textures/livebar.png", (32, 32)
             )
 
@@ -309,11 +364,18 @@ class LiveBar(object):
             return True
 
     def get_data(self):
-        """render the livebar"""
-        live_surface = self.surface.handle()
-        surface = pygame.surface.Surface((192, 32), pygame.SRCALPHA)
-        for i in range(self.lives):
-            surface.blit(live_surface, (160 - 32 * i, 0))
+        """render the livebar, the bar is composed once per frame of the
+           animation and number of lives"""
+        live_surface = self.surface.frame(gt.clock.tick)
+        if self.composed_lives != self.lives:
+            self.composed = {}
+            self.composed_lives = self.lives
+        surface = self.composed.get(live_surface)
+        if surface is None:
+            surface = pygame.surface.Surface((192, 32), pygame.SRCALPHA)
+            for i in range(self.lives):
+                surface.blit(live_surface, (160 - 32 * i, 0))
+            self.composed[live_surface] = surface
         return surface, self.position
 
 class Score(object):
@@ -324,33 +386,67 @@ class Score(object):
         )
         self.score = 0
         self.position = position
+        #(score, surface) of the last rendered score
+        self.rendered = None
 
     def add_score(self):
         """add a score point"""
         self.score += 1
 
     def get_data(self):
-        """render the score-font"""
-        surface = self.font.render(str(self.score), 8, (200, 100, 0))
-        return surface, self.position
+        """render the score-font, when the score changed"""
+        if self.rendered is None or self.rendered[0] != self.score:
+            self.rendered = self.score, self.font.render(str(self.score), 8,
+                                                         (200, 100, 0))
+        return self.rendered[1], self.position
+
+#surface -> dict with size -> semi transparent copy of the surface
+_ghosts = weakref.WeakKeyDictionary()
+
+def ghost_surface(surface, size=None):
+    """Returns: a semi transparent copy of the surface, the copy is shared
+                by all calls with the same surface and size
+
+       Args: surface -> pygame.Surface
+             size    -> (width, height) of the copy, None for the size of
+                        the surface
+    """
+    ghosts = _ghosts.setdefault(surface, {})
+    if size not in ghosts:
+        ghost = surface
+        if size is not None:
+            ghost = pygame.transform.scale(ghost, size)
+        ghost = gt.convert_alpha(ghost)
+        alpha_array = pygame.surfarray.array_alpha(ghost)
+        pygame.surfarray.pixels_alpha(ghost)[:] = alpha_array * 0.5
+        ghosts[size] = ghost
+    return ghosts[size]
+
+def ghost_memory():
+    """Returns: the number of bytes of all semi transparent copies"""
+    return sum(gt.surface_bytes(ghost) for ghosts in list(_ghosts.values())
+               for ghost in ghosts.values())
 
 class Tracker(object):
-    """Moves semi transparent surface over the screen"""
-    def __init__(self, surface, position, destination):
-        self.surface = copy.copy(surface)
-        self.surface = self.surface.convert_alpha()
-        alpha_array = pygame.surfarray.array_alpha(self.surface)
-        pygame.surfarray.pixels_alpha(self.surface)[:] = alpha_array * 0.5
+    """Moves semi transparent surface over the screen
+
+       Args: surface     -> pygame.Surface
+             position    -> start position
+             destination -> end position
+             size        -> (width, height) of the tracker, None for the
+                            size of the surface
+    """
+    def __init__(self, surface, position, destination, size=None):
+        self.surface = ghost_surface(surface, size)
         self.position = list(position)
         self.destination = destination
         self.speed = (self.position[0] - float(self.destination[0])) / 15, \
                      (self.position[1] - float(self.destination[1])) / 15
-        self.wait = gt.Delay(15)
+        self.wait = gt.timers.start(15)
 
     def dest_reached(self):
         """check if the tracker reached his destination"""
-        if self.wait.handle():
-            return True
+        return self.wait.expired()
 
     def get_data(self):
         """Render the surface"""
@@ -359,47 +455,47 @@ class Tracker(object):
         return self.surface, self.position
 
 class Highscore(object):
-    """A list with the five highest scores, reached in this game"""
+    """A list with the five highest scores, reached in this game
+
+       All scores are kept in a ScoreStore, which is shared by all instances.
+       New scores are written in the background.
+    """
+    store = None
+    leaderboard = None
+    score_writer = None
+
     def __init__(self):
+        if Highscore.store is None:
+            Highscore.store = scores.ScoreStore()
+            Highscore.store.import_score_file(game_dir + "/.score")
+            Highscore.leaderboard = scores.Leaderboard(Highscore.store)
+            Highscore.score_writer = scores.ScoreWriter(writer.worker,
+                                                        Highscore.store.path)
+            instrumentation.add_memory_source('scores',
+                                              Highscore.store.memory)
         self.scores = []
-        self.score_file_path = game_dir + "/.score"
         self.read_highscores()
 
-    def check_highscore(self, score):
-        """Check if the score exceeds any highscore and replace it"""
-        if not score in self.scores:
-            for value in self.scores:
-                if score > value:
-                    self.scores.append(score)
-                    self.scores.sort()
-                    self.scores.reverse()
-                    del self.scores[5]
-                    self.write_highscores()
-                    break
-
-    def write_highscores(self):
-        """write all highscores to the file .score """
-        with open(self.score_file_path, "w") as score_file:
-            for score in self.scores:
-                score_file.write("%d " % score + "\n")
+    def check_highscore(self, score, player=None, level=""):
+        """Store the score and update the list of the highscores
+
+           Args: score  -> int, the reached score
+                 player -> string, name of the player
+                 level  -> string, name of the last level file
+        """
+        if score:
+            self.score_writer.add(score, player, level)
+        self.read_highscores()
 
     def read_highscores(self):
-        """read all highscores from the file .score"""
-        self.scores = []
-        if not os.path.isfile(self.score_file_path):
-            self.scores = [0, 0, 0, 0, 0]
-            self.write_highscores()
-            return
-
-        with open(self.score_file_path, "r") as score_file:
-            for line in score_file:
-                if len(self.scores) == 5:
-                    break
-                self.scores.append(int(line))
-            score_file.close()
-            self.scores.sort()
-            self.scores.reverse()
-            if len(self.scores) != 5:
-                self.scores = [0, 0, 0, 0, 0]
-                self.write_highscores()
-                gt.messagebox("Corrupted .score file!")
+        """read the five highest scores from the store"""
+        #scores, which are still queued, are shown as well, they are taken
+        #first, so a score written meanwhile is found in the store
+        pending = self.score_writer.pending_entries()
+        stored = self.leaderboard.top(5)
+        self.scores = [entry.score for entry in stored]
+        self.scores += [entry.score for entry in
+                        scores.without_stored(pending, stored)]
+        self.scores.sort(reverse=True)
+        self.scores = self.scores[:5]
+        self.scores += [0] * (5 - len(self.scores))
@@ -27,8 +27,10 @@ import pygame
 import os
 import tkinter as tk
 from tkinter import messagebox as tkMessageBox
-import random
 import sys
+import heapq
+import itertools
+from . import instrumentation
 
 from os.path import dirname, abspath
 import inspect
@@ -43,6 +45,50 @@ game_dir = dirname(
     abspath(inspect.getfile(inspect.currentframe()))
 )
 
+_screen = None
+
+def set_screen(surface):
+    """Use an other surface than the display surface as screen, e.g. when the
+       frames are presented by a renderer
+
+       Args: surface -> pygame.Surface, None for the display surface
+    """
+    global _screen
+    _screen = surface
+
+def get_screen():
+    """Returns: the surface everything is drawn on"""
+    if _screen is not None:
+        return _screen
+    return pygame.display.get_surface()
+
+def alpha_copy(surface):
+    """Returns a copy of the surface with per pixel alpha, it does not touch
+       the display, so it may run in a worker thread
+
+       Args: surface -> pygame.Surface
+    """
+    copy = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+    copy.blit(surface, (0, 0))
+    return copy
+
+def convert_alpha(surface):
+    """Returns a copy of the surface with per pixel alpha, in the pixel
+       format of the display if a display mode is set
+
+       Args: surface -> pygame.Surface
+    """
+    if pygame.display.get_surface() is not None:
+        return surface.convert_alpha()
+    return alpha_copy(surface)
+
+def surface_bytes(surface):
+    """Returns: the number of bytes of the pixel data of the surface
+
+       Args: surface -> pygame.Surface
+    """
+    return surface.get_pitch() * surface.get_height()
+
 def messagebox(message):
     """Opens a simple window with the message
 
@@ -95,11 +141,14 @@ def create_surface(image_path, surface_scaling,
     """creates a surface from a image, scale the surface and
        if necessary flip it
 
+       The display is not touched, the asset manager converts the surface
+       to the pixel format of the display on the main thread.
+
        Args: image_path      -> the path to the image (str)
              surface_scaling -> the new scaling of the surface (tuple/list)
     """
     surface = pygame.image.load(image_path)
-    surface.convert_alpha()
+    surface = alpha_copy(surface)
     surface = pygame.transform.scale(surface, surface_scaling)
     surface = pygame.transform.flip(surface, surface_flipping[0],
                                     surface_flipping[1])
@@ -126,6 +175,29 @@ def read_multiple_images(image_path):
             break
     return path_list
 
+def load_surfaces(image_path, surface_scaling,
+                  surface_flipping=(False, False)):
+    """load a single image or a numerated imagesequence as surfaces
+
+       This function does not touch the display, so it may run in a worker
+       thread. An empty list is returned, if no image was found.
+
+       Args: image_path       -> the path to the image (str)
+             surface_scaling  -> the new scaling of the surfaces (tuple/list)
+             surface_flipping -> flip the surfaces on the x- or y- axis
+                                 (tuple)
+    """
+    with instrumentation.span('load images', 'assets',
+                              {'path': os.path.basename(image_path)}):
+        #check if there is a single image
+        if os.path.isfile(image_path):
+            paths = [image_path]
+        #or an imagesequence
+        else:
+            paths = read_multiple_images(image_path)
+        return [create_surface(path, surface_scaling, surface_flipping)
+                for path in paths]
+
 class Button(object):
     """A simple button for menus, use it with ButtonGroup
 
@@ -136,7 +208,7 @@ class Button(object):
         self.type = None
         self.active_surface = None
         self.passive_surface = None
-        self.screen = pygame.display.get_surface()
+        self.screen = get_screen()
 
     def add_text(self, font, text, colour_passive, colour_active):
         """Add a text to this button
@@ -180,6 +252,19 @@ class Button(object):
                 self.screen.blit(self.active_surface.handle(),
                                       self.position)
 
+    def get_rect(self):
+        """Returns: pygame.Rect, the area on the screen covered by the button
+                    in both states
+        """
+        if self.type == 'text':
+            surfaces = [self.active_surface, self.passive_surface]
+        else:
+            surfaces = (self.active_surface.surface_list +
+                        self.passive_surface.surface_list)
+        rects = [surface.get_rect(topleft=self.position)
+                 for surface in surfaces]
+        return rects[0].unionall(rects[1:])
+
 
 class ButtonGroup(object):
     """Handle buttons in an menu
@@ -202,7 +287,7 @@ class ButtonGroup(object):
         self.button_sound = sound
         self.down_key = KeyCheck(pygame.K_DOWN, 10)
         self.up_key = KeyCheck(pygame.K_UP, 10)
-        self.screen = pygame.display.get_surface()
+        self.screen = get_screen()
 
     def add_buttons(self, *buttons):
         """add buttons to this group
@@ -233,26 +318,43 @@ class ButtonGroup(object):
             else:
                 self.current_button -= 1
 
-    def handle(self, events, sound):
-        """manage the buttons, returns button-number, when return gets
-           pressed"""
-        self.get_current_button(events, sound)
+    def get_state(self, number):
+        """Returns: 'active' or 'passive', the state of the button with the
+                    given number
+        """
+        if number == self.current_button:
+            return 'active'
+        return 'passive'
 
-        for button in self.button_list:
-            if self.button_list.index(button) == self.current_button - 1:
-                button.handle('active')
-            else:
-                button.handle('passive')
+    def check(self, events, sound):
+        """handle keyboard inputs without rendering, returns button-number,
+           when return gets pressed"""
+        self.get_current_button(events, sound)
 
         if check_for_keydown(pygame.K_RETURN, events):
             if sound:
                 self.button_sound.play()
             return self.current_button
 
+    def handle(self, events, sound):
+        """manage the buttons, returns button-number, when return gets
+           pressed"""
+        pressed_button = self.check(events, sound)
+
+        for number, button in enumerate(self.button_list, 1):
+            button.handle(self.get_state(number))
+
+        return pressed_button
+
 
 class Menu(object):
     """Menu in a game, contains button, a background and fonts
 
+       The background and the fonts are composited once into a cached
+       surface. After the first frame only buttons, which changed their
+       state, are rendered again. The changed areas of the last frame are
+       stored in dirty_rects (None, if the whole screen changed).
+
        Args: font               -> pygame.font.Font
              background_surfseq -> SurfaceSequence, displayed in the background
              colour_active      -> tuple, colour of all active objects
@@ -262,13 +364,16 @@ class Menu(object):
     """
     def __init__(self, font, background_surfseq, colour_active, colour_passive,
                  click_sound = None):
-        self.screen = pygame.display.get_surface()
+        self.screen = get_screen()
         self.font = font
         self.colour_active = colour_active
         self.colour_passive = colour_passive
         self.background = background_surfseq
         self.button_group = ButtonGroup(click_sound)
         self.fonts = []
+        self.static_surface = None
+        self.drawn_buttons = {}
+        self.dirty_rects = None
 
     def add_text(self, text, position, colour=None):
         """add a static font to the menu
@@ -282,6 +387,22 @@ class Menu(object):
         else:
             font = self.font.render(text, 8, colour)
         self.fonts.append((font, position))
+        self.invalidate()
+
+    def invalidate(self):
+        """render the whole menu again in the next frame, e.g. after an other
+           scene used the screen"""
+        self.static_surface = None
+
+    def composite(self):
+        """blit the background and all fonts into the cached static
+           surface"""
+        background = self.background.handle()
+        if self.static_surface is None:
+            self.static_surface = pygame.Surface(background.get_size())
+        self.static_surface.blit(background, (0, 0))
+        for font in self.fonts:
+            self.static_surface.blit(font[0], font[1])
 
     def add_button(self, text, position):
         """add a text button to the menu
@@ -315,11 +436,34 @@ class Menu(object):
            Args: events -> pygame.event.get()
                  sound  -> boolean
         """
-        self.screen.blit(self.background.handle(), (0, 0))
-        for font in self.fonts:
-            self.screen.blit(font[0], font[1])
-
-        pressed_button = self.button_group.handle(events, sound)
+        pressed_button = self.button_group.check(events, sound)
+
+        #animated backgrounds have to be composited every frame
+        full_redraw = (self.static_surface is None or
+                       self.background.surface_number > 1)
+        if full_redraw:
+            self.composite()
+            self.screen.blit(self.static_surface, (0, 0))
+            self.drawn_buttons = {}
+
+        dirty_rects = []
+        for number, button in enumerate(self.button_group.button_list, 1):
+            state = self.button_group.get_state(number)
+            drawn = self.drawn_buttons.get(number)
+            if (drawn is not None and drawn[0] is button and
+                drawn[1] == state and button.type == 'text'):
+                continue
+            rect = button.get_rect()
+            if drawn is not None:
+                #restore the background below the old button
+                self.screen.blit(self.static_surface, drawn[2], drawn[2])
+                dirty_rects.append(drawn[2])
+            self.screen.blit(self.static_surface, rect, rect)
+            button.handle(state)
+            self.drawn_buttons[number] = (button, state, rect)
+            dirty_rects.append(rect)
+
+        self.dirty_rects = None if full_redraw else dirty_rects
         return pressed_button
 
 class KeyCheck(object):
@@ -386,27 +530,172 @@ class Delay(object):
             self.ticks -= 1
             return False
 
-class PrivateHandler(object):
-    """Allows multiple objects to use the same surfacesequence
+class RenderQueue(object):
+    """Collects the blits of a frame and submits them with one Surface.blits
 
-       Args: surface_sequence -> an instance of the surfacesequence to use
+       Surfaces are drawn in the order of their layers, inside a layer the
+       blits of the same surface are grouped together.
+
+       Args: target -> pygame.Surface to draw on, default is the display
     """
-    def __init__(self, surface_sequence):
-        self.surf_seq = surface_sequence
-        self._current_surface = 1
+    def __init__(self, target=None):
+        if target is None:
+            target = get_screen()
+        self.target = target
+        self.layers = {}
+
+    def add(self, surface, position, layer=0):
+        """queue a blit
+
+           Args: surface  -> pygame.Surface
+                 position -> position on the target (tuple/list/Rect)
+                 layer    -> int, higher layers are drawn on top
+        """
+        if layer not in self.layers:
+            self.layers[layer] = []
+        self.layers[layer].append((surface, position))
 
-    def set_random(self):
-        """switches to random surface"""
-        self._current_surface = random.randint(0, self.surf_seq.surface_number)
+    def __len__(self):
+        return sum(len(blits) for blits in self.layers.values())
 
-    def handle(self):
-        """returns the current surface from the sequence"""
-        if not self._current_surface == self.surf_seq.surface_number:
-            self._current_surface += 1
-        else:
-            self._current_surface = 1
-        return self.surf_seq.surface_list[self._current_surface - 1]
+    def collect(self):
+        """Returns: list with all queued (surface, position) pairs in the
+                    order to draw them, the queue is empty afterwards
+        """
+        blit_sequence = []
+        for layer in sorted(self.layers):
+            blits = self.layers[layer]
+            blits.sort(key=lambda blit: id(blit[0]))
+            blit_sequence += blits
+        self.layers = {}
+        return blit_sequence
+
+    def flush(self):
+        """draw all queued surfaces"""
+        self.target.blits(self.collect(), doreturn=False)
+
+class AnimationClock(object):
+    """A frame counter shared by all animations
+
+       Animated objects keep no state of their own besides a phase offset,
+       their current surface is SurfaceSequence.frame(clock.tick + phase).
+    """
+    def __init__(self):
+        self.tick = 0
 
+    def advance(self, ticks=1):
+        """count the next frame
+
+           Args: ticks -> number of frames, more than one to skip frames
+        """
+        self.tick += ticks
+
+clock = AnimationClock()
+
+class Timer(object):
+    """A deadline on the ticks of the clock of a Scheduler, use
+       Scheduler.start() to create one
+
+       Attributes: deadline -> the last tick before the timer expires
+                   callback -> function called by Scheduler.run(), when the
+                               timer expired, or None
+    """
+    __slots__ = ('scheduler', 'deadline', 'callback', 'args', 'cancelled',
+                 'entry')
+
+    def __init__(self, scheduler, callback=None, args=()):
+        self.scheduler = scheduler
+        self.deadline = None
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        #sequence number of the valid heap entry
+        self.entry = None
+
+    def expired(self):
+        """check if the timer waited its number of ticks"""
+        return self.scheduler.clock.tick > self.deadline
+
+    def remaining(self):
+        """Returns: the number of ticks until the timer expires"""
+        return max(self.deadline + 1 - self.scheduler.clock.tick, 0)
+
+    def restart(self, ticks):
+        """wait again, instead of creating a new timer
+
+           Args: ticks -> number of ticks to wait
+        """
+        self.cancelled = False
+        self.deadline = self.scheduler.clock.tick + ticks
+        self.scheduler.push(self)
+
+    def cancel(self):
+        """never call the callback of the timer"""
+        self.cancelled = True
+
+class Scheduler(object):
+    """Keeps the deadlines of all timers of the game in a min-heap
+
+       A timer, which is started with ticks, expires after the clock
+       advanced ticks times and on the tick after that, like a Delay with
+       the same number. run() is called once per tick and visits only the
+       expired timers, so waiting timers cost nothing per tick.
+       Restarted and cancelled timers leave their old heap entries behind,
+       they are skipped when they get popped.
+
+       Args: clock -> AnimationClock, which counts the ticks
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        #(deadline, sequence number, timer), the number keeps the order of
+        #timers with the same deadline and identifies the valid entry
+        self.heap = []
+        self.counter = itertools.count()
+
+    def start(self, ticks, callback=None, *args):
+        """Returns: a new Timer, which expires after the number of ticks
+
+           Args: ticks    -> number of ticks to wait
+                 callback -> function called with args by run(), when the
+                             timer expired
+        """
+        timer = Timer(self, callback, args)
+        timer.restart(ticks)
+        return timer
+
+    def push(self, timer):
+        """add the current deadline of a timer to the heap, its older
+           entries become invalid"""
+        timer.entry = next(self.counter)
+        heapq.heappush(self.heap, (timer.deadline, timer.entry, timer))
+
+    def run(self):
+        """call the callbacks of all timers, which expired since the last
+           call"""
+        heap = self.heap
+        while heap and heap[0][0] < self.clock.tick:
+            deadline, number, timer = heapq.heappop(heap)
+            if (timer.entry == number and not timer.cancelled and
+                    timer.callback is not None):
+                timer.callback(*timer.args)
+
+    def next_deadline(self):
+        """Returns: the earliest deadline of all running timers, None if no
+                    timer is running
+        """
+        heap = self.heap
+        while heap:
+            deadline, number, timer = heap[0]
+            if timer.entry == number and not timer.cancelled:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def clear(self):
+        """forget all timers, e.g. when a new game starts"""
+        self.heap = []
+
+timers = Scheduler(clock)
 
 class SurfaceSequence(object):
     """Allows to handle multiple images as a sequence
@@ -417,7 +706,8 @@ class SurfaceSequence(object):
 
     Attributes: surface_list     -> a list of all surfaces in this sequence
                 surface_number   -> the number of all surfaces in this sequence
-                _current_surface -> the current surface in this sequence
+                current_surface  -> the current surface in this sequence, used
+                                    by handle()
     """
     def __init__(self):
         self.surface_list = []
@@ -435,18 +725,8 @@ class SurfaceSequence(object):
                                      (tuple)
         """
         print("Load image(s) from {} . . . ".format(image_path), end="")
-        #check if there is a single image
-        if os.path.isfile(image_path):
-            surface = create_surface(image_path, surface_scaling,
-                                     surface_flipping)
-            self.surface_list.append(surface)
-        #or an imagesequence
-        else:
-            for path in read_multiple_images(image_path):
-                surface = create_surface(path, surface_scaling,
-                                         surface_flipping)
-                self.surface_list.append(surface)
-            self.surface_number = len(self.surface_list)
+        self.set_surfaces(load_surfaces(image_path, surface_scaling,
+                                        surface_flipping))
 
         if not self.surface_list == []:
             print("DONE")
@@ -454,6 +734,15 @@ class SurfaceSequence(object):
             messagebox("Error, couldn't load %s" % image_path)
             sys.exit()
 
+    def set_surfaces(self, surfaces):
+        """Replace all surfaces of the sequence
+
+           Args: surfaces -> list of pygame.Surface
+        """
+        self.surface_list = list(surfaces)
+        self.surface_number = max(len(self.surface_list), 1)
+        self.current_surface = 1
+
     def add_surface(self, surface):
         """Add a surface to the sequence
 
@@ -462,11 +751,41 @@ class SurfaceSequence(object):
         self.surface_list.append(surface)
         self.surface_number = len(self.surface_list)
 
-    def private_handler(self):
-        """Returns a object, which allows multiple other objects to use
-           this SurfaceSequence
+    def frame(self, tick):
+        """Returns the surface of the sequence at the given tick, the
+           sequence is repeated endlessly
+
+           Args: tick -> int, e.g. AnimationClock.tick plus a phase offset
+        """
+        return self.surface_list[tick % len(self.surface_list)]
+
+    def nbytes(self):
+        """Returns: the number of bytes of the pixel data of all surfaces,
+           surfaces which appear multiple times are counted once
         """
-        return PrivateHandler(self)
+        unique = {id(surface): surface for surface in self.surface_list}
+        return sum(surface_bytes(surface) for surface in unique.values())
+
+    def unique_surfaces(self):
+        """Returns: the number of different surfaces in the sequence"""
+        return len({id(surface) for surface in self.surface_list})
+
+    def drop_frames(self):
+        """halve the memory of an animation, every second surface is
+           replaced by its predecessor, so the animation keeps its length
+        """
+        #[surface, count] of the runs of repeated surfaces
+        runs = []
+        for surface in self.surface_list:
+            if runs and runs[-1][0] is surface:
+                runs[-1][1] += 1
+            else:
+                runs.append([surface, 1])
+        surfaces = []
+        for index in range(0, len(runs), 2):
+            length = sum(count for surface, count in runs[index:index + 2])
+            surfaces.extend([runs[index][0]] * length)
+        self.surface_list = surfaces
 
     def handle(self, number=None, copy=False):
         """returns the current surface from the sequence
@@ -475,7 +794,7 @@ class SurfaceSequence(object):
                  copy   -> boolean, if true, the current surface won't be
                            changed
         """
-        if number:
+        if number is not None:
             return self.surface_list[number]
 
         #self._current_surface counts continual from 0 to the number of
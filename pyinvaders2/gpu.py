@@ -0,0 +1,238 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+
+"""
+This module presents the frames of PyInvaders2 with the SDL2 renderer, which
+scales and composites them on the graphics card
+"""
+
+import os
+from collections import OrderedDict
+import pygame
+from . import gametools as gt
+from . import assets
+from . import instrumentation
+
+try:
+    from pygame._sdl2 import video
+except ImportError:
+    video = None
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+#number of textures kept for surfaces, which are not part of the assets
+SURFACE_TEXTURES = 64
+
+class TextureRenderQueue(gt.RenderQueue):
+    """A RenderQueue, which draws the queued surfaces as textures of a
+       GPUScreen instead of blitting them
+
+       Args: screen -> GPUScreen
+    """
+    def __init__(self, screen):
+        gt.RenderQueue.__init__(self, screen.canvas)
+        self.screen = screen
+
+    def flush(self):
+        """draw all queued surfaces"""
+        self.screen.draw(self.collect())
+
+class GPUScreen(object):
+    """Presents the frames with an accelerated SDL2 renderer
+
+       The game draws on a 640*480 software canvas like on the display. Only
+       the changed areas of the canvas are uploaded to a streaming texture,
+       the renderer scales it to the window size. Scenes, that use a
+       TextureRenderQueue, skip the canvas completely: the sprites of the
+       asset manager are uploaded once and drawn as textures.
+
+       The interface is the same as the one of ScreenScaling.
+
+       Args: size   -> (width, height) of the window
+             vsync  -> boolean, wait for the vertical blank
+             smooth -> boolean, use linear instead of nearest filtering
+    """
+    def __init__(self, size, vsync=False, smooth=False):
+        if video is None:
+            raise RuntimeError("pygame was built without pygame._sdl2")
+        #the hint is read, when a texture gets created
+        os.environ["SDL_RENDER_SCALE_QUALITY"] = ("linear" if smooth
+                                                  else "nearest")
+        self.size = size
+        self.window = video.Window("PyInvaders2", size)
+        self.renderer = video.Renderer(self.window, accelerated=1,
+                                       vsync=vsync)
+        self.renderer.logical_size = (640, 480)
+        self.canvas = pygame.Surface((640, 480))
+        self.canvas_texture = video.Texture(self.renderer, (640, 480),
+                                            streaming=True)
+        #id of the SurfaceSequence -> (sequence, list of its surfaces), the
+        #lists keep the surfaces alive, so the ids of the surfaces stay
+        #unique
+        self.uploaded = {}
+        self.textures = {}
+        #id of the surface -> (surface, texture) of other surfaces (text,
+        #the live bar, trackers) in the order of their last use, the
+        #entries keep the surfaces alive, so the ids stay unique
+        self.surface_textures = OrderedDict()
+        self.generation = None
+        instrumentation.add_memory_source('textures', self.memory)
+        self.drawn = False
+        self.last_frame = []
+
+    def set_size(self, size):
+        """set new window-size, the frame is scaled by the renderer"""
+        self.size = size
+        self.window.size = size
+
+    def active(self):
+        """the renderer always scales the frame"""
+        return self.size != (640, 480)
+
+    def upload(self):
+        """create textures for all images decoded by the asset manager and
+           free the textures of evicted or downsampled images"""
+        if self.generation == assets.manager.generation:
+            return
+        self.generation = assets.manager.generation
+        sequences = {id(sequence): sequence
+                     for sequence in assets.manager.cache.values()
+                     if isinstance(sequence, gt.SurfaceSequence)}
+        for key, (sequence, surfaces) in list(self.uploaded.items()):
+            if (sequences.get(key) is not sequence or
+                    sequence.surface_list != surfaces):
+                del self.uploaded[key]
+                for surface in surfaces:
+                    self.textures.pop(id(surface), None)
+        for key, sequence in sequences.items():
+            if key in self.uploaded:
+                continue
+            self.uploaded[key] = sequence, list(sequence.surface_list)
+            for surface in sequence.surface_list:
+                if id(surface) not in self.textures:
+                    self.textures[id(surface)] = video.Texture.from_surface(
+                        self.renderer, surface
+                    )
+
+    def memory(self):
+        """Returns: dict with the bytes of the canvas and of all textures"""
+        textures = {id(texture): texture
+                    for texture in self.textures.values()}
+        return {
+            'canvas': gt.surface_bytes(self.canvas),
+            'canvas texture': 640 * 480 * 4,
+            'sprites': sum(texture.width * texture.height * 4
+                           for texture in textures.values()),
+            'other surfaces': sum(texture.width * texture.height * 4
+                                  for surface, texture in
+                                  self.surface_textures.values()),
+        }
+
+    def surface_texture(self, surface):
+        """Returns: the texture of a surface, which is not part of the
+                    assets
+
+           The texture is uploaded on the first use of the surface and
+           reused, while the surface is one of the SURFACE_TEXTURES last
+           used ones. Surfaces must not be changed after they were drawn,
+           the owners draw a new surface instead (see data.Score).
+        """
+        entry = self.surface_textures.get(id(surface))
+        if entry is not None and entry[0] is surface:
+            self.surface_textures.move_to_end(id(surface))
+            return entry[1]
+        texture = video.Texture.from_surface(self.renderer, surface)
+        self.surface_textures[id(surface)] = surface, texture
+        while len(self.surface_textures) > SURFACE_TEXTURES:
+            self.surface_textures.popitem(last=False)
+        return texture
+
+    def draw(self, blit_sequence):
+        """draw the next frame with textures instead of the canvas
+
+           Surfaces, which are not part of a SurfaceSequence of the asset
+           manager (e.g. rendered text), get a cached texture (see
+           surface_texture).
+
+           Args: blit_sequence -> list of (surface, position) pairs
+        """
+        self.upload()
+        self.renderer.clear()
+        for surface, position in blit_sequence:
+            texture = self.textures.get(id(surface))
+            if texture is None:
+                texture = self.surface_texture(surface)
+            texture.draw(dstrect=(int(position[0]), int(position[1]),
+                                  texture.width, texture.height))
+        self.last_frame = blit_sequence
+        self.drawn = True
+
+    def present(self, dirty_rects=None):
+        """show the frame in the window
+
+           Args: dirty_rects -> list of changed areas of the canvas, None if
+                                the whole canvas changed
+        """
+        if self.drawn:
+            self.drawn = False
+            self.renderer.present()
+            return
+        if dirty_rects == []:
+            return
+        self.last_frame = []
+        if dirty_rects is None:
+            self.canvas_texture.update(self.canvas)
+        else:
+            bounds = self.canvas.get_rect()
+            for rect in dirty_rects:
+                rect = bounds.clip(rect)
+                if rect.width and rect.height:
+                    self.canvas_texture.update(self.canvas.subsurface(rect),
+                                               rect)
+        self.renderer.clear()
+        self.canvas_texture.draw()
+        self.renderer.present()
+
+    def screenshot(self):
+        """Returns: a copy of the unscaled 640*480 frame"""
+        frame = self.canvas.copy()
+        if self.last_frame:
+            #the last frame was drawn with textures, repeat it in software
+            frame.blits(self.last_frame, doreturn=False)
+        return frame
+
+    def copy_frame(self, target):
+        """copy the unscaled 640*480 frame onto a surface of the same size,
+           without allocating a new one
+
+           Args: target -> pygame.Surface
+        """
+        target.blit(self.canvas, (0, 0))
+        if self.last_frame:
+            target.blits(self.last_frame, doreturn=False)
+
+    def render_queue(self):
+        """Returns: a TextureRenderQueue, which draws on this screen"""
+        return TextureRenderQueue(self)
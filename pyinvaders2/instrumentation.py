@@ -0,0 +1,419 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+
+"""
+This module connects PyInvaders2 to profiling and debugging tools
+
+The game reports events with emit(), tools register functions for these
+events with add_hook(). Without registered hooks an event costs a dictionary
+lookup.
+
+Events:
+    'cull'        -> (tick, counts) once per tick of the game, counts is a
+                     dict with entity kind -> (live, culled) number of
+                     entities
+    'frame start' -> (tick) before the game advances by one tick
+    'frame end'   -> (tick) after the tick was rendered, before the frame is
+                     presented
+
+Parts of the game, that hold memory (asset caches, entity lists, textures),
+register a function with add_memory_source(), memory_report() collects the
+number of bytes of all of them.
+
+Slow parts of a frame (scene phases, asset loads, sound playback, score I/O)
+are wrapped in span(). After start_tracing() the spans, the garbage
+collections and the entity counts are written to a trace file, which opens in
+chrome://tracing or ui.perfetto.dev. Without a running trace a span costs a
+function call.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+_hooks = {}
+_memory_sources = {}
+_tracer = None
+#returned by span(), while nothing gets traced
+_NO_SPAN = contextlib.nullcontext()
+
+def add_hook(event, function):
+    """call the function for every emitted event
+
+       Args: event    -> string, name of the event
+             function -> callable, gets the arguments of the event
+    """
+    _hooks.setdefault(event, []).append(function)
+
+def remove_hook(event, function):
+    """stop calling a function registered with add_hook()"""
+    functions = _hooks.get(event, [])
+    if function in functions:
+        functions.remove(function)
+    if not functions:
+        _hooks.pop(event, None)
+
+def hooked(event):
+    """check if any function is registered for the event, so the arguments
+       of rare events only get collected if somebody listens"""
+    return event in _hooks
+
+def emit(event, *args):
+    """call all functions registered for the event with the arguments"""
+    for function in _hooks.get(event, ()):
+        function(*args)
+
+def add_memory_source(name, function):
+    """report the memory held by a part of the game in memory_report()
+
+       Args: name     -> string, e.g. 'assets'
+             function -> callable, returns a dict with label -> bytes
+    """
+    _memory_sources[name] = function
+
+def remove_memory_source(name):
+    """stop reporting a source registered with add_memory_source()"""
+    _memory_sources.pop(name, None)
+
+def memory_report():
+    """Returns: dict with source name -> dict with label -> bytes"""
+    return {name: function() for name, function in _memory_sources.items()}
+
+def format_memory_report(report=None):
+    """Returns: string with the bytes of every label and the sum of every
+                source in kilobytes
+
+       Args: report -> result of memory_report(), default is the current one
+    """
+    if report is None:
+        report = memory_report()
+    lines = ["memory:"]
+    for name in sorted(report):
+        labels = report[name]
+        lines.append("  {}: {:.0f} KB".format(
+            name, sum(labels.values()) / 1024
+        ))
+        for label in sorted(labels, key=labels.get, reverse=True):
+            lines.append("    {}: {:.1f} KB".format(label,
+                                                   labels[label] / 1024))
+    return "\n".join(lines)
+
+def object_bytes(objects):
+    """Returns: the number of bytes of the objects and their attribute
+                dictionaries, without the objects they refer to
+
+       Args: objects -> list of objects, e.g. an entity list
+    """
+    total = sys.getsizeof(objects)
+    for item in objects:
+        total += sys.getsizeof(item)
+        if hasattr(item, '__dict__'):
+            total += sys.getsizeof(item.__dict__)
+    return total
+
+class CullingStats(object):
+    """Sums up the live and culled entities of the 'cull' events
+
+       Register an instance with add_hook('cull', stats).
+    """
+    def __init__(self):
+        self.ticks = 0
+        self.live = {}
+        self.culled = {}
+
+    def __call__(self, tick, counts):
+        self.ticks += 1
+        for kind, (live, culled) in counts.items():
+            self.live[kind] = self.live.get(kind, 0) + live
+            self.culled[kind] = self.culled.get(kind, 0) + culled
+
+    def summary(self):
+        """Returns: string with the mean number of live entities per tick
+                    and the total number of culled entities of every kind
+        """
+        lines = ["culling in {} ticks:".format(self.ticks)]
+        for kind in sorted(self.live):
+            lines.append("  {}: {:.1f} live per tick, {} culled".format(
+                kind, self.live[kind] / max(self.ticks, 1),
+                self.culled[kind]
+            ))
+        return "\n".join(lines)
+
+class AllocationTracker(object):
+    """Finds the lines of code, which allocate memory in the frames of the
+       game loop, with tracemalloc
+
+       The traces are cleared at the start of every frame, so the snapshot
+       at its end contains only the blocks allocated during the frame, which
+       are still alive. The peak of the traced memory also covers the
+       temporary blocks, which were freed before the end of the frame.
+
+       Args: frames -> number of stack frames stored per allocation
+    """
+    def __init__(self, frames=1):
+        self.frames = frames
+        self.ticks = 0
+        #allocation site -> [bytes, blocks] summed over all frames
+        self.sites = {}
+        self.peak = 0
+        self.transient = 0
+        self.filters = (tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, __file__))
+
+    def start(self):
+        """start tracemalloc and listen to the frame events"""
+        tracemalloc.start(self.frames)
+        add_hook('frame start', self.frame_start)
+        add_hook('frame end', self.frame_end)
+
+    def stop(self):
+        """stop tracemalloc and the listening"""
+        remove_hook('frame start', self.frame_start)
+        remove_hook('frame end', self.frame_end)
+        tracemalloc.stop()
+
+    def frame_start(self, tick):
+        """forget the allocations of the previous frames"""
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+
+    def frame_end(self, tick):
+        """add the allocations of the frame to the sites"""
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        self.ticks += 1
+        self.peak = max(self.peak, peak)
+        self.transient += peak
+        for statistic in snapshot.statistics('lineno'):
+            site = self.sites.setdefault(statistic.traceback, [0, 0])
+            site[0] += statistic.size
+            site[1] += statistic.count
+
+    def summary(self, limit=10):
+        """Returns: string with the mean and maximal peak of the memory
+                    allocated per frame and the sites, which allocated the
+                    most memory, that was still alive at the end of a frame
+
+           Args: limit -> number of listed allocation sites
+        """
+        ticks = max(self.ticks, 1)
+        lines = ["allocations in {} frames: {:.1f} KB peak per frame, "
+                 "{:.1f} KB at most".format(self.ticks,
+                                            self.transient / ticks / 1024,
+                                            self.peak / 1024)]
+        sites = sorted(self.sites.items(), key=lambda item: item[1][0],
+                       reverse=True)
+        for traceback, (size, count) in sites[:limit]:
+            frame = traceback[0]
+            lines.append("  {}:{}: {:.0f} B in {:.1f} blocks per "
+                         "frame".format(frame.filename, frame.lineno,
+                                        size / ticks, count / ticks))
+        return "\n".join(lines)
+
+class ChromeTracer(object):
+    """Writes trace events in the JSON array format of the Chrome trace
+       viewer
+
+       Events of all threads are written to one file, every thread gets its
+       own track in the viewer.
+
+       Args: path -> path of the trace file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write("[")
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.threads = set()
+        self.events = 0
+        self.gc_start = None
+        #collections can happen while an event gets written, their events
+        #are written with the next one
+        self.gc_events = []
+
+    def timestamp(self, seconds=None):
+        """Returns: microseconds since the start of the trace
+
+           Args: seconds -> time.perf_counter() value, default is now
+        """
+        if seconds is None:
+            seconds = time.perf_counter()
+        return round((seconds - self.start) * 1000000, 1)
+
+    def write(self, event):
+        """write an event, the process and thread ids are added
+
+           Args: event -> dict with the fields of a trace event
+        """
+        thread = threading.get_ident()
+        event['pid'] = self.pid
+        event['tid'] = thread
+        with self.lock:
+            if thread not in self.threads:
+                self.threads.add(thread)
+                self._write({'ph': 'M', 'name': 'thread_name',
+                             'pid': self.pid, 'tid': thread,
+                             'args': {'name':
+                                      threading.current_thread().name}})
+            self._write(event)
+            while self.gc_events:
+                self._write(self.gc_events.pop(0))
+
+    def _write(self, event):
+        """append an event to the file, the lock has to be held"""
+        #a collection during dumps() only queues its event
+        text = json.dumps(event, separators=(',', ':'))
+        if self.events:
+            text = ",\n" + text
+        self.file.write(text)
+        self.events += 1
+
+    def complete(self, name, category, start, end, args=None):
+        """write a span, which started and ended at the perf_counter()
+           values
+        """
+        event = {'ph': 'X', 'name': name, 'cat': category,
+                 'ts': self.timestamp(start),
+                 'dur': round((end - start) * 1000000, 1)}
+        if args:
+            event['args'] = args
+        self.write(event)
+
+    def instant(self, name, category, args=None):
+        """write an event without duration"""
+        event = {'ph': 'i', 's': 't', 'name': name, 'cat': category,
+                 'ts': self.timestamp()}
+        if args:
+            event['args'] = args
+        self.write(event)
+
+    def counter(self, name, values):
+        """write the values of a counter track
+
+           Args: values -> dict with series name -> number
+        """
+        self.write({'ph': 'C', 'name': name, 'ts': self.timestamp(),
+                    'args': values})
+
+    def gc_callback(self, phase, info):
+        """queue the garbage collections, registered in gc.callbacks"""
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            end = time.perf_counter()
+            self.gc_events.append({
+                'ph': 'X', 'name': 'gc', 'cat': 'gc',
+                'ts': self.timestamp(self.gc_start),
+                'dur': round((end - self.gc_start) * 1000000, 1),
+                'pid': self.pid, 'tid': threading.get_ident(),
+                'args': {'generation': info['generation'],
+                         'collected': info['collected']},
+            })
+            self.gc_start = None
+
+    def count_entities(self, tick, counts):
+        """write the live entities of the 'cull' events as counters"""
+        self.counter('entities', {kind: live for kind, (live, culled)
+                                  in counts.items()})
+
+    def close(self):
+        """finish the trace file"""
+        with self.lock:
+            while self.gc_events:
+                self._write(self.gc_events.pop(0))
+            self.file.write("\n]\n")
+            self.file.close()
+
+class _Span(object):
+    """Measures the time of a with block for the running tracer"""
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        tracer = _tracer
+        if tracer is not None:
+            tracer.complete(self.name, self.category, self.start,
+                            time.perf_counter(), self.args)
+
+def start_tracing(path):
+    """write all spans, garbage collections and entity counts to a trace
+       file until stop_tracing()
+
+       Args: path -> path of the trace file
+    """
+    global _tracer
+    stop_tracing()
+    _tracer = ChromeTracer(path)
+    gc.callbacks.append(_tracer.gc_callback)
+    add_hook('cull', _tracer.count_entities)
+
+def stop_tracing():
+    """finish the trace file of start_tracing()"""
+    global _tracer
+    if _tracer is None:
+        return
+    tracer = _tracer
+    _tracer = None
+    gc.callbacks.remove(tracer.gc_callback)
+    remove_hook('cull', tracer.count_entities)
+    tracer.close()
+
+def tracing():
+    """check if a trace gets written, so costly span arguments only get
+       collected if they are used"""
+    return _tracer is not None
+
+def span(name, category='game', args=None):
+    """Returns: a context manager, which traces the time of its with block
+
+       Args: name     -> string, name of the span in the trace viewer
+             category -> string, e.g. 'scene', 'assets', 'sound', 'scores'
+             args     -> dict with details shown for the span
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _Span(name, category, args)
+
+def instant(name, category='game', args=None):
+    """trace a single moment, e.g. a level start"""
+    if _tracer is not None:
+        _tracer.instant(name, category, args)
@@ -0,0 +1,243 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+
+"""
+This module reads, writes and validates the level files of PyInvaders2
+
+A level file of the game has HEIGHT lines with WIDTH characters each, '#'
+for an invader and '0' for an empty place. The level creator also edits
+larger levels, the sizes can be relaxed with the width and height
+arguments. A decoded level is a tuple with one bitmask per line, bit n is
+set if there is an invader in column n.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+WIDTH = 19
+HEIGHT = 5
+INVADER = b'#'
+EMPTY = b'0'
+
+#translates a line to a binary number, which gets reversed, so that the
+#first column becomes the lowest bit
+_TO_BITS = bytes.maketrans(INVADER + EMPTY, b'10')
+
+class LevelError(ValueError):
+    """A level file is not valid
+
+       Args: message -> string, what is wrong
+             name    -> string, name or path of the level file
+             line    -> int, number of the line starting with 1, None if the
+                        error concerns the whole file
+             column  -> int, number of the column starting with 1
+    """
+    def __init__(self, message, name="<level>", line=None, column=None):
+        location = name
+        if line is not None:
+            location += ":%d" % line
+            if column is not None:
+                location += ":%d" % column
+        ValueError.__init__(self, "%s: %s" % (location, message))
+        self.message = message
+        self.name = name
+        self.line = line
+        self.column = column
+
+def decode_sized(data, name="<level>", width=WIDTH, height=HEIGHT):
+    """Returns: (tuple with the bitmasks of the lines, number of columns) of
+                a level
+
+       Args: data   -> bytes or string, the content of a level file
+             name   -> string, name of the file for error messages
+             width  -> expected number of columns, None to accept any
+                       number, as long as all lines have the same length
+             height -> expected number of lines, None to accept any number
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    lines = data.split(b'\n')
+    #the last line may end with a newline
+    if lines[-1] == b'':
+        lines.pop()
+    if not lines:
+        raise LevelError("the file is empty", name)
+    if height is not None and len(lines) != height:
+        raise LevelError("expected %d lines, found %d" % (height, len(lines)),
+                         name)
+    if width is None:
+        width = len(lines[0].rstrip(b'\r')) or 1
+    rows = []
+    for line_number, line in enumerate(lines, 1):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        invalid = line.translate(None, INVADER + EMPTY)
+        if invalid:
+            column = line.index(invalid[:1]) + 1
+            raise LevelError("invalid character %r, expected '#' or '0'" %
+                             invalid[:1].decode('latin-1'),
+                             name, line_number, column)
+        if len(line) != width:
+            raise LevelError("expected %d columns, found %d" % (width,
+                                                                len(line)),
+                             name, line_number,
+                             min(len(line), width) + 1)
+        rows.append(int(line[::-1].translate(_TO_BITS), 2))
+    return tuple(rows), width
+
+def decode(data, name="<level>", width=WIDTH, height=HEIGHT):
+    """Returns: tuple with the bitmasks of the lines of a level, the
+                arguments are the same as for decode_sized()
+    """
+    return decode_sized(data, name, width, height)[0]
+
+def encode(rows, width=WIDTH):
+    """Returns: string, the content of a level file
+
+       Args: rows  -> tuple with the bitmasks of the lines
+             width -> number of columns
+    """
+    text = ""
+    for row in rows:
+        text += format(row, "0%db" % width)[::-1].replace(
+            '1', '#'
+        ) + "\n"
+    return text
+
+def read_sized(file_path, width=None, height=None):
+    """Returns: (tuple with the bitmasks of the lines, number of columns) of
+                a level file
+
+       Raises LevelError, if the file can't be read or is not valid.
+
+       Args: file_path -> string, path of the level file
+             width     -> expected number of columns, None for any
+             height    -> expected number of lines, None for any
+    """
+    try:
+        with open(file_path, 'rb') as level_file:
+            data = level_file.read()
+    except OSError as error:
+        raise LevelError(error.strerror or str(error), file_path)
+    return decode_sized(data, file_path, width, height)
+
+def read(file_path, width=WIDTH, height=HEIGHT):
+    """Returns: tuple with the bitmasks of the lines of a level file, by
+                default of the size used by the game
+
+       Raises LevelError, if the file can't be read or is not valid.
+    """
+    return read_sized(file_path, width, height)[0]
+
+def columns(row):
+    """Returns: list with the numbers of the columns with an invader in the
+                bitmask of a line
+    """
+    result = []
+    while row:
+        lowest = row & -row
+        result.append(lowest.bit_length() - 1)
+        row ^= lowest
+    return result
+
+def positions(rows):
+    """Returns: list with the starting positions of the invaders of a level
+
+       Args: rows -> tuple with the bitmasks of the lines
+    """
+    return [(column * 32 + 32, line * 32 + 32)
+            for line, row in enumerate(rows) for column in columns(row)]
+
+def to_grid(rows, width=WIDTH):
+    """Returns: list of lines, every line is a list with a boolean per
+                column, True for an invader
+    """
+    return [[bool(row >> column & 1) for column in range(width)]
+            for row in rows]
+
+def from_grid(grid):
+    """Returns: tuple with the bitmasks of the lines of a grid created by
+                to_grid()
+    """
+    return tuple(sum(1 << column for column, place in enumerate(line)
+                     if place) for line in grid)
+
+def _validate(file_path):
+    """Returns: the LevelError of a file or None if it is valid"""
+    try:
+        read(file_path)
+    except LevelError as error:
+        return error
+
+def validate_directory(path, workers=None):
+    """check all .txt files of a directory
+
+       The files are read and decoded in a pool of threads.
+
+       Returns: (number of checked files, list with the LevelErrors sorted by
+                 file name)
+
+       Args: path    -> string, the directory
+             workers -> number of threads, None for the default of
+                        concurrent.futures
+    """
+    file_paths = sorted(entry.path for entry in os.scandir(path)
+                        if entry.name.endswith(".txt") and entry.is_file())
+    with ThreadPoolExecutor(workers) as executor:
+        errors = [error for error in executor.map(_validate, file_paths,
+                                                  chunksize=64)
+                  if error is not None]
+    return len(file_paths), errors
+
+def main(argv=None):
+    """check level files and directories given on the command line, the exit
+       status is 1 if any file is invalid"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        print("usage: pyinvaders-checklevels FILE|DIRECTORY...")
+        return 2
+    checked = 0
+    errors = []
+    for path in argv:
+        if os.path.isdir(path):
+            number, directory_errors = validate_directory(path)
+            checked += number
+            errors += directory_errors
+        else:
+            checked += 1
+            error = _validate(path)
+            if error is not None:
+                errors.append(error)
+    for error in errors:
+        print(error)
+    print("%d of %d level files are valid" % (checked - len(errors), checked))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
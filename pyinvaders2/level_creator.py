@@ -29,6 +29,8 @@ import sys
 import tkinter as tk
 from tkinter import filedialog as tkFileDialog
 from tkinter import messagebox as tkMessageBox
+from . import writer
+from . import level_codec
 
 from os.path import dirname, abspath
 import inspect
@@ -65,6 +67,9 @@ class Button(object):
         self.screen = pygame.display.get_surface()
         self.range = ((self.position[0], self.position[0] + self.size[0]),
                       (self.position[1], self.position[1] + self.size[1]))
+        self.rect = pygame.Rect(self.position, self.size)
+        self.hovered = None
+        self.changed = False
 
     def add_text(self, text, font, colour):
         font = font.render(text, 8, colour)
@@ -73,15 +78,159 @@ class Button(object):
         self.surface_a.blit(font, font_position)
         self.surface_p.blit(font, font_position)
 
+    def invalidate(self):
+        """draw the button again with the next call of handle()"""
+        self.hovered = None
+
     def handle(self, events, mouse_pos):
-        if mouse_over(self.range[0], self.range[1], mouse_pos):
-            self.screen.blit(self.surface_a, self.position)
-            if mouse_down(events):
-                return True
-        else:
-            self.screen.blit(self.surface_p, self.position)
+        """draw the button, if the mouse entered or left it, and check for a
+           click
+
+           The attribute changed tells, if the button was drawn.
+        """
+        hovered = bool(mouse_over(self.range[0], self.range[1], mouse_pos))
+        self.changed = hovered != self.hovered
+        if self.changed:
+            self.hovered = hovered
+            if hovered:
+                self.screen.blit(self.surface_a, self.position)
+            else:
+                self.screen.blit(self.surface_p, self.position)
+        if hovered and mouse_down(events):
+            return True
+
+class LevelGrid(object):
+    """The places of a level as one bitmask per line, with undo and redo
+
+       Every edit is stored as a compact diff: the sizes before and after the
+       edit and a XOR-mask for every changed line. Applying the XOR-masks
+       again reverts the edit, so one diff serves for undo and redo.
+
+       Areas are (column, line, width, height) tuples, None for the whole
+       grid.
+
+       Args: rows  -> list with the bitmasks of the lines, None for an empty
+                      level of the default size
+             width -> number of columns
+    """
+    MAX_HISTORY = 1000
+
+    def __init__(self, rows=None, width=level_codec.WIDTH):
+        if rows is None:
+            rows = [0] * level_codec.HEIGHT
+        self.rows = list(rows)
+        self.width = width
+        self.height = len(self.rows)
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def get(self, column, line):
+        """check if there is an invader at the place"""
+        return bool(self.rows[line] >> column & 1)
+
+    def _apply(self, size, xors):
+        """xor the lines with the masks and change the size of the grid"""
+        width, height = size
+        if height > len(self.rows):
+            self.rows += [0] * (height - len(self.rows))
+        for line, mask in xors.items():
+            self.rows[line] ^= mask
+        del self.rows[height:]
+        self.width, self.height = width, height
+
+    def edit(self, new_rows, size=None):
+        """replace lines and store the diff in the undo history
+
+           Args: new_rows -> dict, line number -> new bitmask
+                 size     -> (width, height) after the edit, None to keep
+                             the size
+        """
+        old_size = self.width, self.height
+        if size is None:
+            size = old_size
+        xors = {}
+        for line, row in new_rows.items():
+            if row != self.rows[line]:
+                xors[line] = row ^ self.rows[line]
+        if not xors and size == old_size:
+            return
+        self._apply(size, xors)
+        self.undo_stack.append((old_size, size, xors))
+        del self.undo_stack[:-self.MAX_HISTORY]
+        self.redo_stack = []
+
+    def undo(self):
+        """revert the last edit"""
+        if self.undo_stack:
+            diff = self.undo_stack.pop()
+            self._apply(diff[0], diff[2])
+            self.redo_stack.append(diff)
+
+    def redo(self):
+        """repeat the last reverted edit"""
+        if self.redo_stack:
+            diff = self.redo_stack.pop()
+            self._apply(diff[1], diff[2])
+            self.undo_stack.append(diff)
+
+    def clip(self, area):
+        """Returns: the part of the area inside the grid"""
+        if area is None:
+            return 0, 0, self.width, self.height
+        rect = pygame.Rect(area).clip((0, 0, self.width, self.height))
+        return rect.x, rect.y, rect.width, rect.height
+
+    def toggle(self, column, line):
+        """add or remove the invader at the place"""
+        self.edit({line: self.rows[line] ^ 1 << column})
+
+    def fill(self, area=None, value=True):
+        """place invaders on all places of the area or empty them"""
+        column, line, width, height = self.clip(area)
+        mask = ((1 << width) - 1) << column
+        new_rows = {}
+        for number in range(line, line + height):
+            if value:
+                new_rows[number] = self.rows[number] | mask
+            else:
+                new_rows[number] = self.rows[number] & ~mask
+        self.edit(new_rows)
+
+    def mirror(self, area=None, vertical=False):
+        """mirror the area from left to right or from top to bottom"""
+        column, line, width, height = self.clip(area)
+        if not width:
+            return
+        mask = ((1 << width) - 1) << column
+        new_rows = {}
+        for number in range(line, line + height):
+            row = self.rows[number]
+            if vertical:
+                source = self.rows[2 * line + height - 1 - number] & mask
+            else:
+                bits = format((row & mask) >> column, "0%db" % width)
+                source = int(bits[::-1], 2) << column
+            new_rows[number] = row & ~mask | source
+        self.edit(new_rows)
+
+    def resize(self, width, height):
+        """change the number of columns and lines, removed places get
+           emptied first, so the resize can be undone"""
+        width, height = max(width, 1), max(height, 1)
+        mask = (1 << width) - 1
+        new_rows = {}
+        for number, row in enumerate(self.rows):
+            new_rows[number] = row & mask if number < height else 0
+        self.edit(new_rows, (width, height))
 
 class LevelCreator(object):
+    #size of the visible part of the grid in places
+    VIEW_SIZE = 19, 5
+    BACKGROUND = 55, 55, 55
+    SELECTION = 255, 150, 0
+    ARROWS = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0),
+              pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+
     def __init__(self):
         pygame.init()
         self.screen = pygame.display.set_mode((800, 400))
@@ -90,10 +239,21 @@ class LevelCreator(object):
         self.font = pygame.font.Font(
             game_dir + "/textures/game_font.ttf", 50
         )
+        self.small_font = pygame.font.Font(
+            game_dir + "/textures/game_font.ttf", 18
+        )
 
     def main(self):
         self.selection_screen()
 
+    def get_events(self):
+        """wait for the next event, nothing gets drawn while there is no
+           input
+
+           Returns: list with all pending events
+        """
+        return [pygame.event.wait()] + pygame.event.get()
+
     def selection_screen(self):
         pygame.mouse.set_visible(True)
 
@@ -111,22 +271,62 @@ class LevelCreator(object):
         )
         button_load.add_text("Load Level", self.font, (0, 0, 0))
 
+        event_list = []
+        redraw = True
         while True:
+            if redraw:
+                self.screen.fill(self.BACKGROUND)
+                button_create.invalidate()
+                button_load.invalidate()
             mouse_position = pygame.mouse.get_pos()
-            event_list = pygame.event.get()
-            self.check_for_exit(event_list)
-            self.screen.fill((55, 55, 55))
-
+            action = None
             if button_create.handle(event_list, mouse_position):
-                self.edit_screen()
+                action = 'create'
             if button_load.handle(event_list, mouse_position):
-                lines = self.open_file()
-                self.edit_screen(lines)
+                action = 'load'
+            if redraw:
+                pygame.display.update()
+            else:
+                pygame.display.update([button.rect for button in
+                                       (button_create, button_load)
+                                       if button.changed])
+            redraw = action is not None
+            if action == 'create':
+                self.edit_screen()
+            elif action == 'load':
+                level = self.open_file()
+                if level is not None:
+                    self.edit_screen(*level)
 
-            pygame.display.update()
             self.fps_clock.tick(self.fps)
+            event_list = self.get_events()
+            self.check_for_exit(event_list)
+
+    def get_place(self, position, offset):
+        """Returns: (column, line) of the place in the grid at the screen
+                    position, None if there is no place
+
+           Args: position -> (x, y) on the screen
+                 offset   -> (column, line) of the upper left visible place
+        """
+        column = int(round((position[0] - 55) / 38.0))
+        line = int(round((position[1] - 71) / 38.0))
+        if (0 <= column < self.VIEW_SIZE[0] and
+            0 <= line < self.VIEW_SIZE[1]):
+            return column + offset[0], line + offset[1]
 
-    def edit_screen(self, lines=None):
+    def edit_screen(self, rows=None, width=level_codec.WIDTH):
+        """edit a level
+
+           Left click toggles a place, dragging with the right mouse button
+           selects an area. F fills and C clears the selection or the whole
+           grid, M (shift: from top to bottom) mirrors it. The arrow keys and
+           the mouse wheel scroll the grid, shift+arrow keys change its size.
+           Ctrl+Z and Ctrl+Y undo and redo the edits.
+
+           Args: rows  -> list with the bitmasks of the lines of the level
+                 width -> number of columns of the level
+        """
         button_back = Button(
             game_dir + "/gfx/button_flat_p.png",
             game_dir + "/gfx/button_flat_a.png",
@@ -139,43 +339,144 @@ class LevelCreator(object):
             (425, 275)
         )
         button_save.add_text("Save", self.font, (0, 0, 0))
-
+        buttons = button_back, button_save
 
         surface_empty = pygame.image.load(game_dir + "/gfx/empty.png")
         surface_invader = pygame.image.load(game_dir + "/gfx/invader.png")
 
-        if lines is None:
-            lines = [[], [], [], [], []]
-            for i in range(5):
-                for j in range(19):
-                    lines[i].append(False)
-        else:
-            pass
+        grid = LevelGrid(rows, width)
+        offset = [0, 0]
+        selection = None
+        select_start = None
+        #state of the places on the screen, only changed places get drawn
+        drawn = {}
+        status = None
+        redraw = True
+        event_list = []
+        pygame.key.set_repeat(300, 40)
         while True:
-            mouse_position = pygame.mouse.get_pos()
-            event_list = pygame.event.get()
-            self.check_for_exit(event_list)
-            self.screen.fill((55, 55, 55))
-            for i in range(5):
-                for j in range(19):
-                    position = 38 * j + 39, 38 * i + 55
-                    if lines[i][j]:
-                        self.screen.blit(surface_invader, position)
+            for event in event_list:
+                if (event.type == pygame.MOUSEBUTTONDOWN and
+                    event.button in (1, 3)):
+                    place = self.get_place(event.pos, offset)
+                    if place is None or not (place[0] < grid.width and
+                                             place[1] < grid.height):
+                        continue
+                    if event.button == 1:
+                        grid.toggle(*place)
                     else:
-                        self.screen.blit(surface_empty, position)
-            if mouse_down(event_list):
-               line = int(round((mouse_position[1] - 71) / 38.0))
-               number = int(round((mouse_position[0] - 55) / 38.0))
-               if number < 19 and line < 5:
-                   lines[line][number] = not lines[line][number]
+                        select_start = place
+                        selection = place + (1, 1)
+                elif event.type == pygame.MOUSEMOTION and select_start:
+                    place = self.get_place(event.pos, offset)
+                    if place is not None:
+                        selection = pygame.Rect(select_start, (1, 1)).union(
+                            (place, (1, 1))
+                        )
+                elif (event.type == pygame.MOUSEBUTTONUP and
+                      event.button == 3):
+                    select_start = None
+                elif event.type == pygame.MOUSEWHEEL:
+                    offset[0] += event.x
+                    offset[1] -= event.y
+                elif event.type == pygame.KEYDOWN:
+                    ctrl = event.mod & pygame.KMOD_CTRL
+                    shift = event.mod & pygame.KMOD_SHIFT
+                    if ctrl and event.key == pygame.K_z:
+                        if shift:
+                            grid.redo()
+                        else:
+                            grid.undo()
+                    elif ctrl and event.key == pygame.K_y:
+                        grid.redo()
+                    elif ctrl and event.key == pygame.K_a:
+                        selection = grid.clip(None)
+                    elif event.key == pygame.K_f:
+                        grid.fill(selection)
+                    elif event.key in (pygame.K_c, pygame.K_DELETE):
+                        grid.fill(selection, False)
+                    elif event.key == pygame.K_m:
+                        grid.mirror(selection, bool(shift))
+                    elif event.key == pygame.K_ESCAPE:
+                        selection = None
+                    elif event.key in self.ARROWS:
+                        move = self.ARROWS[event.key]
+                        if shift:
+                            grid.resize(grid.width + move[0],
+                                        grid.height + move[1])
+                        else:
+                            offset[0] += move[0]
+                            offset[1] += move[1]
+            offset[0] = max(min(offset[0], grid.width - self.VIEW_SIZE[0]), 0)
+            offset[1] = max(min(offset[1], grid.height - self.VIEW_SIZE[1]),
+                            0)
+            if selection is not None:
+                selection = pygame.Rect(grid.clip(selection))
 
+            dirty_rects = []
+            if redraw:
+                self.screen.fill(self.BACKGROUND)
+                for button in buttons:
+                    button.invalidate()
+                drawn = {}
+                status = None
+                dirty_rects.append(self.screen.get_rect())
+                redraw = False
+            new_status = "%dx%d, showing %d,%d" % (grid.width, grid.height,
+                                                   offset[0] + 1,
+                                                   offset[1] + 1)
+            if new_status != status:
+                status = new_status
+                status_rect = pygame.Rect(25, 10, 750, 40)
+                self.screen.fill(self.BACKGROUND, status_rect)
+                self.screen.blit(self.small_font.render(
+                    status, 8, (0, 0, 0)
+                ), status_rect)
+                self.screen.blit(self.small_font.render(
+                    "F fill  C clear  M mirror  Ctrl+Z undo  Ctrl+Y redo  "
+                    "shift+arrows resize", 8, (0, 0, 0)
+                ), status_rect.move(0, 20))
+                dirty_rects.append(status_rect)
+            for i in range(self.VIEW_SIZE[1]):
+                for j in range(self.VIEW_SIZE[0]):
+                    column, line = j + offset[0], i + offset[1]
+                    state = None
+                    if column < grid.width and line < grid.height:
+                        state = (grid.get(column, line),
+                                 selection is not None and
+                                 selection.collidepoint(column, line))
+                    if drawn.get((j, i), ()) == state:
+                        continue
+                    drawn[(j, i)] = state
+                    rect = pygame.Rect(38 * j + 39, 38 * i + 55, 32, 32)
+                    if state is None:
+                        self.screen.fill(self.BACKGROUND, rect)
+                    elif state[0]:
+                        self.screen.blit(surface_invader, rect)
+                    else:
+                        self.screen.blit(surface_empty, rect)
+                    if state is not None and state[1]:
+                        pygame.draw.rect(self.screen, self.SELECTION, rect, 2)
+                    dirty_rects.append(rect)
+
+            mouse_position = pygame.mouse.get_pos()
             if button_back.handle(event_list, mouse_position):
                 break
             if button_save.handle(event_list, mouse_position):
-                self.save_file(lines)
+                self.save_file(grid)
+                redraw = True
+            dirty_rects += [button.rect for button in buttons
+                            if button.changed]
 
-            pygame.display.update()
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
             self.fps_clock.tick(self.fps)
+            if not redraw:
+                event_list = self.get_events()
+                self.check_for_exit(event_list)
+            else:
+                event_list = []
+        pygame.key.set_repeat()
 
     def check_for_exit(self, events):
         """test if the window gets closed and exit the game"""
@@ -193,36 +494,22 @@ class LevelCreator(object):
         if level_file == '':
             return None
 
-        lines = [[], [], [], [], []]
-        num_lines = sum(1 for line in open(level_file))
-        if num_lines != 5:
-            self.messagebox("Invalid level_file")
-            sys.exit()
-        level_file = open(level_file, 'r')
-        for line, line_number in zip(level_file, range(5)):
-            for letter, number in zip(line, range(19)):
-                if letter == '#':
-                    lines[line_number].append(True)
-                else:
-                    lines[line_number].append(False)
-        level_file.close()
-        return lines
-
-    def save_file(self, lines):
+        try:
+            rows, width = level_codec.read_sized(level_file)
+        except level_codec.LevelError as error:
+            self.messagebox("Invalid level_file\n%s" % error)
+            return None
+        return list(rows), width
+
+    def save_file(self, grid):
         window = tk.Tk()       #setup main_window
         window.wm_withdraw()   #set main_window to invisible
         file_name = tkFileDialog.asksaveasfilename()
         window.destroy()       #close main_window
         if file_name == '':
             return None
-        level_file = open(file_name, "w")
-        for line in lines:
-            for place in line:
-                if place:
-                    level_file.write("#")
-                else:
-                    level_file.write("0")
-            level_file.write('\n')
+        level_text = level_codec.encode(grid.rows, grid.width)
+        writer.worker.write_file(file_name, level_text)
 
     def messagebox(self, message):
         """Opens a simple window with the message"""
@@ -0,0 +1,664 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module streams a running game over the local network
+
+The server runs the game headlessly at a fixed tick rate. The first client,
+which asks for it, controls the spaceship, all other clients spectate. Every
+tick the server encodes the visible state of the game (the sprites with
+their positions and animation frames, the score and the lives) once and
+sends it to all clients as the compressed difference to the state of the
+previous tick. A client, which reads too slowly, gets no differences until
+its connection drained, then it receives the complete state again, so one
+slow spectator never delays the game or the other clients.
+
+Messages are sent over TCP, every message starts with its type (1 byte) and
+the length of its payload (4 bytes, little endian):
+    HELLO    client -> server, the requested role
+    WELCOME  server -> client, the granted role and the tick rate
+    INPUT    client -> server, the pressed keys of the player (INPUT_*)
+    KEYFRAME server -> client, the zlib compressed state
+    DELTA    server -> client, the length of the state and the zlib
+             compressed XOR of the state with the previous one
+
+The client is thin, it only draws the received sprites with the images of
+the game.
+"""
+
+import os
+import sys
+import zlib
+import socket
+import struct
+import asyncio
+import argparse
+from collections import namedtuple
+import pygame
+from . import Scene, Game, PyInvaders2, game_dir
+from . import gametools as gt
+from . import assets
+from . import data
+from . import settings
+from .analyzer import PressedKeys
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+DEFAULT_PORT = 7373
+#type and length of the payload
+MESSAGE = struct.Struct("<BI")
+MAX_PAYLOAD = 1024 * 1024
+HELLO = 1
+WELCOME = 2
+INPUT = 3
+KEYFRAME = 4
+DELTA = 5
+#roles of the clients
+SPECTATOR = 0
+PLAYER = 1
+#role, tick rate
+WELCOME_DATA = struct.Struct("<BB")
+#length of the new state
+DELTA_DATA = struct.Struct("<I")
+#bits of the INPUT message -> keys of the spaceship
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_FIRE = 4
+INPUT_KEYS = ((INPUT_LEFT, pygame.K_LEFT), (INPUT_RIGHT, pygame.K_RIGHT),
+              (INPUT_FIRE, pygame.K_SPACE))
+#a synchronised client gets no more states, when more bytes are waiting
+#for it
+MAX_BUFFER = 64 * 1024
+
+#tick, level, score, lives, game over, number of sprites, the lives are
+#signed, because hits after the game over deduct below zero
+STATE = struct.Struct("<IHIbBH")
+#kind, animation frame, x, y
+SPRITE = struct.Struct("<BBhh")
+State = namedtuple("State", "tick level score lives game_over sprites")
+Sprite = namedtuple("Sprite", "kind frame x y")
+
+#kinds of the sprites
+KIND_INVADER = 0
+KIND_MISSILE_UP = 1
+KIND_MISSILE_DOWN = 2
+KIND_EXPLOSION = 3
+KIND_PLAYER = 4
+KIND_TRACKER_SCORE = 5
+KIND_TRACKER_LIVE = 6
+#kind -> (image, size, flipping, layer of the render queue)
+SPRITE_IMAGES = {
+    KIND_INVADER: ("/textures/invader.png", (32, 32), (False, False),
+                   Game.LAYER_INVADERS),
+    KIND_MISSILE_UP: ("/textures/missile.png", (32, 32), (False, False),
+                      Game.LAYER_MISSILES),
+    KIND_MISSILE_DOWN: ("/textures/missile.png", (32, 32), (False, True),
+                        Game.LAYER_MISSILES),
+    KIND_EXPLOSION: ("/textures/explosion.png", (64, 64), (False, False),
+                     Game.LAYER_EXPLOSIONS),
+    KIND_PLAYER: ("/textures/spaceship.png", (64, 64), (False, False),
+                  Game.LAYER_PLAYER),
+    KIND_TRACKER_SCORE: ("/textures/invader.png", (32, 32), (False, False),
+                         Game.LAYER_TRACKERS),
+    KIND_TRACKER_LIVE: ("/textures/spaceship.png", (64, 64), (False, False),
+                        Game.LAYER_TRACKERS),
+}
+
+class ProtocolError(ValueError):
+    """Raised for messages, which break the protocol"""
+
+def pack_message(message_type, payload=b""):
+    """Returns: bytes with the header and the payload of a message"""
+    return MESSAGE.pack(message_type, len(payload)) + payload
+
+async def read_message(reader):
+    """Returns: (type, payload) of the next message of an
+                asyncio.StreamReader
+
+       Raises asyncio.IncompleteReadError, if the connection was closed
+    """
+    message_type, length = MESSAGE.unpack(
+        await reader.readexactly(MESSAGE.size)
+    )
+    if length > MAX_PAYLOAD:
+        raise ProtocolError("message of %d bytes" % length)
+    return message_type, await reader.readexactly(length)
+
+def input_bits(pressed_keys):
+    """Returns: the INPUT bits of pygame.key.get_pressed()"""
+    bits = 0
+    if pressed_keys[pygame.K_LEFT] or pressed_keys[pygame.K_a]:
+        bits |= INPUT_LEFT
+    if pressed_keys[pygame.K_RIGHT] or pressed_keys[pygame.K_d]:
+        bits |= INPUT_RIGHT
+    if pressed_keys[pygame.K_SPACE]:
+        bits |= INPUT_FIRE
+    return bits
+
+def encode_state(game):
+    """Returns: bytes with the visible state of the game
+
+       The sprites are ordered like the layers of the game.
+
+       Args: game -> Game
+    """
+    tick = gt.clock.tick
+    sprites = []
+    for invader in game.invaders:
+        sprites.append(SPRITE.pack(
+            KIND_INVADER,
+            (tick + invader.phase) % invader.surface.surface_number,
+            invader.rect.x, invader.rect.y
+        ))
+    for missile in game.missiles:
+        kind = KIND_MISSILE_UP
+        if missile.direction == 'down':
+            kind = KIND_MISSILE_DOWN
+        sprites.append(SPRITE.pack(
+            kind, (tick + missile.phase) % missile.surface.surface_number,
+            missile.rect.x, missile.rect.y
+        ))
+    for explosion in game.explosions:
+        sprites.append(SPRITE.pack(
+            KIND_EXPLOSION, min(tick - explosion.start,
+                                explosion.surface.surface_number - 1),
+            explosion.rect.x, explosion.rect.y
+        ))
+    if not game.game_over:
+        player = game.player
+        sprites.append(SPRITE.pack(
+            KIND_PLAYER, tick % player.surface.surface_number,
+            player.rect.x, player.rect.y
+        ))
+    for tracker in game.trackers:
+        kind = KIND_TRACKER_LIVE
+        if tracker.destination == game.score.position:
+            kind = KIND_TRACKER_SCORE
+        sprites.append(SPRITE.pack(kind, 0, int(tracker.position[0]),
+                                   int(tracker.position[1])))
+    return STATE.pack(tick & 0xffffffff, game.level, game.score.score,
+                      game.live_bar.lives, game.game_over,
+                      len(sprites)) + b"".join(sprites)
+
+def decode_state(state):
+    """Returns: State with a list of Sprites
+
+       Args: state -> bytes returned by encode_state()
+    """
+    if len(state) < STATE.size:
+        raise ProtocolError("state is truncated")
+    header = STATE.unpack_from(state)
+    end = STATE.size + SPRITE.size * header[-1]
+    if len(state) != end:
+        raise ProtocolError("state has %d bytes, expected %d" %
+                            (len(state), end))
+    sprites = [Sprite(*sprite) for sprite in
+               SPRITE.iter_unpack(memoryview(state)[STATE.size:end])]
+    return State(*header[:-1], sprites=sprites)
+
+def _xor(first, second, length):
+    """Returns: the XOR of two byte strings, both are cut or padded with
+                zeros to the length"""
+    first = int.from_bytes(first[:length], 'little')
+    second = int.from_bytes(second[:length], 'little')
+    return (first ^ second).to_bytes(length, 'little')
+
+def diff(previous, state):
+    """Returns: the payload of a DELTA message, which turns the previous
+                state into the state"""
+    return DELTA_DATA.pack(len(state)) + zlib.compress(
+        _xor(previous, state, len(state)), 1
+    )
+
+def patch(previous, payload):
+    """Returns: the state of a DELTA message
+
+       Args: previous -> the state before the message
+             payload  -> the payload of the DELTA message
+    """
+    if len(payload) < DELTA_DATA.size:
+        raise ProtocolError("delta is truncated")
+    length, = DELTA_DATA.unpack_from(payload)
+    try:
+        changes = zlib.decompress(payload[DELTA_DATA.size:])
+    except zlib.error as error:
+        raise ProtocolError("broken delta: %s" % error)
+    if len(changes) != length:
+        raise ProtocolError("delta has %d bytes, expected %d" %
+                            (len(changes), length))
+    return _xor(previous, changes, length)
+
+class StateReceiver(object):
+    """Reassembles the messages of a server from the received bytes and
+       keeps the current state
+
+       Attributes: role      -> the granted role, None before the WELCOME
+                   tick_rate -> ticks per second of the server
+                   state     -> bytes of the current state, None before the
+                                first KEYFRAME
+                   updates   -> number of received states
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.role = None
+        self.tick_rate = None
+        self.state = None
+        self.updates = 0
+
+    def feed(self, received):
+        """handle all complete messages of the received bytes
+
+           Args: received -> bytes received from the server
+        """
+        self.buffer += received
+        while len(self.buffer) >= MESSAGE.size:
+            message_type, length = MESSAGE.unpack_from(self.buffer)
+            if length > MAX_PAYLOAD:
+                raise ProtocolError("message of %d bytes" % length)
+            end = MESSAGE.size + length
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[MESSAGE.size:end])
+            del self.buffer[:end]
+            self.handle(message_type, payload)
+
+    def handle(self, message_type, payload):
+        """apply a message of the server"""
+        if message_type == WELCOME:
+            self.role, self.tick_rate = WELCOME_DATA.unpack(payload)
+        elif message_type == KEYFRAME:
+            self.state = zlib.decompress(payload)
+            self.updates += 1
+        elif message_type == DELTA:
+            if self.state is None:
+                raise ProtocolError("delta before the first keyframe")
+            self.state = patch(self.state, payload)
+            self.updates += 1
+        else:
+            raise ProtocolError("unexpected message %d" % message_type)
+
+class Match(object):
+    """A game, which runs forever: the levels follow each other and a new
+       game starts after the game is over or the last level was cleared
+
+       Args: level_list -> data.LevelList
+    """
+    def __init__(self, level_list):
+        self.level_list = level_list
+        self.keys = PressedKeys()
+        self.games = 0
+        self.game = None
+        self.new_game()
+
+    def new_game(self):
+        """start a new game"""
+        self.game = Game(self.level_list)
+        self.game.player.controls = lambda: self.keys
+        self.games += 1
+
+    def set_input(self, bits):
+        """press the keys of the INPUT bits"""
+        self.keys = PressedKeys(key for bit, key in INPUT_KEYS if bits & bit)
+
+    def step(self):
+        """advance the game by one tick
+
+           Returns: bytes of the new state (see encode_state)
+        """
+        game = self.game
+        if game.game_over and game.go_delay.expired():
+            self.new_game()
+        elif not game.invaders and game.level >= len(self.level_list):
+            self.new_game()
+        game = self.game
+        if not game.invaders:
+            game.invaders = self.level_list[game.level].get_invaders()
+            game.level += 1
+        game.step()
+        #the server draws nothing
+        game.render_queue.collect()
+        return encode_state(game)
+
+class Connection(object):
+    """A client of the server
+
+       Attributes: writer -> asyncio.StreamWriter
+                   role   -> PLAYER or SPECTATOR
+                   synced -> True, if the client has the state of the last
+                             tick and gets the next one as DELTA
+    """
+    def __init__(self, writer, role):
+        self.writer = writer
+        self.role = role
+        self.synced = False
+
+class Server(object):
+    """Runs a Match and streams its states to the clients
+
+       Args: level_list -> data.LevelList
+             tick_rate  -> ticks per second
+             max_buffer -> bytes waiting for a client, above them it gets no
+                           states until its connection drained
+    """
+    def __init__(self, level_list, tick_rate=30, max_buffer=MAX_BUFFER):
+        self.match = Match(level_list)
+        self.tick_rate = tick_rate
+        self.max_buffer = max_buffer
+        self.connections = []
+        self.player = None
+        self.state = b""
+        self.server = None
+        self.stats = {'ticks': 0, 'keyframes': 0, 'deltas': 0, 'skipped': 0,
+                      'bytes': 0}
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """listen for clients
+
+           Returns: the port of the server, useful for port 0
+        """
+        self.server = await asyncio.start_server(self.handle_client, host,
+                                                 port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle_client(self, reader, writer):
+        """greet a client and read its input until it disconnects"""
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = None
+        try:
+            message_type, payload = await read_message(reader)
+            if message_type != HELLO:
+                return
+            role = SPECTATOR
+            if payload[:1] == bytes((PLAYER,)) and self.player is None:
+                role = PLAYER
+            connection = Connection(writer, role)
+            if role == PLAYER:
+                self.player = connection
+            writer.write(pack_message(WELCOME, WELCOME_DATA.pack(
+                role, self.tick_rate
+            )))
+            self.connections.append(connection)
+            while True:
+                message_type, payload = await read_message(reader)
+                if message_type == INPUT and connection is self.player:
+                    self.match.set_input(payload[0] if payload else 0)
+        except (asyncio.IncompleteReadError, asyncio.CancelledError,
+                ConnectionError, ProtocolError):
+            pass
+        finally:
+            if connection in self.connections:
+                self.connections.remove(connection)
+            if connection is not None and connection is self.player:
+                self.player = None
+                self.match.set_input(0)
+            writer.close()
+
+    def tick(self):
+        """advance the match by one tick and send the new state to the
+           clients, the messages are encoded once for all clients"""
+        previous = self.state
+        self.state = self.match.step()
+        self.stats['ticks'] += 1
+        delta = None
+        keyframe = None
+        for connection in self.connections:
+            transport = connection.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.max_buffer:
+                #the client misses this state, it needs a keyframe later
+                connection.synced = False
+                self.stats['skipped'] += 1
+                continue
+            if connection.synced:
+                if delta is None:
+                    delta = pack_message(DELTA, diff(previous, self.state))
+                message = delta
+                self.stats['deltas'] += 1
+            else:
+                if keyframe is None:
+                    keyframe = pack_message(KEYFRAME,
+                                            zlib.compress(self.state, 1))
+                message = keyframe
+                connection.synced = True
+                self.stats['keyframes'] += 1
+            connection.writer.write(message)
+            self.stats['bytes'] += len(message)
+
+    async def run(self):
+        """tick at the tick rate, until the task gets cancelled"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            self.tick()
+            deadline += 1.0 / self.tick_rate
+            delay = deadline - loop.time()
+            if delay < -1:
+                #far behind, e.g. after a suspend, skip the missed ticks
+                deadline = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    def close(self):
+        """stop listening and disconnect all clients"""
+        if self.server is not None:
+            self.server.close()
+        for connection in self.connections:
+            connection.writer.close()
+
+class Viewer(Scene):
+    """Shows the game of a server and sends the keys of the player
+
+       Args: host -> string, address of the server
+             port -> int, port of the server
+             role -> PLAYER or SPECTATOR, the server grants PLAYER only to
+                     one client at a time
+    """
+    needs_menu_background = False
+
+    def __init__(self, host, port, role=PLAYER):
+        super().__init__()
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.sendall(pack_message(HELLO, bytes((role,))))
+        self.socket.setblocking(False)
+        self.receiver = StateReceiver()
+        self.input = None
+        self.outgoing = bytearray()
+        self.sequences = {}
+        self.layers = {}
+        for kind, (path, size, flipping, layer) in SPRITE_IMAGES.items():
+            self.sequences[kind] = assets.manager.images(game_dir + path,
+                                                         size, flipping)
+            self.layers[kind] = layer
+        self.background = data.StaticObject((0, 0))
+        self.background.add_images(
+            game_dir + "/textures/background.png", (640, 480)
+        )
+        self.live_bar = data.LiveBar((370, 20))
+        self.score = data.Score((580, 20))
+        self.render_queue = self.upscaler.render_queue()
+
+    def receive(self):
+        """read all bytes, which arrived from the server
+
+           Returns: False, if the server closed the connection
+        """
+        while True:
+            try:
+                received = self.socket.recv(65536)
+            except BlockingIOError:
+                return True
+            except ConnectionError:
+                return False
+            if not received:
+                return False
+            self.receiver.feed(received)
+
+    def send_input(self):
+        """send the pressed keys, if they changed
+
+           The socket may take only a part of a message, the rest waits in
+           the outgoing buffer for the next frame.
+        """
+        bits = input_bits(pygame.key.get_pressed())
+        if bits != self.input:
+            self.outgoing += pack_message(INPUT, bytes((bits,)))
+            self.input = bits
+        if self.outgoing:
+            try:
+                sent = self.socket.send(self.outgoing)
+            except (BlockingIOError, ConnectionError):
+                #a closed connection is noticed by receive()
+                return
+            del self.outgoing[:sent]
+
+    def render(self, state):
+        """draw a State"""
+        gt.clock.tick = state.tick
+        self.live_bar.lives = state.lives
+        self.score.score = state.score
+        self.render_queue.add(*self.background.get_data(),
+                              layer=Game.LAYER_BACKGROUND)
+        for kind, frame, x, y in state.sprites:
+            surface = self.sequences[kind].handle(frame)
+            if kind == KIND_TRACKER_SCORE:
+                surface = data.ghost_surface(surface)
+            elif kind == KIND_TRACKER_LIVE:
+                surface = data.ghost_surface(surface, (32, 32))
+            self.render_queue.add(surface, (x, y), layer=self.layers[kind])
+        self.render_queue.add(*self.live_bar.get_data(),
+                              layer=Game.LAYER_HUD)
+        self.render_queue.add(*self.score.get_data(), layer=Game.LAYER_HUD)
+        self.render_queue.flush()
+
+    def main(self):
+        """show the game until the window gets closed, escape is pressed or
+           the server disconnects"""
+        try:
+            while True:
+                event_list = pygame.event.get()
+                self.check_for_exit(event_list)
+                if gt.check_for_keydown(pygame.K_ESCAPE, event_list):
+                    break
+                if not self.receive():
+                    print("the server closed the connection")
+                    break
+                if self.receiver.role == PLAYER:
+                    self.send_input()
+                if self.receiver.state is not None:
+                    self.render(decode_state(self.receiver.state))
+                self.scene_basics()
+        finally:
+            self.socket.close()
+
+def init_headless():
+    """set up the game without window and audio device for the server"""
+    #SDL turns SIGTERM into a quit event, which nobody reads here
+    os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+    game_settings = settings.Settings(os.devnull)
+    game_settings.update({'headless': True, 'renderer': 'software',
+                          'sound': False})
+    PyInvaders2(game_settings)
+
+async def serve(level_list, host, port, tick_rate):
+    """run a server until the task gets cancelled"""
+    server = Server(level_list, tick_rate)
+    port = await server.start(host, port)
+    print("serving on {}:{}".format(host, port))
+    try:
+        await server.run()
+    finally:
+        server.close()
+
+def server_argument_parser():
+    """Returns: argparse.ArgumentParser for the flags of the server"""
+    parser = argparse.ArgumentParser(
+        prog="pyinvaders-server",
+        description="Run a game for a player and spectators in the local "
+        "network"
+    )
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on, 0.0.0.0 for all "
+                        "interfaces")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port to listen on")
+    parser.add_argument("--tick-rate", type=int, default=30,
+                        help="ticks per second")
+    parser.add_argument("--levels", help="directory of the level files")
+    return parser
+
+def server_main(argv=None):
+    """run a server with the flags of the command line"""
+    if argv is None:
+        argv = sys.argv[1:]
+    arguments = server_argument_parser().parse_args(argv)
+    init_headless()
+    levels = None
+    if arguments.levels:
+        levels = os.path.join(arguments.levels, "")
+    try:
+        asyncio.run(serve(data.LevelList(levels), arguments.host,
+                          arguments.port, arguments.tick_rate))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def client_argument_parser():
+    """Returns: argparse.ArgumentParser for the flags of the client, all
+                other flags are settings of the game"""
+    parser = argparse.ArgumentParser(
+        prog="pyinvaders-client",
+        description="Play or watch the game of a server"
+    )
+    parser.add_argument("host", nargs="?", default="127.0.0.1",
+                        help="address of the server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port of the server")
+    parser.add_argument("--spectate", action="store_true",
+                        help="only watch, even if nobody controls the "
+                        "spaceship")
+    return parser
+
+def client_main(argv=None):
+    """connect to a server with the flags of the command line"""
+    if argv is None:
+        argv = sys.argv[1:]
+    arguments, game_arguments = client_argument_parser().parse_known_args(
+        argv
+    )
+    PyInvaders2(settings.load(game_arguments))
+    role = SPECTATOR if arguments.spectate else PLAYER
+    try:
+        viewer = Viewer(arguments.host, arguments.port, role)
+    except OSError as error:
+        gt.messagebox("couldn't connect to {}: {}".format(arguments.host,
+                                                          error))
+        return 1
+    viewer.main()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(server_main())
@@ -0,0 +1,412 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module stores the scores of PyInvaders2 in a SQLite database
+"""
+
+import os
+import sys
+import sqlite3
+import time
+import getpass
+import threading
+from collections import namedtuple
+from . import instrumentation
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+#days and weeks (starting on monday) since the epoch in UTC
+DAY = "CAST(created / 86400 AS INTEGER)"
+WEEK = "CAST((created / 86400 + 3) / 7 AS INTEGER)"
+
+#every entry upgrades the schema of the database from the version of its
+#index to the next one (PRAGMA user_version)
+MIGRATIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS scores (
+        id      INTEGER PRIMARY KEY,
+        player  TEXT    NOT NULL,
+        level   TEXT    NOT NULL,
+        score   INTEGER NOT NULL,
+        created REAL    NOT NULL
+    );
+    """,
+    """
+    CREATE INDEX scores_score ON scores (score DESC);
+    CREATE INDEX scores_level ON scores (level, score DESC);
+    CREATE INDEX scores_player ON scores (player, score DESC);
+    CREATE INDEX scores_day ON scores ({day}, score DESC);
+    CREATE INDEX scores_week ON scores ({week}, score DESC);
+    CREATE TABLE score_counts (
+        score INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    );
+    INSERT INTO score_counts SELECT score, COUNT(*) FROM scores
+        GROUP BY score;
+    CREATE TRIGGER scores_count AFTER INSERT ON scores BEGIN
+        INSERT INTO score_counts VALUES (NEW.score, 1)
+            ON CONFLICT (score) DO UPDATE SET count = count + 1;
+    END;
+    """.format(day=DAY, week=WEEK),
+    """
+    CREATE TABLE level_score_counts (
+        level TEXT    NOT NULL,
+        score INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (level, score)
+    );
+    INSERT INTO level_score_counts SELECT level, score, COUNT(*) FROM scores
+        GROUP BY level, score;
+    CREATE TRIGGER scores_level_count AFTER INSERT ON scores BEGIN
+        INSERT INTO level_score_counts VALUES (NEW.level, NEW.score, 1)
+            ON CONFLICT (level, score) DO UPDATE SET count = count + 1;
+    END;
+    """,
+)
+
+Entry = namedtuple("Entry", "player level score created")
+
+def split_statements(script):
+    """Returns: list with the single SQL statements of a script"""
+    statements = []
+    current = ""
+    for part in script.split(";"):
+        current += part + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \n;"):
+                statements.append(current)
+            current = ""
+    return statements
+
+def default_path():
+    """Returns: the path of the score database
+
+       The path can be set with the environment variable PYINVADERS2_SCORES,
+       otherwise the database is placed in the XDG data directory.
+    """
+    if os.environ.get("PYINVADERS2_SCORES"):
+        return os.environ["PYINVADERS2_SCORES"]
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    return os.path.join(data_home, "pyinvaders2", "scores.sqlite3")
+
+def default_player():
+    """Returns: the name of the current user, used as player name"""
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "player"
+
+class ScoreStore(object):
+    """All scores ever reached, stored in a SQLite database
+
+       Every write is a transaction, so the database never contains half
+       written scores. The database runs in WAL mode and waits for locks of
+       other writers, which allows many processes to add scores at the same
+       time. Queries are cached until any connection changes the database.
+
+       Args: path    -> path of the database file, ':memory:' for a
+                        temporary database
+             timeout -> seconds to wait for the locks of other writers
+    """
+    def __init__(self, path=None, timeout=10.0):
+        if path is None:
+            path = default_path()
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.cache = {}
+        self.data_version = None
+
+    def migrate(self):
+        """bring the schema of the database up to date"""
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            version = self.connection.execute(
+                "PRAGMA user_version"
+            ).fetchone()[0]
+            for number in range(version, len(MIGRATIONS)):
+                for statement in split_statements(MIGRATIONS[number]):
+                    self.connection.execute(statement)
+            self.connection.execute(
+                "PRAGMA user_version = %d" % len(MIGRATIONS)
+            )
+
+    def _transaction(self, statement, rows):
+        """execute a statement for all rows in one transaction"""
+        with instrumentation.span('write scores', 'scores',
+                                  {'rows': len(rows)}), self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(statement, rows)
+        self.cache = {}
+
+    def add(self, score, player=None, level="", created=None):
+        """add a score
+
+           Args: score   -> int, the reached score
+                 player  -> string, name of the player
+                 level   -> string, name of the last level file
+                 created -> float, unix timestamp, default is now
+        """
+        self.add_many([(score, player, level, created)])
+
+    def add_many(self, entries):
+        """add multiple scores in one transaction
+
+           Args: entries -> list of (score, player, level, created) tuples,
+                            with the defaults of add() for None values
+        """
+        rows = []
+        for score, player, level, created in entries:
+            if player is None:
+                player = default_player()
+            if created is None:
+                created = time.time()
+            rows.append((player, level or "", int(score), created))
+        self._transaction(
+            "INSERT INTO scores (player, level, score, created) "
+            "VALUES (?, ?, ?, ?)", rows
+        )
+
+    def query(self, statement, parameters=()):
+        """run a read only query, the result is cached until the database
+           changes
+
+           Returns: list of the result rows
+        """
+        #data_version changes, when an other connection modified the file
+        with instrumentation.span('query scores', 'scores'):
+            data_version = self.connection.execute(
+                "PRAGMA data_version"
+            ).fetchone()[0]
+            if data_version != self.data_version:
+                self.cache = {}
+                self.data_version = data_version
+            key = statement, tuple(parameters)
+            if key not in self.cache:
+                self.cache[key] = self.connection.execute(
+                    statement, parameters
+                ).fetchall()
+            return self.cache[key]
+
+    def memory(self):
+        """Returns: dict with the bytes of the cached query results"""
+        total = sys.getsizeof(self.cache)
+        for rows in self.cache.values():
+            total += sys.getsizeof(rows)
+            total += sum(sys.getsizeof(row) for row in rows)
+        return {'query cache': total}
+
+    def count(self):
+        """Returns: the number of stored scores"""
+        return self.query("SELECT COUNT(*) FROM scores")[0][0]
+
+    def import_score_file(self, score_file_path):
+        """import the highscores of an old .score file, if the store is
+           still empty
+
+           Args: score_file_path -> string, path to the .score file
+        """
+        if self.count() or not os.path.isfile(score_file_path):
+            return
+        entries = []
+        with open(score_file_path, "r") as score_file:
+            for line in score_file:
+                try:
+                    score = int(line)
+                except ValueError:
+                    continue
+                if score:
+                    entries.append((score, None, "", None))
+        if entries:
+            self.add_many(entries)
+
+    def close(self):
+        """close the connection to the database"""
+        self.connection.close()
+
+class Leaderboard(object):
+    """Ranked views on the scores of a ScoreStore
+
+       Every query is answered from an index of the store, so its cost
+       depends on the number of returned entries and not on the number of
+       stored scores.
+
+       Args: store -> ScoreStore
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def top(self, number=5, level=None, period=None, timestamp=None):
+        """Returns: list of the Entry tuples with the highest scores
+
+           Args: number    -> int, maximal number of entries
+                 level     -> string, only scores of this level file
+                 period    -> 'day' or 'week', only scores of the day/week
+                              of the timestamp (UTC)
+                 timestamp -> float, unix timestamp, default is now
+        """
+        conditions = []
+        parameters = []
+        if level is not None:
+            conditions.append("level = ?")
+            parameters.append(level)
+        if period is not None:
+            if timestamp is None:
+                timestamp = time.time()
+            bucket = {'day': DAY, 'week': WEEK}[period]
+            conditions.append(bucket + " = " +
+                              bucket.replace("created", "?"))
+            parameters.append(timestamp)
+        statement = "SELECT player, level, score, created FROM scores"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY score DESC LIMIT ?"
+        parameters.append(number)
+        return [Entry(*row) for row in self.store.query(statement,
+                                                        parameters)]
+
+    def best(self, player, level=None):
+        """Returns: the highest score of the player, None if the player has
+                    no scores
+
+           Args: player -> string, name of the player
+                 level  -> string, only scores of this level file
+        """
+        if level is None:
+            rows = self.store.query(
+                "SELECT MAX(score) FROM scores WHERE player = ?", (player,)
+            )
+        else:
+            rows = self.store.query(
+                "SELECT MAX(score) FROM scores WHERE level = ? AND "
+                "player = ?", (level, player)
+            )
+        return rows[0][0]
+
+    def rank(self, player, level=None):
+        """Returns: the position of the best score of the player among all
+                    scores (starting with 1), None if the player has no
+                    scores
+
+           Args: player -> string, name of the player
+                 level  -> string, only scores of this level file
+        """
+        best = self.best(player, level)
+        if best is None:
+            return None
+        #the count tables have one row per distinct score (of a level)
+        if level is None:
+            rows = self.store.query(
+                "SELECT TOTAL(count) FROM score_counts WHERE score > ?",
+                (best,)
+            )
+        else:
+            rows = self.store.query(
+                "SELECT TOTAL(count) FROM level_score_counts WHERE "
+                "level = ? AND score > ?", (level, best)
+            )
+        return int(rows[0][0]) + 1
+
+class ScoreWriter(object):
+    """Adds scores to a database in the background
+
+       The scores are written by a WriteWorker, scores submitted in a short
+       time are added in one transaction. The worker thread uses its own
+       ScoreStore, so other stores notice the changes. Scores, which can't
+       be written, are reported by the worker and dropped from the pending
+       scores. The lock only guards the list of the pending scores, it is
+       never held while the database is written.
+
+       Args: worker -> WriteWorker
+             path   -> path of the database file
+    """
+    def __init__(self, worker, path=None):
+        self.worker = worker
+        self.path = path
+        self.store = None
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, score, player=None, level="", created=None):
+        """add a score in the background, the arguments are the same as for
+           ScoreStore.add()
+        """
+        if player is None:
+            player = default_player()
+        if created is None:
+            created = time.time()
+        entry = (score, player, level, created)
+        with self.lock:
+            self.pending.append(entry)
+        self.worker.submit_batched(self, self._write, entry)
+
+    def _write(self, entries):
+        """add the entries to the database, runs in the worker thread
+
+           The entries leave the pending scores after the transaction, even
+           if they can't be written, the error is raised to the worker,
+           which reports it.
+        """
+        try:
+            if self.store is None:
+                self.store = ScoreStore(self.path)
+            self.store.add_many(entries)
+        finally:
+            with self.lock:
+                for entry in entries:
+                    self.pending.remove(entry)
+
+    def pending_entries(self):
+        """Returns: list with the Entries, which are not yet written
+
+           A score stays pending until its transaction committed. A reader,
+           which takes the pending entries before it queries the store, has
+           every score at least once and drops the pending ones, which it
+           found in the store (see without_stored()).
+        """
+        with self.lock:
+            return [Entry(player, level, score, created)
+                    for score, player, level, created in self.pending]
+
+def without_stored(pending, stored):
+    """Returns: list with the pending Entries, which are not among the
+                stored Entries, an entry is identified by its player and
+                its time
+
+       Args: pending -> Entries of ScoreWriter.pending_entries()
+             stored  -> Entries read from the store afterwards
+    """
+    written = set((entry.player, entry.created) for entry in stored)
+    return [entry for entry in pending
+            if (entry.player, entry.created) not in written]
@@ -0,0 +1,265 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module loads and saves the runtime settings of PyInvaders2
+
+The settings are read from (later sources override earlier ones):
+    1. the defaults
+    2. the performance profile
+    3. the config file
+    4. environment variables (PYINVADERS2_<NAME>, e.g. PYINVADERS2_FPS=60)
+    5. command line flags (--<name>, e.g. --fps 60)
+"""
+
+import os
+import argparse
+import configparser
+from . import writer
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+RESOLUTIONS = ((640, 480), (800, 600), (1024, 768), (1280, 960))
+RENDERERS = ('software', 'scaled', 'dirty', 'sdl2')
+SCALING_FILTERS = ('nearest', 'smooth')
+
+def parse_bool(value):
+    """convert 'true', 'yes', 'on', '1' and their opposites to a boolean"""
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError("not a boolean: %s" % value)
+
+def parse_resolution(value):
+    """convert '800x600' or '800*600' to a tuple"""
+    if isinstance(value, tuple):
+        return value
+    width, height = str(value).lower().replace('*', 'x').split('x')
+    return int(width), int(height)
+
+def format_value(value):
+    """convert a value to its representation in the config file"""
+    if isinstance(value, tuple):
+        return "%dx%d" % value
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+def choice(options):
+    """Returns: a parser, which accepts only the given options"""
+    def parse_choice(value):
+        value = str(value).strip().lower()
+        if value not in options:
+            raise ValueError("%s is not one of %s" % (value,
+                                                      ", ".join(options)))
+        return value
+    return parse_choice
+
+#name -> (parser, default value, help text)
+OPTIONS = {
+    'fps': (int, 30, "frame rate cap"),
+    'renderer': (choice(RENDERERS), 'dirty',
+                 "software: no scaling, scaled: scale the screen in "
+                 "software, dirty: scale and update only changed areas, "
+                 "sdl2: scale and draw the sprites on the graphics card"),
+    'resolution': (parse_resolution, (640, 480), "window size, e.g. 800x600"),
+    'scaling_filter': (choice(SCALING_FILTERS), 'nearest',
+                       "filter used to scale the screen"),
+    'vsync': (parse_bool, False, "wait for the vertical blank"),
+    'audio_buffer': (int, 512, "mixer buffer size in samples"),
+    'sound': (parse_bool, False, "play music and sound effects"),
+    'headless': (parse_bool, False,
+                 "run without window and audio device"),
+    'memory_budget': (int, 0,
+                      "megabytes for decoded images and sounds, above it "
+                      "assets get evicted and downsampled, 0 for no limit"),
+    'profiling': (parse_bool, False,
+                  "print the frame rate and write cProfile statistics"),
+    'profile_output': (str, "pyinvaders2.prof",
+                       "file for the cProfile statistics"),
+    'gc_freeze': (parse_bool, False,
+                  "collect garbage only between the levels, the collector "
+                  "is disabled during a wave"),
+    'allocation_report': (int, 0,
+                          "print the N lines, which allocate the most memory "
+                          "per frame of the game loop, 0 for no report"),
+    'trace_output': (str, "",
+                     "write a trace of every frame to this file, it opens "
+                     "in chrome://tracing and ui.perfetto.dev"),
+    'record_output': (str, "",
+                      "record the session as video file (encoded by ffmpeg) "
+                      "or as images, e.g. frames/%%05d.png"),
+    'record_buffers': (int, 8,
+                       "frames waiting for the encoder, further frames are "
+                       "dropped"),
+}
+
+#named performance profiles for different hardware classes
+PROFILES = {
+    'low': {'fps': 30, 'renderer': 'dirty', 'resolution': (640, 480),
+            'scaling_filter': 'nearest', 'vsync': False,
+            'audio_buffer': 1024, 'memory_budget': 3},
+    'standard': {},
+    'high': {'fps': 60, 'renderer': 'dirty', 'resolution': (1280, 960),
+             'scaling_filter': 'smooth', 'vsync': True,
+             'audio_buffer': 512},
+}
+
+def default_path():
+    """Returns: the path of the config file
+
+       The path can be set with the environment variable PYINVADERS2_CONFIG,
+       otherwise the config file is placed in the XDG config directory.
+    """
+    if os.environ.get("PYINVADERS2_CONFIG"):
+        return os.environ["PYINVADERS2_CONFIG"]
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(
+        os.path.expanduser("~"), ".config"
+    )
+    return os.path.join(config_home, "pyinvaders2", "settings.ini")
+
+class Settings(object):
+    """The runtime settings of the game
+
+       Every option of OPTIONS is an attribute of this object. Changes made
+       with set() are written back to the config file with save().
+
+       Args: path -> path of the config file
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = default_path()
+        self.path = path
+        self.profile = 'standard'
+        self.stored_profile = None
+        self.stored = {}
+        self.profiles = dict(PROFILES)
+        for name, option in OPTIONS.items():
+            setattr(self, name, option[1])
+
+    def update(self, values):
+        """set multiple options, the values are parsed
+
+           Args: values -> dict, option name -> value (string or parsed)
+        """
+        for name, value in values.items():
+            if name not in OPTIONS:
+                raise KeyError("unknown setting: %s" % name)
+            setattr(self, name, OPTIONS[name][0](value))
+
+    def set(self, name, value):
+        """change an option and remember it for the config file"""
+        self.update({name: value})
+        self.stored[name] = getattr(self, name)
+
+    def read_file(self):
+        """Returns: (profile name, dict with the settings) of the config
+                    file
+        """
+        parser = configparser.ConfigParser()
+        parser.read(self.path)
+        for section in parser.sections():
+            if section.startswith("profile."):
+                self.profiles[section[8:]] = dict(parser[section])
+        values = {}
+        if parser.has_section("settings"):
+            values = dict(parser["settings"])
+        return values.pop("profile", None), values
+
+    def save(self):
+        """write the profile and all changed options to the config file in
+           the background"""
+        lines = ["[settings]"]
+        if self.stored_profile is not None:
+            lines.append("profile = %s" % self.stored_profile)
+        for name, value in sorted(self.stored.items()):
+            lines.append("%s = %s" % (name, format_value(value)))
+        for name, profile in sorted(self.profiles.items()):
+            if name in PROFILES:
+                continue
+            lines.append("")
+            lines.append("[profile.%s]" % name)
+            for option, value in sorted(profile.items()):
+                lines.append("%s = %s" % (option, format_value(value)))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        writer.worker.write_file(self.path, "\n".join(lines) + "\n")
+
+def read_environment(environ=None):
+    """Returns: (profile name, dict with the settings) of the environment"""
+    if environ is None:
+        environ = os.environ
+    values = {}
+    for name in OPTIONS:
+        key = "PYINVADERS2_" + name.upper()
+        if key in environ:
+            values[name] = environ[key]
+    return environ.get("PYINVADERS2_PROFILE"), values
+
+def argument_parser():
+    """Returns: argparse.ArgumentParser for the command line flags"""
+    parser = argparse.ArgumentParser(
+        prog="pyinvaders",
+        description="A python-based clone of the game Space Invaders"
+    )
+    parser.add_argument("--config", help="path of the config file")
+    parser.add_argument("--profile", help="performance profile: " +
+                        ", ".join(sorted(PROFILES)))
+    for name, option in OPTIONS.items():
+        parser.add_argument("--" + name.replace('_', '-'), dest=name,
+                            help=option[2])
+    return parser
+
+def load(argv=(), environ=None):
+    """Returns: Settings from all sources
+
+       Args: argv    -> list of command line arguments
+             environ -> dict of environment variables, default os.environ
+    """
+    arguments = vars(argument_parser().parse_args(list(argv)))
+    settings = Settings(arguments.pop("config"))
+    file_profile, file_values = settings.read_file()
+    settings.stored_profile = file_profile
+    env_profile, env_values = read_environment(environ)
+    cli_values = {name: value for name, value in arguments.items()
+                  if value is not None and name != "profile"}
+
+    profile = arguments["profile"] or env_profile or file_profile
+    if profile is not None and profile not in settings.profiles:
+        raise SystemExit("unknown profile: %s" % profile)
+    try:
+        if profile is not None:
+            settings.profile = profile
+            #profiles of the config file may have misspelled values as well
+            settings.update(settings.profiles[profile])
+        settings.update(file_values)
+        settings.stored = {name: getattr(settings, name)
+                           for name in file_values}
+        settings.update(env_values)
+        settings.update(cli_values)
+    except (KeyError, ValueError) as error:
+        raise SystemExit("invalid setting: %s" % error)
+    return settings
@@ -0,0 +1,214 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module saves the state of a running game in a compact binary snapshot
+and restores it
+
+A snapshot contains everything, that the next ticks depend on: the clock, all
+timers, the entities, the counters of the game and the state of the random
+module. Surfaces, sounds and the level list are not part of it, a snapshot is
+restored into a Game, which was created with the same levels. Timers and
+animations are stored relative to the tick, so a snapshot of a game with
+50 entities has about 3 KB, most of it is the random state.
+
+Snapshots are immutable bytes, worker processes can share one snapshot and
+branch from it without copying it.
+"""
+
+import struct
+import random
+from . import gametools as gt
+from . import data
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+MAGIC = b"PIS"
+VERSION = 1
+#magic, version, tick, level, score, shots, lives, game over, invader
+#direction, bottom of the formation, player x and y, timers of the player
+#reload, the descent and the game over, number of invaders, missiles,
+#explosions and trackers, the lives are signed, because hits after the game
+#over deduct below zero
+HEADER = struct.Struct("<3sBqHIIbBBihhiiiHHHH")
+#x, y, animation phase, armed, reload timer
+INVADER = struct.Struct("<hhiBi")
+#x, y, direction, ticks since the start of the animation
+MISSILE = struct.Struct("<hhBi")
+#x, y, start tick
+EXPLOSION = struct.Struct("<hhi")
+#x, y, speed x and y, destination, wait timer
+TRACKER = struct.Struct("<ddddBi")
+#version of the random generator, 624 state words and the position
+RANDOM_STATE = struct.Struct("<B625I")
+
+DIRECTIONS = ('LEFT', 'RIGHT')
+MISSILE_DIRECTIONS = ('up', 'down')
+#destinations of the trackers: the live bar and the score
+TRACKER_LIVE = 0
+TRACKER_SCORE = 1
+#timers are stored as deadline - tick, expired timers are negative
+NO_TIMER = -0x80000000
+
+class SnapshotError(ValueError):
+    """Raised for data, which is not a snapshot of this version"""
+
+def _remaining(timer):
+    """Returns: the ticks until the deadline of a timer, NO_TIMER for
+                None"""
+    if timer is None:
+        return NO_TIMER
+    return timer.deadline - gt.clock.tick
+
+def take(game):
+    """Returns: bytes with the state of the game
+
+       Args: game -> Game
+    """
+    tick = gt.clock.tick
+    player = game.player.rect
+    parts = [HEADER.pack(
+        MAGIC, VERSION, tick, game.level, game.score.score, game.shots,
+        game.live_bar.lives, game.game_over,
+        DIRECTIONS.index(game.iv_direction), game.invaders.bottom,
+        player.x, player.y, _remaining(game.player.reload),
+        _remaining(game.iv_down), _remaining(game.go_delay),
+        len(game.invaders), len(game.missiles), len(game.explosions),
+        len(game.trackers)
+    )]
+    parts.extend(INVADER.pack(invader.rect.x, invader.rect.y, invader.phase,
+                              invader.armed, _remaining(invader.reload))
+                 for invader in game.invaders)
+    parts.extend(MISSILE.pack(missile.rect.x, missile.rect.y,
+                              MISSILE_DIRECTIONS.index(missile.direction),
+                              missile.phase + tick)
+                 for missile in game.missiles)
+    parts.extend(EXPLOSION.pack(explosion.rect.x, explosion.rect.y,
+                                explosion.start - tick)
+                 for explosion in game.explosions)
+    parts.extend(TRACKER.pack(tracker.position[0], tracker.position[1],
+                              tracker.speed[0], tracker.speed[1],
+                              TRACKER_SCORE if tracker.destination ==
+                              game.score.position else TRACKER_LIVE,
+                              _remaining(tracker.wait))
+                 for tracker in game.trackers)
+    version, state, gauss = random.getstate()
+    parts.append(RANDOM_STATE.pack(version, *state))
+    return b"".join(parts)
+
+def _records(record, buffer, offset, number):
+    """Returns: (list of the unpacked records, offset after them)"""
+    end = offset + record.size * number
+    if end > len(buffer):
+        raise SnapshotError("snapshot is truncated")
+    return list(record.iter_unpack(buffer[offset:end])), end
+
+def _start(ticks):
+    """Returns: a timer, which expires after the ticks, None for
+                NO_TIMER"""
+    if ticks == NO_TIMER:
+        return None
+    return gt.timers.start(ticks)
+
+def restore(game, snapshot):
+    """replace the state of the game with the state of a snapshot
+
+       All timers of the scheduler are replaced by the timers of the
+       snapshot. Semi transparent trackers show the first frame of their
+       sprite.
+
+       Args: game     -> Game, created with the levels of the snapshot
+             snapshot -> bytes returned by take()
+    """
+    buffer = memoryview(snapshot)
+    if len(buffer) < HEADER.size:
+        raise SnapshotError("snapshot is truncated")
+    (magic, version, tick, level, score, shots, lives, game_over,
+     direction, bottom, player_x, player_y, reload, iv_down, go_delay,
+     invaders, missiles, explosions,
+     trackers) = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError("not a snapshot of version %d" % VERSION)
+    offset = HEADER.size
+    invaders, offset = _records(INVADER, buffer, offset, invaders)
+    missiles, offset = _records(MISSILE, buffer, offset, missiles)
+    explosions, offset = _records(EXPLOSION, buffer, offset, explosions)
+    trackers, offset = _records(TRACKER, buffer, offset, trackers)
+    random_state, offset = _records(RANDOM_STATE, buffer, offset, 1)
+
+    gt.clock.tick = tick
+    gt.timers.clear()
+    game.level = level
+    game.score.score = score
+    game.shots = shots
+    game.live_bar.lives = lives
+    game.game_over = bool(game_over)
+    game.iv_direction = DIRECTIONS[direction]
+    game.iv_down = _start(iv_down)
+    game.go_delay = _start(go_delay)
+    game.player.rect.topleft = player_x, player_y
+    game.player.reload = gt.timers.start(reload)
+
+    formation = []
+    for x, y, phase, armed, reload in invaders:
+        invader = data.Invader((0, 0))
+        invader.rect.topleft = x, y
+        invader.phase = phase
+        invader.armed = bool(armed)
+        invader.reload.restart(reload)
+        formation.append(invader)
+    game.invaders = data.Formation(formation)
+    game.invaders.bottom = bottom
+
+    game.missiles[:] = []
+    for x, y, missile_direction, age in missiles:
+        missile = data.Missile((0, 0), MISSILE_DIRECTIONS[missile_direction])
+        missile.rect.topleft = x, y
+        missile.phase = age - tick
+        game.missiles.append(missile)
+
+    game.explosions[:] = []
+    for x, y, start in explosions:
+        explosion = data.Explosion((0, 0))
+        explosion.rect.topleft = x, y
+        explosion.start = start + tick
+        game.explosions.append(explosion)
+
+    game.trackers[:] = []
+    for x, y, speed_x, speed_y, destination, wait in trackers:
+        if destination == TRACKER_SCORE:
+            if data.Invader.surface is None:
+                #the class loads the sprite with its first instance
+                data.Invader((0, 0)).reload.cancel()
+            tracker = data.Tracker(data.Invader.surface.frame(0), (x, y),
+                                   game.score.position)
+        else:
+            tracker = data.Tracker(data.Spaceship.surface.frame(0), (x, y),
+                                   game.live_bar.left_pos, (32, 32))
+        tracker.speed = speed_x, speed_y
+        tracker.wait.restart(wait)
+        game.trackers.append(tracker)
+
+    state = random_state[0]
+    random.setstate((state[0], tuple(state[1:]), None))
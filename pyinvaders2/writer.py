@@ -0,0 +1,187 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+This module writes files and scores of PyInvaders2 in a background thread
+"""
+
+import os
+import sys
+import time
+import queue
+import atexit
+import tempfile
+import threading
+import traceback
+from collections import deque
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+def write_file_atomic(file_path, data):
+    """write a file completely or not at all
+
+       The data is written to a temporary file in the same directory, synced
+       to the disk and renamed over the old file.
+
+       Args: file_path -> string, path of the file
+             data      -> string or bytes, new content of the file
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    try:
+        with os.fdopen(handle, mode) as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        if os.path.exists(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)
+        else:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class WriteWorker(object):
+    """Runs write jobs in a background thread, so they never block the game
+       loop
+
+       Jobs submitted with the same batch key, while the worker was busy, are
+       combined into a single call. All queued jobs are finished, before the
+       interpreter exits.
+
+       Args: batch_size -> maximal number of jobs combined in one batch
+    """
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        #(seconds from submit to finish, seconds of the write) of the last
+        #jobs
+        self.latencies = deque(maxlen=1024)
+        self.jobs = 0
+        self.errors = 0
+        atexit.register(self.flush)
+
+    def _start(self):
+        """start the worker thread, if it is not running"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,
+                                               name="writer", daemon=True)
+                self.thread.start()
+
+    def submit(self, function, *args):
+        """run function(*args) in the background
+
+           Args: function -> callable, the write job
+        """
+        self.queue.put((None, function, args, time.perf_counter()))
+        self._start()
+
+    def submit_batched(self, key, function, item):
+        """run function([item, ...]) in the background, items with the same
+           key are combined into one call
+
+           Args: key      -> hashable, identifies the batch
+                 function -> callable, gets a list of all items of the batch
+                 item     -> one item of the batch
+        """
+        self.queue.put((key, function, item, time.perf_counter()))
+        self._start()
+
+    def write_file(self, file_path, data):
+        """write a file atomically in the background
+
+           Args: file_path -> string, path of the file
+                 data      -> string or bytes, new content of the file
+        """
+        self.submit(write_file_atomic, file_path, data)
+
+    def _collect(self):
+        """wait for a job and take all queued jobs up to the batch size"""
+        jobs = [self.queue.get()]
+        while len(jobs) < self.batch_size:
+            try:
+                jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def _run(self):
+        """the loop of the worker thread"""
+        while True:
+            jobs = self._collect()
+            batches = {}
+            calls = []
+            for key, function, payload, submitted in jobs:
+                if key is None:
+                    calls.append((function, payload, [submitted]))
+                elif key in batches:
+                    batches[key][1].append(payload)
+                    batches[key][2].append(submitted)
+                else:
+                    batches[key] = (function, [payload], [submitted])
+                    calls.append(batches[key])
+            for function, payload, submitted in calls:
+                started = time.perf_counter()
+                try:
+                    if isinstance(payload, list):
+                        function(payload)
+                    else:
+                        function(*payload)
+                except Exception:
+                    self.errors += 1
+                    traceback.print_exc(file=sys.stderr)
+                finished = time.perf_counter()
+                for time_submitted in submitted:
+                    self.latencies.append((finished - time_submitted,
+                                           finished - started))
+                self.jobs += len(submitted)
+            for job in jobs:
+                self.queue.task_done()
+
+    def flush(self):
+        """wait until all queued jobs are finished"""
+        if self.thread is not None:
+            self.queue.join()
+
+    def stats(self):
+        """Returns: dict with the number of finished jobs, failed calls and
+                    the mean and maximal latency (submit to finish) and
+                    write time of the last jobs in milliseconds
+        """
+        latencies = list(self.latencies)
+        result = {'jobs': self.jobs, 'errors': self.errors,
+                  'pending': self.queue.unfinished_tasks}
+        for index, name in enumerate(('latency', 'write')):
+            values = [latency[index] * 1000 for latency in latencies]
+            result[name + '_mean'] = sum(values) / max(len(values), 1)
+            result[name + '_max'] = max(values, default=0.0)
+        return result
+
+worker = WriteWorker()
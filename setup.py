@@ -24,7 +24,11 @@ setup(
 	entry_points={
 		'console_scripts' : [
 			'pyinvaders=pyinvaders2:game',
-			'pyinvaders-levelcreator=pyinvaders2:levelcreator'
+			'pyinvaders-levelcreator=pyinvaders2:levelcreator',
+			'pyinvaders-checklevels=pyinvaders2.level_codec:main',
+			'pyinvaders-analyze=pyinvaders2.analyzer:main',
+			'pyinvaders-server=pyinvaders2.netplay:server_main',
+			'pyinvaders-client=pyinvaders2.netplay:client_main'
 		]
 	}
 )
@@ -0,0 +1,200 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+Tests of the network play: a server on localhost streams its states to a
+player and several spectators, every client has to end up with exactly the
+state, which the server encoded for its game
+"""
+
+import socket
+import asyncio
+import unittest
+import pygame
+from pyinvaders2 import netplay
+from pyinvaders2 import data
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+SPECTATORS = 3
+TICKS = 60
+#seconds to wait for a message of the server
+TIMEOUT = 5
+
+def setUpModule():
+    netplay.init_headless()
+
+class Client(object):
+    """A client, which reads the messages of the server with a
+       StateReceiver
+
+       Args: reader -> asyncio.StreamReader
+             writer -> asyncio.StreamWriter
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.receiver = netplay.StateReceiver()
+        self.keyframes = 0
+        self.deltas = 0
+
+    async def receive(self, updates):
+        """read until the receiver got the number of states"""
+        while self.receiver.updates < updates:
+            message_type, payload = await asyncio.wait_for(
+                netplay.read_message(self.reader), TIMEOUT
+            )
+            if message_type == netplay.KEYFRAME:
+                self.keyframes += 1
+            elif message_type == netplay.DELTA:
+                self.deltas += 1
+            self.receiver.handle(message_type, payload)
+
+    async def welcome(self):
+        """read the WELCOME message of the server"""
+        while self.receiver.role is None:
+            self.receiver.handle(*await asyncio.wait_for(
+                netplay.read_message(self.reader), TIMEOUT
+            ))
+
+async def connect(port, role):
+    """Returns: a Client, which said HELLO to the server on localhost"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(netplay.pack_message(netplay.HELLO, bytes((role,))))
+    client = Client(reader, writer)
+    await client.welcome()
+    return client
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.server = netplay.Server(data.LevelList())
+
+    async def play(self):
+        """connect the clients and compare their states for every tick"""
+        try:
+            return await self.compare_states()
+        finally:
+            self.server.close()
+
+    async def compare_states(self):
+        """Returns: the Clients after TICKS ticks"""
+        port = await self.server.start("127.0.0.1", 0)
+        player = await connect(port, netplay.PLAYER)
+        #a second player has to spectate
+        spectators = [await connect(port, netplay.PLAYER)]
+        for number in range(SPECTATORS - 1):
+            spectators.append(await connect(port, netplay.SPECTATOR))
+        clients = [player] + spectators
+        self.assertEqual(player.receiver.role, netplay.PLAYER)
+        for client in spectators:
+            self.assertEqual(client.receiver.role, netplay.SPECTATOR)
+        player.writer.write(netplay.pack_message(
+            netplay.INPUT, bytes((netplay.INPUT_LEFT | netplay.INPUT_FIRE,))
+        ))
+        for tick in range(1, TICKS + 1):
+            if tick == TICKS // 2:
+                #as if the last spectator had read too slowly
+                self.server.connections[-1].synced = False
+            self.server.tick()
+            self.assertEqual(self.server.state,
+                             netplay.encode_state(self.server.match.game))
+            for client in clients:
+                await client.receive(tick)
+                self.assertEqual(client.receiver.state, self.server.state)
+        self.assertTrue(self.server.match.keys[pygame.K_LEFT])
+        self.assertTrue(self.server.match.keys[pygame.K_SPACE])
+        for client in clients[:-1]:
+            self.assertEqual(client.keyframes, 1)
+            self.assertEqual(client.deltas, TICKS - 1)
+        self.assertEqual(clients[-1].keyframes, 2)
+        self.assertEqual(clients[-1].deltas, TICKS - 2)
+        for client in clients:
+            client.writer.close()
+        return clients
+
+    def test_clients_get_the_state(self):
+        clients = asyncio.run(self.play())
+        state = netplay.decode_state(clients[0].receiver.state)
+        self.assertEqual(state.level, self.server.match.game.level)
+        self.assertTrue(any(sprite.kind == netplay.KIND_INVADER
+                            for sprite in state.sprites))
+
+class TestState(unittest.TestCase):
+    def test_game_over(self):
+        game = netplay.Match(data.LevelList()).game
+        game.game_over = True
+        #a missile hit the spaceship after the last live was lost
+        game.live_bar.lives = -1
+        state = netplay.decode_state(netplay.encode_state(game))
+        self.assertEqual(state.lives, -1)
+        self.assertTrue(state.game_over)
+        self.assertFalse(any(sprite.kind == netplay.KIND_PLAYER
+                             for sprite in state.sprites))
+
+class SlowSocket(object):
+    """A socket, which takes at most two bytes per send() and none every
+       second time"""
+    def __init__(self):
+        self.sent = bytearray()
+        self.calls = 0
+
+    def send(self, message):
+        self.calls += 1
+        if self.calls % 2:
+            raise BlockingIOError()
+        self.sent += message[:2]
+        return len(message[:2])
+
+    def close(self):
+        pass
+
+class TestViewer(unittest.TestCase):
+    def test_partial_sends(self):
+        listener = socket.create_server(("127.0.0.1", 0))
+        try:
+            viewer = netplay.Viewer(*listener.getsockname())
+        finally:
+            listener.close()
+        viewer.socket.close()
+        viewer.socket = SlowSocket()
+        for frame in range(20):
+            viewer.send_input()
+        expected = netplay.pack_message(netplay.INPUT, b"\0")
+        self.assertEqual(bytes(viewer.socket.sent), expected)
+        self.assertFalse(viewer.outgoing)
+
+class TestDelta(unittest.TestCase):
+    def test_patch_restores_the_state(self):
+        previous = b"\x01\x02\x03\x04\x05"
+        for state in (b"\x01\x02\x07\x04\x05", b"\x09" * 9, b"\x01"):
+            self.assertEqual(
+                netplay.patch(previous, netplay.diff(previous, state)), state
+            )
+
+    def test_broken_delta(self):
+        with self.assertRaises(netplay.ProtocolError):
+            netplay.patch(b"\x01", netplay.DELTA_DATA.pack(1) + b"broken")
+
+if __name__ == '__main__':
+    unittest.main()
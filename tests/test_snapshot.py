@@ -0,0 +1,98 @@
+#PyInvaders2 (c) 2018 by Karsten Lehmann
+
+###############################################################################
+#                                                                             #
+#    This file is a part of PyInvaders2                                       #
+#                                                                             #
+#    PyInvaders2 is free software you can redistribute it and/or modify       #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    any later version.                                                       #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+
+"""
+Tests of the snapshots: a restored game has to continue exactly like the
+game, which the snapshot was taken from
+"""
+
+import os
+import random
+import unittest
+from pyinvaders2 import Game, game_dir
+from pyinvaders2 import analyzer
+from pyinvaders2 import data
+from pyinvaders2 import level_codec
+from pyinvaders2 import snapshot
+
+__author__ = "Karsten Lehmann"
+__copyright__ = "Copyright 2018, Karsten Lehmann"
+__license__ = "GPLv3"
+__version__ = "2.1"
+__maintainer__ = "Karsten Lehmann"
+
+#the aim policy loses this level with this seed
+LEVEL = "0006.txt"
+SEED = 3
+MAX_TICKS = 5000
+#ticks played after the snapshot
+TICKS = 30
+
+def setUpModule():
+    analyzer._init_worker()
+
+def new_game(level_path, seed):
+    """Returns: a Game with the invaders of the level, played by the aim
+                policy"""
+    random.seed(seed)
+    game = Game(level_list=[])
+    policy = analyzer.AimPolicy(random.Random(seed))
+    game.player.controls = lambda: policy(game)
+    game.invaders = data.Formation(
+        data.Invader(position)
+        for position in level_codec.positions(level_codec.read(level_path))
+    )
+    game.level = 1
+    return game
+
+def play(game, ticks):
+    """Returns: a list with a snapshot after each of the ticks"""
+    snapshots = []
+    for tick in range(ticks):
+        game.step()
+        game.render_queue.collect()
+        snapshots.append(snapshot.take(game))
+    return snapshots
+
+class TestSnapshot(unittest.TestCase):
+    def test_game_over(self):
+        game = new_game(os.path.join(game_dir, "levels", LEVEL), SEED)
+        for tick in range(MAX_TICKS):
+            if game.live_bar.lives < 0:
+                break
+            play(game, 1)
+        #hits after the game over deduct below zero
+        self.assertTrue(game.game_over)
+        self.assertEqual(game.live_bar.lives, -1)
+        #the policy keeps its own random numbers, it must not play on
+        game.player.controls = analyzer.PressedKeys
+        taken = snapshot.take(game)
+        expected = play(game, TICKS)
+        snapshot.restore(game, taken)
+        self.assertEqual(snapshot.take(game), taken)
+        self.assertEqual(play(game, TICKS), expected)
+        self.assertEqual(game.live_bar.lives, -1)
+
+    def test_wrong_data(self):
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.restore(None, b"PIS")
+
+if __name__ == '__main__':
+    unittest.main()